@@ -0,0 +1,699 @@
+#!/usr/bin/env python3
+
+"""
+성능 측정용 스크립트
+
+usage: benchmark.py parse [--file FILE] [--compile-commands JSON] [--repeat N]
+       benchmark.py lsp [--requests N] [--payload-bytes N]
+       benchmark.py callgraph [--functions N] [--fanout N]
+       benchmark.py traverse [--file FILE] [--repeat N]
+       benchmark.py shared-headers [--tus N] [--repeat N]
+       benchmark.py callgraph-file [--functions N] [--fanout N]
+       benchmark.py callgraph-server [--functions N] [--fanout N] [--queries N]
+"""
+
+import argparse
+import asyncio
+import http.client
+import importlib.util
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from collections import defaultdict, namedtuple
+from urllib.parse import quote
+
+# 헤더가 무거운 C++ TU를 만들 때 include할 표준 헤더들
+HEAVY_HEADERS = [
+    'algorithm', 'functional', 'iostream', 'map', 'memory', 'regex',
+    'sstream', 'string', 'unordered_map', 'vector',
+]
+
+HEAVY_BODY = '''
+namespace bench {
+
+int lookup(const std::map<std::string, int> &m, const std::string &key) {
+    auto it = m.find(key);
+    auto twice = [](int v) {
+        return v * 2;
+    };
+    return it == m.end() ? 0 : twice(it->second);
+}
+
+struct Parser {
+    std::vector<std::string> split(const std::string &s) const;
+    int count() const { return 0; }
+};
+
+std::vector<std::string> Parser::split(const std::string &s) const {
+    std::vector<std::string> out;
+    std::istringstream in(s);
+    for (std::string w; in >> w;)
+        out.push_back(w);
+    return out;
+}
+
+}
+'''
+
+
+def write_heavy_tu(dirname):
+    path = os.path.join(dirname, 'heavy.cpp')
+    with open(path, 'w') as f:
+        for header in HEAVY_HEADERS:
+            f.write(f'#include <{header}>\n')
+        f.write(HEAVY_BODY)
+    return path
+
+
+def measure(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def bench_parse(args):
+    import buildutil as bu
+    from clang.cindex import Index
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        file_path = args.file or write_heavy_tu(tmpdir)
+        file_path = os.path.abspath(file_path)
+
+        flags = ['-std=c++17']
+        if args.compile_commands:
+            flags = bu.CompileDatabase(args.compile_commands).args(file_path)
+
+        print(f'File: {file_path}')
+        print(f'Flags: {" ".join(flags)}')
+        print(f'{"mode":<12} {"median ms":>10} {"min ms":>10} '
+              f'{"speedup":>8}  extents')
+
+        baseline = None
+        full_extents = None
+        for mode in bu.PARSE_MODES:
+            extents = []
+
+            def parse():
+                tu = bu.parse_for_extents(Index.create(), file_path, flags,
+                                          mode)
+                extents[:] = bu.function_extents(tu.cursor, file_path)
+
+            samples = measure(parse, args.repeat)
+            median = statistics.median(samples)
+            if baseline is None:
+                baseline = median
+                full_extents = list(extents)
+
+            same = 'same' if extents == full_extents else 'DIFFERENT'
+            print(f'{mode:<12} {median * 1000:>10.1f} '
+                  f'{min(samples) * 1000:>10.1f} {baseline / median:>7.1f}x  '
+                  f'{same}')
+
+
+def fake_symbols(payload_bytes):
+    """documentSymbol 응답처럼 생긴, 대략 payload_bytes 크기의 결과"""
+    symbols = []
+    size = 2
+    i = 0
+    while size < payload_bytes:
+        symbol = {
+            "name": f"함수_{i}",
+            "kind": 12,
+            "location": {
+                "uri": "file:///src/파일.c",
+                "range": {"start": {"line": i, "character": 0},
+                          "end": {"line": i + 3, "character": 1}}
+            }
+        }
+        symbols.append(symbol)
+        size += len(json.dumps(symbol, ensure_ascii=False).encode('utf-8'))
+        i += 1
+    return symbols
+
+
+def fake_lsp_server(args):
+    """
+    모든 요청에 같은 크기의 결과로 답하는 가짜 LSP 서버.
+    stdin/stdout으로 통신하며 exit notification을 받으면 끝난다.
+    """
+    import lsputil
+
+    payload = json.dumps(fake_symbols(args.payload_bytes),
+                         ensure_ascii=False).encode('utf-8')
+    reader = lsputil.MessageReader()
+    stdin = sys.stdin.buffer.raw
+    stdout = sys.stdout.buffer
+
+    while True:
+        data = stdin.read(1 << 16)
+        if not data:
+            return
+        reader.feed(data)
+        for message in reader:
+            if message.get('method') == 'exit':
+                return
+            if 'id' not in message:
+                continue
+            body = b'{"jsonrpc":"2.0","id":%d,"result":%s}' % (
+                message['id'], payload)
+            stdout.write(b'Content-Type: application/vscode-jsonrpc; '
+                         b'charset=utf-8\r\n'
+                         b'Content-Length: %d\r\n\r\n' % len(body))
+            stdout.write(body)
+        stdout.flush()
+
+
+def fake_lsp_command(args):
+    return [sys.executable, os.path.abspath(__file__), 'fake-lsp-server',
+            '--payload-bytes', str(args.payload_bytes)]
+
+
+def naive_lsp_round_trips(args):
+    """예전 lsp-example.py 방식: 요청 하나 보내고 readline/read로 응답 읽기"""
+    process = subprocess.Popen(fake_lsp_command(args), stdin=subprocess.PIPE,
+                               stdout=subprocess.PIPE)
+    received = 0
+    for req_id in range(1, args.requests + 1):
+        request_str = json.dumps({"jsonrpc": "2.0", "id": req_id,
+                                  "method": "textDocument/documentSymbol",
+                                  "params": {}})
+        process.stdin.write(
+            f"Content-Length: {len(request_str)}\r\n\r\n".encode('utf-8'))
+        process.stdin.write(request_str.encode('utf-8'))
+        process.stdin.flush()
+
+        # Content-Type이 먼저 오면 예전 코드는 그 줄을 Content-Length로
+        # 잘못 읽으므로, 비교를 위해 Content-Length 줄을 찾을 때까지 읽는다.
+        while True:
+            line = process.stdout.readline().decode('utf-8').strip()
+            if line.startswith('Content-Length'):
+                break
+        content_length = int(line.split(': ')[1])
+        process.stdout.readline()
+        response = json.loads(
+            process.stdout.read(content_length).decode('utf-8'))
+        assert response['id'] == req_id
+        received += content_length
+
+    process.stdin.write(b'Content-Length: 33\r\n\r\n'
+                        b'{"jsonrpc":"2.0","method":"exit"}')
+    process.stdin.close()
+    process.wait()
+    return received
+
+
+async def pipelined_lsp_round_trips(args):
+    """lsputil.LspClient로 모든 요청을 한꺼번에 보내기"""
+    import lsputil
+
+    client = await lsputil.LspClient.spawn(fake_lsp_command(args))
+
+    # 응답을 모두 쥐고 있으면 GC 비용이 측정을 왜곡하므로 길이만 남긴다.
+    async def symbol_count():
+        return len(await client.request("textDocument/documentSymbol", {}))
+
+    results = await asyncio.gather(*(symbol_count()
+                                     for _ in range(args.requests)))
+    await client.notify("exit")
+    client.writer.close()
+    await client.process.wait()
+    await client.reader_task
+    return len(results)
+
+
+def bench_lsp(args):
+    payload = json.dumps(fake_symbols(args.payload_bytes),
+                         ensure_ascii=False).encode('utf-8')
+    total_mb = len(payload) * args.requests / (1024 * 1024)
+    print(f'{args.requests} requests, {len(payload)} bytes per response '
+          f'({total_mb:.1f} MB total)')
+    print(f'{"client":<28} {"seconds":>8} {"MB/s":>8} {"msgs/s":>8}')
+
+    def report(name, seconds):
+        print(f'{name:<28} {seconds:>8.2f} {total_mb / seconds:>8.1f} '
+              f'{args.requests / seconds:>8.0f}')
+
+    start = time.perf_counter()
+    naive_lsp_round_trips(args)
+    report('lock-step readline/read', time.perf_counter() - start)
+
+    start = time.perf_counter()
+    asyncio.run(pipelined_lsp_round_trips(args))
+    report('lsputil pipelined', time.perf_counter() - start)
+
+    # 프로세스 통신을 뺀 framing 계층만의 처리량
+    import lsputil
+    stream = b''.join(
+        lsputil.encode_message({"jsonrpc": "2.0", "id": i,
+                                "result": json.loads(payload)})
+        for i in range(args.requests))
+    reader = lsputil.MessageReader()
+    start = time.perf_counter()
+    count = 0
+    for i in range(0, len(stream), 1 << 16):
+        reader.feed(stream[i:i + (1 << 16)])
+        for _ in reader:
+            count += 1
+    assert count == args.requests
+    report('MessageReader (in memory)', time.perf_counter() - start)
+
+
+def synthetic_edges(functions, fanout):
+    """
+    namespace/class 이름이 붙은 함수들 사이의 call edge. libclang에서 읽을 때처럼
+    edge마다 이름 문자열을 새로 만든다.
+    """
+    def names(i):
+        qualified = f'ns{i % 7}::Class{i % 97}::method{i}'
+        return qualified, qualified + '(int, const std::string &)'
+
+    for caller in range(functions):
+        caller_pretty = names(caller)[1]
+        for k in range(fanout):
+            callee = (caller * 31 + k * 17 + 1) % functions
+            qualified, pretty = names(callee)
+            yield caller_pretty, (qualified, pretty, callee % 5 == 0, False)
+
+
+def bench_callgraph(args):
+    import callgraphutil
+
+    Callee = namedtuple('Callee',
+                        ['qualified', 'pretty', 'is_virtual', 'is_pure_virtual'])
+
+    def legacy():
+        graph = defaultdict(list)
+        for caller, callee in synthetic_edges(args.functions, args.fanout):
+            graph[caller].append(Callee(*callee))
+        return graph
+
+    def interned():
+        graph = callgraphutil.CallGraph()
+        for caller, callee in synthetic_edges(args.functions, args.fanout):
+            graph.add_edge(caller, callee)
+        return graph
+
+    print(f'{args.functions} functions, {args.functions * args.fanout} edges')
+    print(f'{"graph":<28} {"build s":>8} {"MB":>8}')
+    for name, build in (('list of Callee per caller', legacy),
+                        ('callgraphutil.CallGraph', interned)):
+        tracemalloc.start()
+        start = time.perf_counter()
+        graph = build()
+        seconds = time.perf_counter() - start
+        size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        print(f'{name:<28} {seconds:>8.2f} {size / (1024 * 1024):>8.1f}')
+
+    root = graph.pretty[0]
+    start = time.perf_counter()
+    steps = graph.walk(root, max_depth=args.functions)
+    print(f'walk from {root}: {len(steps)} steps in '
+          f'{(time.perf_counter() - start) * 1000:.1f} ms')
+
+    # "matching:" fallback: 예전처럼 전체를 훑는 것과 정렬된 색인
+    for symbol, pretty in enumerate(graph.pretty):
+        graph.add_name(graph.qualified[symbol], pretty)
+    prefixes = [f'ns{i % 7}::Class{i % 97}::method{i}' for i in range(0, 97)]
+    start = time.perf_counter()
+    for prefix in prefixes:
+        [pretty for qualified, pretty in graph.fullnames()
+         if qualified.startswith(prefix)]
+    scan = (time.perf_counter() - start) / len(prefixes)
+    start = time.perf_counter()
+    graph.qualified_index()
+    index_build = time.perf_counter() - start
+    start = time.perf_counter()
+    for prefix in prefixes:
+        graph.matching(prefix)
+    indexed = (time.perf_counter() - start) / len(prefixes)
+    print(f'matching: scan {scan * 1000:.2f} ms, sorted index '
+          f'{indexed * 1000:.3f} ms per prefix '
+          f'(index built in {index_build * 1000:.1f} ms)')
+
+    start = time.perf_counter()
+    graph.callers_of()
+    print(f'callers index: {(time.perf_counter() - start) * 1000:.1f} ms')
+    roots = graph.pretty[::max(1, len(graph) // 1000)]
+    samples = []
+    found = 0
+    for root in roots:
+        start = time.perf_counter()
+        found += len(graph.callers_within(root))
+        samples.append(time.perf_counter() - start)
+    print(f'callers_within() for {len(roots)} functions: '
+          f'median {statistics.median(samples) * 1000:.3f} ms, '
+          f'max {max(samples) * 1000:.3f} ms, '
+          f'{found / len(roots):.0f} callers on average')
+
+
+def load_callgraph_module():
+    """이름에 '-'가 있어서 import 문으로 읽을 수 없는 libclang-callgraph.py"""
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        'libclang-callgraph.py')
+    spec = importlib.util.spec_from_file_location('libclang_callgraph', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def bench_traverse(args):
+    cg = load_callgraph_module()
+    from clang.cindex import CursorKind, Index
+
+    class UncachedNames:
+        """NameResolver 이전처럼 cursor마다 semantic_parent를 따라 올라간다."""
+        def scope(self, c):
+            if c is None or c.kind == CursorKind.TRANSLATION_UNIT:
+                return ''
+            parent = self.scope(c.semantic_parent)
+            return parent + '::' + c.spelling if parent else c.spelling
+
+        def names(self, c):
+            if c is None:
+                return '', ''
+            parent = self.scope(c.semantic_parent)
+            if parent:
+                return (parent + '::' + c.spelling,
+                        parent + '::' + c.displayname)
+            return c.spelling, c.displayname
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        file_path = os.path.abspath(args.file or write_heavy_tu(tmpdir))
+        tu = Index.create().parse(file_path, ['-std=c++17'])
+
+    # 시스템 헤더도 제외하지 않아야 헤더가 많은 프로젝트와 비슷해진다.
+    print(f'File: {file_path} (no excluded paths)')
+    print(f'{"names":<28} {"median ms":>10} {"min ms":>10} {"edges":>8}')
+    baseline = None
+    for name, make in (('uncached', UncachedNames),
+                       ('NameResolver', cg.NameResolver)):
+        edges = []
+        names = []
+
+        def traverse():
+            cg.NAMES = make()
+            edges[:] = []
+            names[:] = []
+            cg.show_info(tu.cursor, [], [], edges, names)
+
+        samples = measure(traverse, args.repeat)
+        median = statistics.median(samples)
+        print(f'{name:<28} {median * 1000:>10.1f} {min(samples) * 1000:>10.1f} '
+              f'{len(edges):>8}')
+        result = (edges, [n[:2] for n in names])
+        if baseline is None:
+            baseline = result
+        elif result != baseline:
+            print('  names differ from uncached traversal!')
+
+    # 같은 순회에서 가상 함수/함수 포인터 정보까지 모으는 비용
+    dispatch = cg.new_dispatch()
+
+    def traverse_dispatch():
+        cg.NAMES = cg.NameResolver()
+        for values in dispatch.values():
+            values[:] = []
+        cg.show_info(tu.cursor, [], [], [], [], dispatch=dispatch)
+
+    samples = measure(traverse_dispatch, args.repeat)
+    print(f'{"NameResolver + dispatch":<28} '
+          f'{statistics.median(samples) * 1000:>10.1f} '
+          f'{min(samples) * 1000:>10.1f} '
+          f'{sum(map(len, dispatch.values())):>8}')
+
+    # traversal 중 이름을 만드는 부분만 따로 잰다.
+    cursors = []
+    for node in tu.cursor.walk_preorder():
+        if node.kind in (CursorKind.FUNCTION_DECL, CursorKind.CXX_METHOD,
+                         CursorKind.FUNCTION_TEMPLATE):
+            cursors.append(node)
+        elif node.kind == CursorKind.CALL_EXPR and node.referenced:
+            cursors.append(node.referenced)
+    print(f'{len(cursors)} function and callee cursors, names only:')
+    for name, make in (('uncached', UncachedNames),
+                       ('NameResolver', cg.NameResolver)):
+        def resolve():
+            resolver = make()
+            for c in cursors:
+                resolver.names(c)
+
+        samples = measure(resolve, args.repeat)
+        print(f'{name:<28} {statistics.median(samples) * 1000:>10.1f} '
+              f'{min(samples) * 1000:>10.1f}')
+
+
+def bench_shared_headers(args):
+    cg = load_callgraph_module()
+    import callgraphutil
+    from clang.cindex import Index
+
+    # 같은 헤더들을 include하고 body만 조금씩 다른 TU들
+    index = Index.create()
+    tus = []
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for i in range(args.tus):
+            path = os.path.join(tmpdir, f'tu{i}.cpp')
+            with open(path, 'w') as f:
+                for header in HEAVY_HEADERS:
+                    f.write(f'#include <{header}>\n')
+                f.write(HEAVY_BODY.replace('namespace bench',
+                                           f'namespace bench{i}'))
+            tus.append(index.parse(path, ['-std=c++17']))
+
+    print(f'{args.tus} TUs including {len(HEAVY_HEADERS)} standard headers')
+    print(f'{"header definitions":<28} {"median ms":>10} {"edges":>8} '
+          f'{"graph":>8}')
+    for name, shared in (('walked in every TU', False),
+                         ('walked once', True)):
+        graph = callgraphutil.CallGraph()
+        edges = []
+
+        def traverse():
+            cg.NAMES = cg.NameResolver()
+            visited = set()
+            edges[:] = []
+            for tu in tus:
+                show_edges = []
+                cg.show_info(tu.cursor, [], [], show_edges, [],
+                             visited=visited if shared else set())
+                edges.extend(show_edges)
+
+        samples = measure(traverse, args.repeat)
+        counts = defaultdict(int)
+        for caller, callee, _, kind in edges:
+            counts[caller, callee, kind] += 1
+        for (caller, callee, kind), count in counts.items():
+            graph.add_edge(caller, callee, count, kind)
+        print(f'{name:<28} {statistics.median(samples) * 1000:>10.1f} '
+              f'{len(edges):>8} {graph.edge_count():>8}')
+
+
+def rss_kb():
+    """현재 process의 resident set size (KB, Linux)"""
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1])
+    return 0
+
+
+def synthetic_named_graph(functions, fanout):
+    import callgraphutil
+
+    graph = callgraphutil.CallGraph()
+    for caller, callee in synthetic_edges(functions, fanout):
+        graph.add_edge(caller, callee)
+    for symbol, pretty in enumerate(graph.pretty):
+        graph.add_name(graph.qualified[symbol], pretty, f'c:@F@f{symbol}#',
+                       f'/src/file{symbol % 500}.cpp:{symbol}')
+    return graph
+
+
+def bench_callgraph_file(args):
+    import callgraphfile
+
+    graph = synthetic_named_graph(args.functions, args.fanout)
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, 'callgraph' + callgraphfile.EXTENSION)
+        start = time.perf_counter()
+        callgraphfile.write(graph, path)
+        print(f'{len(graph)} functions, {graph.edge_count()} edges: wrote '
+              f'{os.path.getsize(path) / (1024 * 1024):.1f} MB in '
+              f'{time.perf_counter() - start:.2f} s')
+        # 이미 만든 그래프가 RSS에 섞이지 않게 새 process에서 연다.
+        subprocess.run([sys.executable, os.path.abspath(__file__),
+                        'open-callgraph-file', path], check=True)
+
+
+def open_callgraph_file(args):
+    import callgraphfile
+
+    before = rss_kb()
+    start = time.perf_counter()
+    graph = callgraphfile.MappedCallGraph(args.path)
+    opened = time.perf_counter() - start
+    print(f'open: {opened * 1000:.2f} ms, '
+          f'RSS +{(rss_kb() - before) / 1024:.1f} MB')
+
+    roots = [graph.pretty[symbol]
+             for symbol in range(0, len(graph), max(1, len(graph) // 1000))]
+    for name, query in (('callees', graph.callees),
+                        ('callers_within', graph.callers_within),
+                        ('lookup', lambda pretty: graph.lookup(
+                            pretty.split('(')[0].rsplit('::', 1)[-1]))):
+        samples = []
+        for root in roots:
+            start = time.perf_counter()
+            query(root)
+            samples.append(time.perf_counter() - start)
+        print(f'{name:<16} median {statistics.median(samples) * 1000:.3f} ms, '
+              f'max {max(samples) * 1000:.3f} ms')
+    print(f'after {len(roots) * 3} queries: '
+          f'RSS +{(rss_kb() - before) / 1024:.1f} MB')
+
+
+def bench_callgraph_server(args):
+    import callgraphfile
+
+    graph = synthetic_named_graph(args.functions, args.fanout)
+    roots = [graph.pretty[symbol]
+             for symbol in range(0, len(graph), max(1, len(graph) // 200))]
+    queries = {
+        'callees': [f'/callees?name={quote(root)}' for root in roots],
+        'callers': [f'/callers?name={quote(root)}' for root in roots],
+        'path': [f'/path?from={quote(root)}&to={quote(roots[-1 - i])}&depth=6'
+                 for i, root in enumerate(roots)],
+        'lookup': [f"/lookup?name={root.split('(')[0].rsplit('::', 1)[-1]}"
+                   for root in roots],
+    }
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, 'callgraph' + callgraphfile.EXTENSION)
+        callgraphfile.write(graph, path)
+        print(f'{len(graph)} functions, {graph.edge_count()} edges')
+        del graph
+
+        server = subprocess.Popen(
+            [sys.executable,
+             os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                          'callgraph-server.py'),
+             '--graph', path, '--port', '0'],
+            stderr=subprocess.PIPE, text=True)
+        try:
+            for line in server.stderr:
+                if 'listening on' in line:
+                    break
+            host, port = line.split('//')[1].rstrip('/\n').split(':')
+            conn = http.client.HTTPConnection(host, int(port))
+
+            def get(url):
+                conn.request('GET', url)
+                return conn.getresponse().read()
+
+            for name, urls in queries.items():
+                samples = []
+                for i in range(args.queries):
+                    start = time.perf_counter()
+                    get(urls[i % len(urls)])
+                    samples.append(time.perf_counter() - start)
+                samples.sort()
+                print(f'{name:<8} p50 '
+                      f'{samples[len(samples) // 2] * 1000:.3f} ms, p99 '
+                      f'{samples[int(len(samples) * 0.99)] * 1000:.3f} ms '
+                      f'(round trip)')
+
+            latency = json.loads(get('/metrics'))['latency']
+            print(f"server   p50 {latency['p50_ms']:.3f} ms, p99 "
+                  f"{latency['p99_ms']:.3f} ms over {latency['queries']} "
+                  f"queries")
+            conn.close()
+        finally:
+            server.terminate()
+            server.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    parse_parser = subparsers.add_parser(
+        'parse', help='Parse time of each buildutil.PARSE_MODES')
+    parse_parser.add_argument(
+        '--file',
+        help='C/C++ file to parse (default: generated header-heavy C++ TU)')
+    parse_parser.add_argument(
+        '--compile-commands',
+        help='Path to compile_commands.json for the flags of --file')
+    parse_parser.add_argument('--repeat', type=int, default=5)
+    parse_parser.set_defaults(func=bench_parse)
+
+    lsp_parser = subparsers.add_parser(
+        'lsp', help='LSP framing throughput against a local fake LSP server')
+    lsp_parser.add_argument('--requests', type=int, default=200)
+    lsp_parser.add_argument('--payload-bytes', type=int, default=1 << 20)
+    lsp_parser.set_defaults(func=bench_lsp)
+
+    callgraph_parser = subparsers.add_parser(
+        'callgraph', help='Memory of the callgraph representation')
+    callgraph_parser.add_argument('--functions', type=int, default=20000)
+    callgraph_parser.add_argument('--fanout', type=int, default=20)
+    callgraph_parser.set_defaults(func=bench_callgraph)
+
+    traverse_parser = subparsers.add_parser(
+        'traverse', help='Callgraph traversal time of one TU with and '
+                         'without the qualified name cache')
+    traverse_parser.add_argument(
+        '--file',
+        help='C/C++ file to traverse (default: generated header-heavy C++ TU)')
+    traverse_parser.add_argument('--repeat', type=int, default=5)
+    traverse_parser.set_defaults(func=bench_traverse)
+
+    shared_parser = subparsers.add_parser(
+        'shared-headers', help='Callgraph traversal time of TUs sharing '
+                               'headers with and without skipping visited '
+                               'header definitions')
+    shared_parser.add_argument('--tus', type=int, default=8)
+    shared_parser.add_argument('--repeat', type=int, default=3)
+    shared_parser.set_defaults(func=bench_shared_headers)
+
+    file_parser = subparsers.add_parser(
+        'callgraph-file', help='Write time, open time and RSS of the '
+                               'mmap callgraph file')
+    file_parser.add_argument('--functions', type=int, default=50000)
+    file_parser.add_argument('--fanout', type=int, default=20)
+    file_parser.set_defaults(func=bench_callgraph_file)
+
+    callgraph_server_parser = subparsers.add_parser(
+        'callgraph-server', help='Query latency of callgraph-server.py on a '
+                                 'synthetic callgraph file')
+    callgraph_server_parser.add_argument('--functions', type=int,
+                                         default=50000)
+    callgraph_server_parser.add_argument('--fanout', type=int, default=20)
+    callgraph_server_parser.add_argument('--queries', type=int, default=2000)
+    callgraph_server_parser.set_defaults(func=bench_callgraph_server)
+
+    open_parser = subparsers.add_parser('open-callgraph-file')
+    open_parser.add_argument('path')
+    open_parser.set_defaults(func=open_callgraph_file)
+
+    server_parser = subparsers.add_parser('fake-lsp-server')
+    server_parser.add_argument('--payload-bytes', type=int, default=1 << 20)
+    server_parser.set_defaults(func=fake_lsp_server)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
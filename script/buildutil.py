@@ -1,6 +1,7 @@
+import bisect
 import json
-import re
 import os
+import shlex
 import sys
 import platform
 
@@ -14,7 +15,9 @@ python_clang_package_dir = config.get('python_clang_package_dir')
 if python_clang_package_dir is not None:
     sys.path.append(python_clang_package_dir)
 
-from clang.cindex import CursorKind, Config
+from clang.cindex import CursorKind, Config, TranslationUnit
+
+from intervalutil import IntervalIndex
 
 libclang_dir = config.get('libclang_dir')
 
@@ -22,6 +25,37 @@ if libclang_dir is not None:
     Config.set_library_path(libclang_dir)
 
 
+# TranslationUnit에 상수가 정의되어 있지 않은 parse option (clang-c/Index.h)
+PARSE_CREATE_PREAMBLE_ON_FIRST_PARSE = 0x100
+PARSE_KEEP_GOING = 0x200
+PARSE_SINGLE_FILE_PARSE = 0x400
+PARSE_LIMIT_SKIP_FUNCTION_BODIES_TO_PREAMBLE = 0x800
+
+# 함수 범위를 찾기 위한 parse mode -> index.parse()의 options
+#  full:        기존과 같은 전체 semantic parse
+#  extents:     include된 헤더(preamble)의 함수 body는 건너뛰고 main file은
+#               전부 파싱한다. 함수 범위는 full과 같다.
+#  single-file: #include를 따라가지 않고 main file만 파싱한다. 가장 빠르지만
+#               헤더에 정의된 매크로로 만든 선언은 놓칠 수 있다.
+PARSE_MODES = {
+    'full': TranslationUnit.PARSE_NONE,
+    'extents': TranslationUnit.PARSE_INCOMPLETE |
+               TranslationUnit.PARSE_SKIP_FUNCTION_BODIES |
+               PARSE_LIMIT_SKIP_FUNCTION_BODIES_TO_PREAMBLE |
+               TranslationUnit.PARSE_PRECOMPILED_PREAMBLE |
+               PARSE_CREATE_PREAMBLE_ON_FIRST_PARSE,
+    'single-file': TranslationUnit.PARSE_INCOMPLETE |
+                   PARSE_SINGLE_FILE_PARSE |
+                   PARSE_KEEP_GOING,
+}
+
+# #include를 따라가므로 tu.get_includes()가 include 목록을 알려 주는 mode
+INCLUDE_PARSE_MODES = ('full', 'extents')
+
+def parse_for_extents(index, file_path, args, mode='full'):
+    """PARSE_MODES의 mode로 file_path를 파싱한다."""
+    return index.parse(file_path, args, options=PARSE_MODES[mode])
+
 def read_compile_commands(filename):
     if filename.endswith('.json'):
         with open(filename) as compdb:
@@ -29,73 +63,306 @@ def read_compile_commands(filename):
     else:
         return [{'command': '', 'file': filename}]
 
-# read_compile_commands의 리턴 값을 받아서 file이 키인 hash로 변환
-def compile_commands_by_file(filename):
-    compile_commands = read_compile_commands(filename)
-    return {cmd['file']: cmd for cmd in compile_commands}
-
-def extract_args(command):
-    # 공백으로 문자열 분리
-    parts = command.split()
-    
-    # 정규 표현식 패턴 정의
-    pattern = re.compile(r'^-I|-D|-isysroot|-isystem|-std=')
-    
-    # 패턴에 맞는 인자 추출
+# libclang 파싱에 필요한 인자. 값은 붙여 쓰거나(-Ifoo) 다음 인자로 온다.
+ARG_FLAGS = ('-I', '-D', '-U', '-isystem', '-isysroot', '-iquote',
+             '-idirafter')
+# 값이 항상 다음 인자로 오는 것 (-include-pch 등과 헷갈리지 않도록)
+ARG_SEPARATE_FLAGS = ('-include',)
+# 값이 경로여서 directory 기준으로 바꿔야 하는 것
+ARG_PATH_FLAGS = ('-I', '-isystem', '-isysroot', '-iquote', '-idirafter',
+                  '-include')
+
+def extract_args(command, directory=None):
+    """
+    command(문자열) 또는 arguments(리스트)에서 libclang 파싱에 필요한
+    인자만 뽑는다. 문자열은 shell 규칙(shlex)으로 나누므로 따옴표 안의
+    공백이 보존된다. directory가 주어지면 상대 경로 include를 절대 경로로
+    바꾼다.
+    """
+    if isinstance(command, str):
+        parts = shlex.split(command)
+    else:
+        parts = list(command)
+
     extracted_args = []
     i = 0
     while i < len(parts):
-        if pattern.match(parts[i]):
-            extracted_args.append(parts[i])
-            # -sysroot와 -system는 다음 인자도 포함해야 함
-            if (parts[i] == '-isysroot' or parts[i] == '-isystem') and i + 1 < len(parts):
-                extracted_args.append(parts[i + 1])
-                i += 1
+        part = parts[i]
         i += 1
-    
+        if part.startswith('-std='):
+            extracted_args.append(part)
+            continue
+
+        if part in ARG_SEPARATE_FLAGS:
+            flag = part
+        else:
+            flag = next((f for f in ARG_FLAGS if part.startswith(f)), None)
+            if flag is None:
+                continue
+
+        value = part[len(flag):]
+        if not value:
+            if i >= len(parts):
+                break
+            value = parts[i]
+            i += 1
+
+        if directory and flag in ARG_PATH_FLAGS and \
+                not os.path.isabs(value):
+            value = os.path.normpath(os.path.join(directory, value))
+
+        # -I, -D, -U는 붙여 쓰고 나머지는 기존처럼 두 인자로 둔다.
+        if flag in ('-I', '-D', '-U'):
+            extracted_args.append(flag + value)
+        else:
+            extracted_args.extend((flag, value))
+
     return extracted_args
 
-def find_functions_at_lines(cursor, file_path, line_numbers, result):
-    """주어진 커서에서 해당 파일의 여러 라인 번호가 속한 함수명을 찾음"""
-    if cursor.location.file and cursor.location.file.name == file_path:
-        start_line = cursor.extent.start.line
-        end_line = cursor.extent.end.line
-        
-        # 커서가 함수 선언인 경우, 해당 함수가 line_numbers 중 어느 라인에 속하는지 확인
-        if cursor.kind == CursorKind.FUNCTION_DECL:
-            # 함수 범위 내에 있는 라인 번호에 대해 함수 이름을 기록
-            for line_no in line_numbers.copy():  # set은 반복 중 제거를 위해 copy 필요
-                if start_line <= line_no <= end_line:
-                    result[start_line] = cursor.spelling
-                    line_numbers.remove(line_no)  # 처리된 라인은 제거
-        elif cursor.kind == CursorKind.CXX_METHOD:
-            for line_no in line_numbers.copy():
-                if start_line <= line_no <= end_line:
-                    result[start_line] = cursor.spelling
-                    line_numbers.remove(line_no)
-
-    # 모든 자식 커서 순회
-    for child in cursor.get_children():
-        if not line_numbers:  # 모든 라인이 처리되면 더 이상 순회할 필요 없음
-            break
-        find_functions_at_lines(child, file_path, line_numbers, result)
+def command_args(cmd):
+    """compile_commands.json 항목 하나의 libclang 인자"""
+    command = cmd['arguments'] if 'arguments' in cmd else cmd['command']
+    return extract_args(command, cmd.get('directory'))
 
-def find_functions_in_file(tu, file_path, line_numbers):
+SOURCE_EXTENSIONS = ('.c', '.cc', '.cpp', '.cxx', '.c++', '.m', '.mm')
 
-    # 결과를 저장할 딕셔너리 (라인 번호 -> 함수 이름)
-    result = {}
+def iter_json_array(f, chunk_size=1024 * 1024):
+    """
+    최상위가 배열인 JSON 파일의 원소를 하나씩 돌려준다.
+
+    파일 전체를 한 번에 읽지 않으므로 100MB가 넘는 compile database도
+    chunk_size 정도의 버퍼만 쓴다.
+    """
+    decoder = json.JSONDecoder()
+    buf = ''
+    pos = 0
+    eof = False
+    started = False
+
+    while True:
+        # 공백과 구분자(',')를 건너뛴다.
+        while True:
+            while pos < len(buf) and buf[pos] in ' \t\r\n,':
+                pos += 1
+            if pos < len(buf) or eof:
+                break
+            buf = f.read(chunk_size)
+            pos = 0
+            eof = not buf
+
+        if pos >= len(buf):
+            raise ValueError('unexpected end of JSON array')
+        if not started:
+            if buf[pos] != '[':
+                raise ValueError('compile database must be a JSON array')
+            started = True
+            pos += 1
+            continue
+        if buf[pos] == ']':
+            return
+
+        try:
+            value, end = decoder.raw_decode(buf, pos)
+        except json.JSONDecodeError:
+            # 원소가 chunk 경계에 걸렸으면 더 읽어서 다시 시도한다.
+            if eof:
+                raise
+            chunk = f.read(chunk_size)
+            eof = not chunk
+            buf = buf[pos:] + chunk
+            pos = 0
+            continue
+        yield value
+        pos = end
+
+class CompileDatabase:
+    """
+    compile_commands.json 색인.
+
+    처음 찾을 때 파일을 streaming으로 읽고, 항목은 directory 기준으로 푼
+    실제 경로(realpath)로 찾는다. 심볼릭 링크나 상대 경로로 적힌 항목도
+    같은 파일이면 찾을 수 있다. 파싱한 인자는 파일별로 기억해 둔다.
+
+    compile database에 없는 파일(헤더 등)은 가장 가까운 TU의 인자를 쓴다.
+    같은 디렉터리에서 이름이 같은 소스(util.h -> util.cpp)가 먼저이고,
+    없으면 경로가 가장 길게 겹치는 TU를 쓴다.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self._entries = None  # realpath -> compile command
+        self._paths = None    # 정렬한 realpath 목록 (nearest TU 검색용)
+        self._args = {}
+        self._nearest = {}
+
+    def _load(self):
+        if self._entries is not None:
+            return self._entries
+
+        entries = {}
+        if self.filename.endswith('.json'):
+            # 항목들은 대개 디렉터리를 공유하므로 디렉터리의 realpath를
+            # 기억해 두고 파일 자체가 링크일 때만 다시 푼다.
+            dirs = {}
+            with open(self.filename, 'r') as f:
+                for cmd in iter_json_array(f):
+                    path = os.path.join(cmd.get('directory', ''), cmd['file'])
+                    head, tail = os.path.split(path)
+                    real_dir = dirs.get(head)
+                    if real_dir is None:
+                        real_dir = dirs[head] = os.path.realpath(head)
+                    path = os.path.join(real_dir, tail)
+                    if os.path.islink(path):
+                        path = os.path.realpath(path)
+                    # 같은 파일이 여러 번 나오면 처음 것을 쓴다.
+                    entries.setdefault(path, cmd)
+        else:
+            entries[os.path.realpath(self.filename)] = \
+                {'command': '', 'file': self.filename}
+
+        self._entries = entries
+        return entries
 
-    # Translation Unit에서 root cursor 가져옴
-    root_cursor = tu.cursor
+    def __len__(self):
+        return len(self._load())
 
-    # root cursor부터 시작하여 한 번만 순회
-    find_functions_at_lines(root_cursor, file_path, line_numbers, result)
+    def __iter__(self):
+        """(realpath, compile command)"""
+        return iter(self._load().items())
+
+    def __contains__(self, path):
+        return os.path.realpath(path) in self._load()
+
+    def __getitem__(self, path):
+        return self._load()[os.path.realpath(path)]
+
+    def get(self, path, default=None):
+        return self._load().get(os.path.realpath(path), default)
+
+    def nearest(self, path):
+        """path의 TU 경로. 없으면 인자를 빌려 쓸 가장 가까운 TU, 그것도 없으면 None"""
+        path = os.path.realpath(path)
+        entries = self._load()
+        if path in entries:
+            return path
+        if path in self._nearest:
+            return self._nearest[path]
+
+        stem = os.path.splitext(path)[0]
+        found = next((stem + ext for ext in SOURCE_EXTENSIONS
+                      if stem + ext in entries), None)
+        if found is None and entries:
+            if self._paths is None:
+                self._paths = sorted(entries)
+            # 정렬된 목록에서 바로 이웃한 경로가 가장 길게 겹친다.
+            i = bisect.bisect_left(self._paths, path)
+            neighbours = self._paths[max(i - 1, 0):i + 1]
+            found = max(neighbours, key=lambda p: len(
+                os.path.commonprefix([p, path])))
+
+        self._nearest[path] = found
+        return found
+
+    def args(self, path):
+        """path를 libclang으로 파싱할 인자. 찾을 수 없으면 KeyError"""
+        path = os.path.realpath(path)
+        if path in self._args:
+            return self._args[path]
+
+        tu_path = self.nearest(path)
+        if tu_path is None:
+            raise KeyError(path)
+        args = command_args(self._entries[tu_path])
+        if tu_path != path and not path.endswith(SOURCE_EXTENSIONS):
+            # 헤더는 빌려 온 TU의 언어로 파싱한다.
+            language = 'c-header' if tu_path.endswith('.c') else 'c++-header'
+            args = ['-x', language] + args
+
+        self._args[path] = args
+        return args
+
+# 변경된 라인이 속한 함수로 보고할 커서 종류.
+# Lambda는 이름이 없으므로 감싸고 있는 함수로 보고한다.
+FUNCTION_KINDS = {
+    CursorKind.FUNCTION_DECL,
+    CursorKind.CXX_METHOD,
+    CursorKind.CONSTRUCTOR,
+    CursorKind.DESTRUCTOR,
+    CursorKind.CONVERSION_FUNCTION,
+    CursorKind.FUNCTION_TEMPLATE,
+}
+
+# function_extents()의 결과 형식이나 의미가 바뀌면 올려서 캐시를 무효화한다.
+FUNCTION_EXTENTS_VERSION = 2
+
+def function_extents(cursor, file_path):
+    """
+    주어진 커서 아래에서 file_path에 정의된 함수/메소드의 범위를 모두 찾음
+
+    file_path 밖(헤더 등)에 있는 커서는 하위 트리까지 건너뛰므로 TU 전체가
+    아니라 main file의 AST만 한 번 순회한다.
+
+    Returns:
+        list: (함수 이름, CursorKind 이름, 시작 라인, 끝 라인)의 리스트.
+              순회 순서(바깥 함수가 먼저)를 유지한다.
+    """
+    extents = []
+    stack = [cursor]
+    while stack:
+        node = stack.pop()
+        if node.kind in FUNCTION_KINDS:
+            extents.append((node.spelling, node.kind.name,
+                            node.extent.start.line, node.extent.end.line))
+
+        children = [
+            child for child in node.get_children()
+            if child.location.file and child.location.file.name == file_path
+        ]
+        # stack이므로 역순으로 넣어야 원래 순서대로 방문한다.
+        stack.extend(reversed(children))
+
+    return extents
+
+def functions_at_lines(extents, file_path, line_numbers):
+    """function_extents()의 결과에서 각 라인 번호가 속한 함수명을 찾음"""
+
+    index = IntervalIndex(extents)
+
+    # 결과를 저장할 딕셔너리 (함수 시작 라인 번호 -> 함수 이름)
+    result = {}
+    not_found = []
+
+    for line_no in line_numbers:
+        extent = index.lookup(line_no)
+        if extent is None:
+            not_found.append(line_no)
+        else:
+            result[extent[2]] = extent[0]
 
     # 결과 리스트 생성
     results = []
     for line_no in sorted(result.keys()):
         results.append((file_path, line_no, result[line_no]))
-    for line_no in sorted(line_numbers):  # 함수가 없는 경우도 포함
+    for line_no in sorted(not_found):  # 함수가 없는 경우도 포함
         results.append((file_path, line_no, "No function found"))
 
     return results
+
+def find_functions_in_file(tu, file_path, line_numbers):
+    extents = function_extents(tu.cursor, file_path)
+    return functions_at_lines(extents, file_path, line_numbers)
+
+def include_names(tu):
+    """TU가 (간접적으로) include하는 파일들의 이름"""
+    return [i.include.name for i in tu.get_includes()]
+
+def included_file_name(tu, path):
+    """
+    TU 안에서 path를 가리키는 파일 이름. 같은 파일이라도 include 경로에
+    따라 이름이 다를 수 있으므로 realpath로 비교한다. 없으면 None.
+    """
+    path = os.path.realpath(path)
+    for name in include_names(tu):
+        if os.path.realpath(name) == path:
+            return name
+    return None
@@ -0,0 +1,128 @@
+# cacheutil.py
+
+import hashlib
+import json
+import os
+import tempfile
+import time
+
+
+def default_cache_dir():
+    """XDG_CACHE_HOME(없으면 ~/.cache) 아래의 lang_server 캐시 디렉터리"""
+    base = os.environ.get('XDG_CACHE_HOME') or \
+        os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'lang_server')
+
+
+def hash_key(*parts):
+    """bytes/str/JSON 값들을 이어 붙여 sha256 hex digest를 만든다."""
+    h = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, str):
+            part = part.encode('utf-8')
+        elif not isinstance(part, bytes):
+            part = json.dumps(part, sort_keys=True).encode('utf-8')
+        # 경계가 모호해지지 않도록 길이를 먼저 넣는다.
+        h.update(str(len(part)).encode('ascii') + b':')
+        h.update(part)
+    return h.hexdigest()
+
+
+class DiskCache:
+    """
+    key -> JSON 값을 디렉터리에 파일 하나씩 저장하는 영속 캐시.
+
+    엔트리 파일의 mtime은 저장한 시각, atime은 마지막으로 읽은 시각으로 쓴다.
+    ttl(초)이 지난 엔트리는 없는 것으로 보고, 전체 크기가 max_bytes를
+    넘으면 가장 오래 쓰지 않은 엔트리부터 지운다.
+    """
+
+    def __init__(self, cache_dir, max_bytes=64 * 1024 * 1024, ttl=None):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key + '.json')
+
+    def _expired(self, st, now):
+        return self.ttl is not None and now - st.st_mtime > self.ttl
+
+    def get(self, key):
+        path = self._path(key)
+        now = time.time()
+        try:
+            st = os.stat(path)
+            if self._expired(st, now):
+                os.remove(path)
+                self.misses += 1
+                return None
+            with open(path, 'r') as f:
+                value = json.load(f)
+        except (OSError, ValueError):
+            self.misses += 1
+            return None
+
+        # LRU: 읽을 때마다 사용 시각(atime)을 갱신. mtime은 TTL 용으로 둔다.
+        try:
+            os.utime(path, (now, st.st_mtime))
+        except OSError:
+            pass
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        # 여러 프로세스가 같은 캐시를 써도 깨진 파일이 보이지 않도록
+        # 임시 파일에 쓴 뒤 rename 한다.
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(value, f)
+            os.replace(tmp_path, self._path(key))
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        self.evict()
+
+    def evict(self):
+        entries = []
+        total = 0
+        now = time.time()
+        with os.scandir(self.cache_dir) as it:
+            for entry in it:
+                if not entry.name.endswith('.json'):
+                    continue
+                try:
+                    st = entry.stat()
+                    if self._expired(st, now):
+                        os.remove(entry.path)
+                        continue
+                except OSError:
+                    continue
+                entries.append((st.st_atime, st.st_size, entry.path))
+                total += st.st_size
+
+        if total <= self.max_bytes:
+            return
+
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0
+        }
@@ -0,0 +1,445 @@
+#!/usr/bin/env python3
+
+"""
+callgraph를 메모리에 들고 질의에 답하는 로컬 HTTP 서버
+
+libclang-callgraph.py는 실행할 때마다 프로젝트를 다시 읽는다. 이 서버는
+그래프를 한 번 만들어 두고, compile_commands.json과 소스/헤더의 mtime을
+주기적으로 확인해서 바뀐 TU만 다시 파싱한 뒤 새 그래프로 바꿔 끼운다.
+TU별 결과는 libclang-callgraph.py --db와 같은 SQLite 저장소에 남으므로
+서버를 다시 띄워도 바뀐 TU만 파싱한다.
+
+    python script/callgraph-server.py --compile-commands build/compile_commands.json
+    curl 'http://127.0.0.1:8100/callers?name=twice(int)'
+
+--graph callgraph.cgraph를 주면 libclang-callgraph.py --export로 만든 파일을
+mmap으로 열어서 답하고, 파일이 바뀌면 다시 연다. --unix-socket PATH를 주면
+TCP 대신 Unix socket에서 듣는다 (curl --unix-socket PATH http://localhost/...).
+
+GET 질의 (모두 JSON):
+    /callees?name=F                       F가 직접 호출하는 함수들
+    /callers?name=F[&depth=3&fanout=16&limit=64]
+                                          F를 (간접적으로) 호출하는 함수들
+    /calls?name=F[&depth=15]              F의 호출 트리 (libclang-callgraph.py
+                                          --batch의 한 줄과 같다)
+    /path?from=A&to=B[&depth=15]          A에서 B까지 가장 짧은 호출 경로
+    /lookup?name=f                        이름이 f인 함수들
+    /matching?prefix=P[&limit=100]        qualified name이 P로 시작하는 함수들
+    /metrics                              그래프 크기, refresh 시간, 질의
+                                          latency histogram
+"""
+
+import argparse
+import bisect
+import importlib.util
+import json
+import os
+import socketserver
+import sys
+import threading
+import time
+import traceback
+
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import callgraphdb
+import callgraphfile
+import callgraphutil
+import includeutil
+
+# 질의 latency histogram의 경계 (ms). 마지막 칸은 그보다 큰 것 전부.
+LATENCY_BUCKETS_MS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100)
+
+# percentile을 계산할 때 쓰는 최근 질의 수
+LATENCY_WINDOW = 10000
+
+
+def load_callgraph_module():
+    """이름에 '-'가 있어서 import 문으로 읽을 수 없는 libclang-callgraph.py"""
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        'libclang-callgraph.py')
+    spec = importlib.util.spec_from_file_location('libclang_callgraph', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def file_mtime(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
+class LatencyHistogram:
+    """질의 처리 시간의 누적 histogram과 최근 LATENCY_WINDOW개의 percentile"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counts = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+        self.recent = deque(maxlen=LATENCY_WINDOW)
+        self.total = 0
+
+    def add(self, seconds):
+        ms = seconds * 1000
+        with self.lock:
+            self.counts[bisect.bisect_left(LATENCY_BUCKETS_MS, ms)] += 1
+            self.recent.append(ms)
+            self.total += 1
+
+    def snapshot(self):
+        with self.lock:
+            counts = list(self.counts)
+            recent = sorted(self.recent)
+            total = self.total
+
+        def percentile(p):
+            if not recent:
+                return 0.0
+            return recent[min(len(recent) - 1, int(len(recent) * p))]
+
+        buckets = {f'le_{bound}': count
+                   for bound, count in zip(LATENCY_BUCKETS_MS, counts)}
+        buckets['inf'] = counts[-1]
+        return {'queries': total, 'buckets_ms': buckets,
+                'p50_ms': percentile(0.50), 'p90_ms': percentile(0.90),
+                'p99_ms': percentile(0.99), 'max_ms': percentile(1.0)}
+
+
+class CallGraphIndex:
+    """
+    서버가 들고 있는 그래프와 그것을 새로 만드는 방법.
+
+    refresh()는 watcher thread에서만 부른다. 새 그래프를 따로 다 만든 뒤
+    self.graph를 바꿔 끼우므로 질의하는 thread는 lock 없이 그때의 그래프를
+    읽는다.
+    """
+
+    def __init__(self, cg, cfg=None, graph_file=None):
+        self.cg = cg
+        self.cfg = cfg
+        self.graph_file = graph_file
+        self.graph = None
+        self.cmds = None
+        self.dependencies = []  # build() 때 저장소에서 읽은 (path, mtime)
+        self.compile_commands_mtime = None
+        self.graph_file_mtime = None
+        self.refreshes = 0
+        self.last_refresh_seconds = None
+        self.last_refresh_at = None
+        self.last_reindexed = 0
+        self.last_error = None
+
+    def stale(self):
+        """
+        다시 만들어야 하면 그 이유, 아니면 None.
+
+        의존 파일 목록과 mtime은 build() 때 한 번 읽어 두므로 poll마다
+        저장소를 열지 않고, 여러 TU가 include하는 헤더도 한 번만 stat 한다.
+        """
+        if self.graph is None:
+            return 'initial load'
+        if self.graph_file is not None:
+            if file_mtime(self.graph_file) != self.graph_file_mtime:
+                return f'{self.graph_file} changed'
+            return None
+        if file_mtime(self.cfg['db']) != self.compile_commands_mtime:
+            return f"{self.cfg['db']} changed"
+        mtimes = {}
+        for path, mtime in self.dependencies:
+            if path not in mtimes:
+                mtimes[path] = callgraphdb.file_mtime(path)
+            if mtimes[path] != mtime:
+                return f'{path} changed'
+        return None
+
+    def refresh(self):
+        """필요하면 그래프를 새로 만들어 바꿔 끼운다. 바꿨으면 True"""
+        reason = self.stale()
+        if reason is None:
+            return False
+
+        print(f'refreshing callgraph: {reason}', file=sys.stderr)
+        start = time.perf_counter()
+        if self.graph_file is not None:
+            self.graph_file_mtime = file_mtime(self.graph_file)
+            graph = callgraphfile.MappedCallGraph(self.graph_file)
+            reindexed = 0
+        else:
+            graph, reindexed = self.build()
+
+        # 질의 중에 만들지 않도록 지연 색인을 미리 만든다.
+        graph.callers_of()
+        graph.qualified_index()
+        graph.lookup('')
+
+        # 이전 그래프(MappedCallGraph면 mmap)는 아직 읽는 질의가 있을 수
+        # 있으므로 닫지 않고 GC에 맡긴다.
+        self.graph = graph
+        self.refreshes += 1
+        self.last_refresh_seconds = time.perf_counter() - start
+        self.last_refresh_at = time.time()
+        self.last_reindexed = reindexed
+        print(f'callgraph ready: {len(graph)} functions, '
+              f'{graph.edge_count()} edges, {reindexed} TUs re-indexed in '
+              f'{self.last_refresh_seconds:.2f} s', file=sys.stderr)
+        return True
+
+    def build(self):
+        cg = self.cg
+        cfg = self.cfg
+        mtime = file_mtime(cfg['db'])
+        if self.cmds is None or mtime != self.compile_commands_mtime:
+            # libclang-callgraph.py와 같이 bu.CompileDatabase로 읽으므로
+            # file은 realpath이고 args는 arguments/directory를 반영한다.
+            self.cmds = cg.read_compile_commands(cfg['db'])
+            self.compile_commands_mtime = mtime
+
+        # plumbing.py가 쓰는 include graph도 analyze_source_files()처럼 갱신한다.
+        include_graph = None
+        if cfg['db'].endswith('.json'):
+            include_graph = includeutil.IncludeGraph(
+                includeutil.include_graph_path(cfg['db']))
+            include_graph.retain(cmd['file'] for cmd in self.cmds)
+        graph = callgraphutil.CallGraph()
+        reindexed = cg.update_callgraph_db(cfg, self.cmds, include_graph,
+                                           graph)
+        if include_graph is not None:
+            include_graph.save()
+
+        db = callgraphdb.CallGraphDB(cfg['callgraph_db'])
+        try:
+            self.dependencies = db.dependencies()
+        finally:
+            db.close()
+        return graph, reindexed
+
+    def watch(self, interval, stop):
+        """stop(threading.Event)이 설정될 때까지 interval초마다 refresh()"""
+        while not stop.wait(interval):
+            try:
+                self.refresh()
+                self.last_error = None
+            except Exception as e:
+                self.last_error = f'{type(e).__name__}: {e}'
+                traceback.print_exc()
+
+    def metrics(self):
+        graph = self.graph
+        return {
+            'functions': len(graph) if graph is not None else 0,
+            'edges': graph.edge_count() if graph is not None else 0,
+            'source': self.graph_file or self.cfg['db'],
+            'refreshes': self.refreshes,
+            'last_refresh_seconds': self.last_refresh_seconds,
+            'last_refresh_at': self.last_refresh_at,
+            'last_reindexed_tus': self.last_reindexed,
+            'last_error': self.last_error,
+        }
+
+
+def int_param(params, name, default):
+    value = params.get(name)
+    return int(value) if value is not None else default
+
+
+def callees_result(graph, params):
+    name = params['name']
+    symbol = graph.ids.get(name)
+    if symbol is None:
+        return {'name': name, 'found': False, 'callees': []}
+    counts = graph.call_counts[symbol]
+    kinds = graph.edge_kinds[symbol]
+    return {'name': name, 'found': True, 'callees': [{
+        'name': graph.pretty[target],
+        'count': counts[i],
+        'kinds': callgraphutil.edge_kind_names(kinds[i]),
+    } for i, target in enumerate(graph.callees_of[symbol])]}
+
+
+def callers_result(graph, params):
+    name = params['name']
+    steps = graph.callers_within(name, int_param(params, 'depth', 3),
+                                 int_param(params, 'fanout', 16),
+                                 int_param(params, 'limit', 64))
+    return {'name': name, 'found': name in graph, 'callers': [{
+        'name': graph.pretty[step.symbol],
+        'distance': step.distance,
+        'via': graph.pretty[step.via],
+    } for step in steps]}
+
+
+def path_result(graph, params):
+    return {'from': params['from'], 'to': params['to'],
+            'path': graph.call_path(params['from'], params['to'],
+                                    int_param(params, 'depth', 15))}
+
+
+def lookup_result(graph, params):
+    return {'name': params['name'], 'functions': graph.lookup(params['name'])}
+
+
+def matching_result(graph, params):
+    return {'prefix': params['prefix'],
+            'functions': graph.matching(params['prefix'],
+                                        int_param(params, 'limit', 100))}
+
+
+class CallGraphHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # 헤더와 본문을 따로 쓰므로 Nagle을 끄지 않으면 keep-alive 연결에서
+    # delayed ACK 때문에 응답마다 40 ms씩 기다린다.
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def send_json(self, status, body):
+        data = json.dumps(body, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        server = self.server
+        url = urlparse(self.path)
+        params = {name: values[-1]
+                  for name, values in parse_qs(url.query).items()}
+        route = url.path.rstrip('/')
+
+        if route == '/metrics':
+            self.send_json(200, dict(server.index.metrics(),
+                                     latency=server.latency.snapshot()))
+            return
+
+        query = server.routes.get(route)
+        if query is None:
+            self.send_json(404, {'error': f'unknown query {url.path}'})
+            return
+        graph = server.index.graph
+        if graph is None:
+            self.send_json(503, {'error': 'callgraph is not loaded yet'})
+            return
+
+        start = time.perf_counter()
+        try:
+            body = query(graph, params)
+        except KeyError as e:
+            self.send_json(400, {'error': f'missing parameter {e}'})
+            return
+        except ValueError as e:
+            self.send_json(400, {'error': str(e)})
+            return
+        server.latency.add(time.perf_counter() - start)
+        self.send_json(200, body)
+
+
+class UnixCallGraphHandler(CallGraphHandler):
+    disable_nagle_algorithm = False
+
+    def address_string(self):
+        # Unix socket에서는 client_address가 빈 문자열이다.
+        return 'unix'
+
+
+class ThreadingUnixHTTPServer(socketserver.ThreadingMixIn,
+                              socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def make_server(index, host='127.0.0.1', port=0, unix_socket=None,
+                verbose=False):
+    """port 0이면 빈 포트를 쓴다. server.server_address로 확인할 수 있다."""
+    if unix_socket is not None:
+        if os.path.exists(unix_socket):
+            os.remove(unix_socket)
+        server = ThreadingUnixHTTPServer(unix_socket, UnixCallGraphHandler)
+    else:
+        server = ThreadingHTTPServer((host, port), CallGraphHandler)
+    server.daemon_threads = True
+    server.verbose = verbose
+    server.index = index
+    server.latency = LatencyHistogram()
+    server.routes = {
+        '/callees': callees_result,
+        '/callers': callers_result,
+        '/calls': lambda graph, params: index.cg.query_result(
+            params['name'], int_param(params, 'depth', 15), graph),
+        '/path': path_result,
+        '/lookup': lookup_result,
+        '/matching': matching_result,
+    }
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        epilog='Other arguments (-x, -p, --cfg, extra clang args) are passed '
+               'to libclang-callgraph.py.')
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--compile-commands",
+                        help="Path to compile_commands.json")
+    source.add_argument("--graph",
+                        help="Callgraph file written by libclang-callgraph.py "
+                             "--export")
+    parser.add_argument("--db",
+                        help="Callgraph store (default: callgraph.sqlite next "
+                             "to compile_commands.json)")
+    parser.add_argument("--jobs", type=int, default=1,
+                        help="Worker processes for parsing (0: one per CPU)")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--unix-socket",
+                        help="Listen on this Unix socket instead of TCP")
+    parser.add_argument("--poll-interval", type=float, default=2.0,
+                        help="Seconds between checks for changed files")
+    parser.add_argument("--verbose", action="store_true")
+    args, rest = parser.parse_known_args()
+
+    cg = load_callgraph_module()
+    if args.graph:
+        index = CallGraphIndex(cg, graph_file=args.graph)
+    else:
+        db = args.db or os.path.join(
+            os.path.dirname(os.path.abspath(args.compile_commands)),
+            'callgraph.sqlite')
+        cfg = cg.read_args([args.compile_commands, '--db', db,
+                            '--jobs', str(args.jobs)] + rest)
+        cg.load_config_file(cfg)
+        index = CallGraphIndex(cg, cfg)
+
+    # 그래프가 준비된 뒤에 듣기 시작한다.
+    index.refresh()
+    server = make_server(index, args.host, args.port, args.unix_socket,
+                         args.verbose)
+
+    stop = threading.Event()
+    watcher = threading.Thread(target=index.watch,
+                               args=(args.poll_interval, stop), daemon=True)
+    watcher.start()
+
+    if args.unix_socket:
+        print(f"Callgraph server listening on {args.unix_socket}",
+              file=sys.stderr)
+    else:
+        host, port = server.server_address[:2]
+        print(f"Callgraph server listening on http://{host}:{port}/",
+              file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop.set()
+        server.server_close()
+        if args.unix_socket and os.path.exists(args.unix_socket):
+            os.remove(args.unix_socket)
+
+
+if __name__ == '__main__':
+    main()
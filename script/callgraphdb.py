@@ -0,0 +1,314 @@
+# callgraphdb.py
+
+import json
+import os
+import sqlite3
+import time
+
+import callgraphutil
+
+# 스키마가 바뀌면 올린다. 다른 version의 저장소는 비우고 다시 만든다.
+SCHEMA_VERSION = 5
+
+# TU별 레코드가 있는 table들
+TU_TABLES = ('dependency', 'edge', 'name', 'base', 'virtual_method',
+             'address_taken', 'pointer_call')
+
+# TU마다 어떤 edge/이름을 만들었는지 기록해 두면 바뀐 TU만 다시 파싱해서
+# 그 TU의 레코드만 교체할 수 있다.
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS tu (
+    id INTEGER PRIMARY KEY,
+    file TEXT UNIQUE NOT NULL,
+    args TEXT NOT NULL,
+    indexed_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS dependency (
+    tu_id INTEGER NOT NULL REFERENCES tu(id) ON DELETE CASCADE,
+    path TEXT NOT NULL,
+    mtime REAL
+);
+CREATE INDEX IF NOT EXISTS dependency_tu ON dependency(tu_id);
+CREATE INDEX IF NOT EXISTS dependency_path ON dependency(path);
+CREATE TABLE IF NOT EXISTS edge (
+    tu_id INTEGER NOT NULL REFERENCES tu(id) ON DELETE CASCADE,
+    caller TEXT NOT NULL,
+    callee_qualified TEXT NOT NULL,
+    callee_pretty TEXT NOT NULL,
+    is_virtual INTEGER NOT NULL,
+    is_pure_virtual INTEGER NOT NULL,
+    callee_usr TEXT NOT NULL,
+    owner TEXT,
+    kind INTEGER NOT NULL,
+    count INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS edge_tu ON edge(tu_id);
+CREATE INDEX IF NOT EXISTS edge_caller ON edge(caller);
+CREATE INDEX IF NOT EXISTS edge_callee ON edge(callee_pretty);
+CREATE TABLE IF NOT EXISTS name (
+    tu_id INTEGER NOT NULL REFERENCES tu(id) ON DELETE CASCADE,
+    qualified TEXT NOT NULL,
+    pretty TEXT NOT NULL,
+    spelling TEXT NOT NULL,
+    usr TEXT NOT NULL,
+    location TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS name_tu ON name(tu_id);
+CREATE INDEX IF NOT EXISTS name_spelling ON name(spelling);
+CREATE TABLE IF NOT EXISTS base (
+    tu_id INTEGER NOT NULL REFERENCES tu(id) ON DELETE CASCADE,
+    class TEXT NOT NULL,
+    base TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS base_tu ON base(tu_id);
+CREATE TABLE IF NOT EXISTS virtual_method (
+    tu_id INTEGER NOT NULL REFERENCES tu(id) ON DELETE CASCADE,
+    class TEXT NOT NULL,
+    signature TEXT NOT NULL,
+    qualified TEXT NOT NULL,
+    pretty TEXT NOT NULL,
+    is_virtual INTEGER NOT NULL,
+    is_pure_virtual INTEGER NOT NULL,
+    usr TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS virtual_method_tu ON virtual_method(tu_id);
+CREATE TABLE IF NOT EXISTS address_taken (
+    tu_id INTEGER NOT NULL REFERENCES tu(id) ON DELETE CASCADE,
+    type TEXT NOT NULL,
+    qualified TEXT NOT NULL,
+    pretty TEXT NOT NULL,
+    is_virtual INTEGER NOT NULL,
+    is_pure_virtual INTEGER NOT NULL,
+    usr TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS address_taken_tu ON address_taken(tu_id);
+CREATE TABLE IF NOT EXISTS pointer_call (
+    tu_id INTEGER NOT NULL REFERENCES tu(id) ON DELETE CASCADE,
+    caller TEXT NOT NULL,
+    type TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS pointer_call_tu ON pointer_call(tu_id);
+'''
+
+
+def spelling_of(qualified):
+    """a::b::f -> f"""
+    return qualified.rsplit('::', 1)[-1]
+
+
+def file_mtime(path):
+    try:
+        return os.stat(path).st_mtime
+    except OSError:
+        return None
+
+
+class CallGraphDB:
+    """libclang-callgraph.py의 결과를 TU 단위로 저장하는 SQLite 저장소"""
+
+    def __init__(self, path):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.execute('PRAGMA foreign_keys = ON')
+        self.conn.execute('PRAGMA journal_mode = WAL')
+        version = self.conn.execute('PRAGMA user_version').fetchone()[0]
+        if version != SCHEMA_VERSION:
+            with self.conn:
+                for table in TU_TABLES + ('tu',):
+                    self.conn.execute(f'DROP TABLE IF EXISTS {table}')
+            self.conn.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+        self.conn.executescript(SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    def stale_files(self, tus, changed_paths=None):
+        """
+        다시 파싱해야 하는 TU 파일 목록을 반환한다.
+
+        Args:
+            tus (list): (file, args) 리스트. 보통 compile_commands.json 순서.
+            changed_paths (set): git range 등으로 얻은 변경 파일의 real path.
+                None이면 기록해 둔 의존 파일들의 mtime과 비교한다.
+
+        Returns:
+            list: 새로 추가됐거나, 컴파일 인자가 바뀌었거나, 자신 또는
+                  include한 파일이 바뀐 TU 파일들.
+        """
+        indexed = {file: (tu_id, args) for tu_id, file, args in
+                   self.conn.execute('SELECT id, file, args FROM tu')}
+
+        stale = []
+        for file, args in tus:
+            if file not in indexed or indexed[file][1] != json.dumps(args):
+                stale.append(file)
+                continue
+
+            deps = self.conn.execute(
+                'SELECT path, mtime FROM dependency WHERE tu_id = ?',
+                (indexed[file][0],))
+            for path, mtime in deps:
+                if changed_paths is not None:
+                    if path in changed_paths:
+                        stale.append(file)
+                        break
+                elif file_mtime(path) != mtime:
+                    stale.append(file)
+                    break
+
+        return stale
+
+    def store(self, result):
+        """parse_tu()의 결과로 한 TU의 레코드를 교체한다."""
+        with self.conn:
+            row = self.conn.execute('SELECT id FROM tu WHERE file = ?',
+                                    (result['file'],)).fetchone()
+            if row is None:
+                tu_id = self.conn.execute(
+                    'INSERT INTO tu (file, args, indexed_at) VALUES (?, ?, ?)',
+                    (result['file'], json.dumps(result['args']),
+                     time.time())).lastrowid
+            else:
+                tu_id = row[0]
+                self.conn.execute(
+                    'UPDATE tu SET args = ?, indexed_at = ? WHERE id = ?',
+                    (json.dumps(result['args']), time.time(), tu_id))
+                for table in TU_TABLES:
+                    self.conn.execute(
+                        f'DELETE FROM {table} WHERE tu_id = ?', (tu_id,))
+
+            deps = {os.path.realpath(path)
+                    for path in [result['file']] + result['includes']}
+            self.conn.executemany(
+                'INSERT INTO dependency VALUES (?, ?, ?)',
+                [(tu_id, path, file_mtime(path)) for path in sorted(deps)])
+            self.conn.executemany(
+                'INSERT INTO edge VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                [(tu_id, caller) + tuple(callee) + (owner, kind, count)
+                 for caller, callee, owner, kind, count in result['edges']])
+            self.conn.executemany(
+                'INSERT INTO name VALUES (?, ?, ?, ?, ?, ?)',
+                [(tu_id, qualified, pretty, spelling_of(qualified), usr,
+                  location)
+                 for qualified, pretty, usr, location in result['names']])
+
+            dispatch = result['dispatch']
+            self.conn.executemany(
+                'INSERT INTO base VALUES (?, ?, ?)',
+                [(tu_id, cls, base) for cls, base in dispatch['bases']])
+            self.conn.executemany(
+                'INSERT INTO virtual_method VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                [(tu_id, cls, signature) + tuple(callee)
+                 for cls, signature, callee in dispatch['virtual_methods']])
+            self.conn.executemany(
+                'INSERT INTO address_taken VALUES (?, ?, ?, ?, ?, ?, ?)',
+                [(tu_id, ftype) + tuple(callee)
+                 for ftype, callee in dispatch['address_taken']])
+            self.conn.executemany(
+                'INSERT INTO pointer_call VALUES (?, ?, ?)',
+                [(tu_id, caller, ftype)
+                 for caller, ftype in dispatch['pointer_calls']])
+
+    def dependencies(self):
+        """
+        모든 TU가 의존하는 파일과 기록해 둔 mtime. 여러 TU가 같은 mtime으로
+        기록한 헤더는 한 번만 나온다.
+
+        Returns:
+            list: (path, mtime)
+        """
+        return self.conn.execute(
+            'SELECT DISTINCT path, mtime FROM dependency').fetchall()
+
+    def retain_files(self, files):
+        """compile database에서 사라진 TU의 레코드를 지운다."""
+        files = set(files)
+        with self.conn:
+            for tu_id, file in self.conn.execute(
+                    'SELECT id, file FROM tu').fetchall():
+                if file not in files:
+                    self.conn.execute('DELETE FROM tu WHERE id = ?', (tu_id,))
+
+    def edges_by_tu(self):
+        """
+        TU마다 [(caller, (callee_qualified, callee_pretty, is_virtual,
+        is_pure_virtual, callee_usr), owner, kind, count)]를 기록 순서대로
+        돌려준다. owner는 edge가 나온 헤더 정의의 키이고 kind는
+        callgraphutil.EDGE_* 비트이다.
+        """
+        tu_id = None
+        edges = []
+        for row in self.conn.execute(
+                'SELECT tu_id, caller, callee_qualified, callee_pretty, '
+                'is_virtual, is_pure_virtual, callee_usr, owner, kind, count '
+                'FROM edge ORDER BY tu_id, rowid'):
+            if row[0] != tu_id and edges:
+                yield edges
+                edges = []
+            tu_id = row[0]
+            edges.append((row[1], (row[2], row[3], bool(row[4]),
+                                   bool(row[5]), row[6]),
+                          row[7], row[8], row[9]))
+        if edges:
+            yield edges
+
+    def dispatch(self):
+        """모든 TU의 dispatch 정보 (CallGraph.merge_dispatch() 참고)"""
+        def callee(row):
+            return row[0], row[1], bool(row[2]), bool(row[3]), row[4]
+
+        return {
+            'bases': self.conn.execute(
+                'SELECT DISTINCT class, base FROM base').fetchall(),
+            'virtual_methods': [
+                (row[0], row[1], callee(row[2:])) for row in self.conn.execute(
+                    'SELECT class, signature, qualified, pretty, is_virtual, '
+                    'is_pure_virtual, usr FROM virtual_method '
+                    'ORDER BY tu_id, rowid')],
+            'address_taken': [
+                (row[0], callee(row[1:])) for row in self.conn.execute(
+                    'SELECT type, qualified, pretty, is_virtual, '
+                    'is_pure_virtual, usr FROM address_taken '
+                    'ORDER BY tu_id, rowid')],
+            'pointer_calls': self.conn.execute(
+                'SELECT DISTINCT caller, type FROM pointer_call').fetchall(),
+        }
+
+    def names(self):
+        """(qualified, pretty, usr, location). location은 정의의 'path:line'"""
+        return self.conn.execute(
+            'SELECT qualified, pretty, usr, location FROM name '
+            'ORDER BY tu_id, rowid')
+
+    def load_graph(self, graph=None):
+        """
+        저장된 이름과 edge로 callgraphutil.CallGraph를 채우고 가상 함수와
+        함수 포인터 호출을 잇는다. 여러 TU가 같은 헤더 정의를 기록했으면 그
+        edge는 한 번만 넣는다.
+        """
+        if graph is None:
+            graph = callgraphutil.CallGraph()
+        # caller는 pretty name만 있으므로 USR이 있는 이름을 먼저 넣는다.
+        for name, pretty, usr, location in self.names():
+            graph.add_name(name, pretty, usr, location)
+        for tu_edges in self.edges_by_tu():
+            graph.merge_edges(tu_edges)
+        graph.merge_dispatch(self.dispatch())
+        graph.resolve_dispatch()
+        return graph
+
+    def lookup(self, spelling):
+        """함수 이름(spelling)으로 pretty name들을 찾는다."""
+        return sorted(row[0] for row in self.conn.execute(
+            'SELECT DISTINCT pretty FROM name WHERE spelling = ?',
+            (spelling,)))
+
+    def callees(self, pretty):
+        return sorted(row[0] for row in self.conn.execute(
+            'SELECT DISTINCT callee_pretty FROM edge WHERE caller = ?',
+            (pretty,)))
+
+    def callers(self, pretty):
+        return sorted(row[0] for row in self.conn.execute(
+            'SELECT DISTINCT caller FROM edge WHERE callee_pretty = ?',
+            (pretty,)))
@@ -0,0 +1,432 @@
+# callgraphfile.py
+
+import bisect
+import json
+import mmap
+import os
+import struct
+import sys
+import tempfile
+
+from array import array
+
+import callgraphutil
+
+MAGIC = b'CGRAPH\0\0'
+
+# libclang-callgraph.py가 입력 파일을 callgraph 파일로 알아보는 확장자
+EXTENSION = '.cgraph'
+
+# 형식이 바뀌면 올린다. 다른 version의 파일은 읽지 않는다.
+FORMAT_VERSION = 2
+
+# (section 이름, array typecode). 파일에 이 순서로 들어간다.
+SECTIONS = (
+    ('string_offsets', 'q'),  # 문자열 수 + 1, string_data 안의 byte offset
+    ('string_data', 'B'),     # UTF-8
+    ('pretty', 'i'),          # node -> 문자열 번호
+    ('qualified', 'i'),
+    ('usr', 'i'),
+    ('file', 'i'),            # 정의 위치의 파일
+    ('line', 'i'),            # 정의 위치의 라인, 모르면 0
+    ('flags', 'B'),           # callgraphutil.VIRTUAL | PURE_VIRTUAL
+    ('defined', 'B'),
+    ('callee_offsets', 'i'),  # node 수 + 1 (CSR)
+    ('callees', 'i'),
+    ('call_counts', 'i'),
+    ('edge_kinds', 'b'),      # callgraphutil.EDGE_*
+    ('caller_offsets', 'i'),  # 역방향 CSR
+    ('callers', 'i'),
+    ('by_pretty', 'i'),       # pretty name 순으로 정렬한 node
+    ('by_spelling', 'i'),     # 이름을 본 node를 (spelling, pretty name) 순으로
+    ('by_qualified', 'i'),    # 이름을 본 node를 (qualified, pretty name) 순으로
+)
+
+# magic, version, little endian 여부, node 수, edge 수, 문자열 수
+HEADER = struct.Struct('<8sIIIII')
+# section마다 (byte offset, item 수)
+SECTION_ENTRY = struct.Struct('<QQ')
+
+ALIGNMENT = 8
+
+
+def spelling_of(qualified):
+    """a::b::f -> f"""
+    return qualified.rsplit('::', 1)[-1]
+
+
+def split_location(location):
+    """'path:line' -> (path, line). 모르면 ('', 0)"""
+    path, _, line = location.rpartition(':')
+    if not path or not line.isdigit():
+        return '', 0
+    return path, int(line)
+
+
+def csr(rows, typecode):
+    """array들의 리스트 -> (offsets, 이어 붙인 값들)"""
+    offsets = array('i', [0])
+    values = array(typecode)
+    for row in rows:
+        values.extend(row)
+        offsets.append(len(values))
+    return offsets, values
+
+
+def write(graph, path):
+    """
+    callgraphutil.CallGraph를 mmap으로 바로 읽을 수 있는 binary 파일로 쓴다.
+
+    문자열은 string table에 한 번씩만 들어가고, node마다의 값은 column,
+    edge는 CSR(offset 배열 + 값 배열)로 들어간다. caller 방향 CSR과 이름
+    검색용 정렬 색인도 함께 넣으므로 읽을 때 아무것도 다시 만들지 않는다.
+    array는 native byte order로 쓴다.
+    """
+    graph.freeze()
+    strings = {}
+
+    def string(s):
+        index = strings.get(s)
+        if index is None:
+            index = strings[s] = len(strings)
+        return index
+
+    string('')
+    n = len(graph)
+    locations = [split_location(location) for location in graph.location]
+    columns = {
+        'pretty': array('i', map(string, graph.pretty)),
+        'qualified': array('i', map(string, graph.qualified)),
+        'usr': array('i', map(string, graph.usr)),
+        'file': array('i', (string(path) for path, _ in locations)),
+        'line': array('i', (line for _, line in locations)),
+        'flags': array('B', graph.flags),
+        'defined': array('B', graph.defined),
+    }
+    columns['callee_offsets'], columns['callees'] = csr(graph.callees_of, 'i')
+    columns['call_counts'] = csr(graph.call_counts, 'i')[1]
+    columns['edge_kinds'] = csr(graph.edge_kinds, 'b')[1]
+    columns['caller_offsets'], columns['callers'] = \
+        csr(graph.callers_of(), 'i')
+    columns['by_pretty'] = array('i', sorted(range(n),
+                                             key=graph.pretty.__getitem__))
+    columns['by_spelling'] = array('i', sorted(
+        (symbol for symbol in range(n) if graph.defined[symbol]),
+        key=lambda symbol: (spelling_of(graph.qualified[symbol]),
+                            graph.pretty[symbol])))
+    columns['by_qualified'] = array('i', graph.qualified_index())
+
+    encoded = [s.encode('utf-8') for s in strings]
+    string_offsets = array('q', [0])
+    for data in encoded:
+        string_offsets.append(string_offsets[-1] + len(data))
+    columns['string_offsets'] = string_offsets
+    columns['string_data'] = array('B', b''.join(encoded))
+
+    table_size = HEADER.size + SECTION_ENTRY.size * len(SECTIONS)
+    offset = table_size
+    entries = []
+    for name, typecode in SECTIONS:
+        column = columns[name]
+        assert column.typecode == typecode, name
+        offset += -offset % ALIGNMENT
+        entries.append((offset, len(column)))
+        offset += len(column) * column.itemsize
+
+    # cacheutil.DiskCache와 같이 임시 파일에 쓴 뒤 rename 한다.
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, FORMAT_VERSION,
+                                sys.byteorder == 'little', n,
+                                len(columns['callees']), len(strings)))
+            for entry in entries:
+                f.write(SECTION_ENTRY.pack(*entry))
+            for (name, _), (offset, _) in zip(SECTIONS, entries):
+                f.write(b'\0' * (offset - f.tell()))
+                columns[name].tofile(f)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+class StringColumn:
+    """node -> 문자열. 읽을 때마다 string table에서 decode한다."""
+
+    def __init__(self, strings, column):
+        self.strings = strings
+        self.column = column
+
+    def __len__(self):
+        return len(self.column)
+
+    def __getitem__(self, symbol):
+        return self.strings[self.column[symbol]]
+
+
+class StringTable:
+    def __init__(self, offsets, data):
+        self.offsets = offsets
+        self.data = data
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index):
+        return str(self.data[self.offsets[index]:self.offsets[index + 1]],
+                   'utf-8')
+
+
+class LocationColumn:
+    """node -> 'path:line' ('' 이면 모름)"""
+
+    def __init__(self, strings, files, lines):
+        self.strings = strings
+        self.files = files
+        self.lines = lines
+
+    def __len__(self):
+        return len(self.files)
+
+    def __getitem__(self, symbol):
+        path = self.strings[self.files[symbol]]
+        return f'{path}:{self.lines[symbol]}' if path else ''
+
+
+class CSRRows:
+    """row -> values의 memoryview 조각"""
+
+    def __init__(self, offsets, values):
+        self.offsets = offsets
+        self.values = values
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, row):
+        return self.values[self.offsets[row]:self.offsets[row + 1]]
+
+
+class NameIndex:
+    """pretty name -> node. pretty name 순 색인을 이분 탐색한다."""
+
+    def __init__(self, pretty, by_pretty):
+        self.pretty = pretty
+        self.by_pretty = by_pretty
+
+    def get(self, pretty, default=None):
+        i = bisect.bisect_left(self.by_pretty, pretty,
+                               key=self.pretty.__getitem__)
+        if i < len(self.by_pretty) and \
+                self.pretty[self.by_pretty[i]] == pretty:
+            return self.by_pretty[i]
+        return default
+
+    def __contains__(self, pretty):
+        return self.get(pretty) is not None
+
+
+class MappedCallGraph:
+    """
+    write()로 쓴 파일을 mmap으로 열어 callgraphutil.CallGraph처럼 쓰는
+    읽기 전용 callgraph.
+
+    여는 동안에는 header와 section 위치만 읽는다. 배열은 mmap 위의
+    memoryview라서 복사되지 않고 실제로 읽는 page만 메모리에 올라온다.
+    walk(), callers_within() 등 조회 method는 CallGraph의 것을 그대로 쓴다.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._views = []
+        try:
+            self._open()
+        except BaseException:
+            self.close()
+            raise
+
+    def _open(self):
+        view = memoryview(self._mmap)
+        self._views.append(view)
+        magic, version, little, nodes, edges, _ = HEADER.unpack_from(view)
+        if magic != MAGIC:
+            raise ValueError(f'{self.path}: not a callgraph file')
+        if version != FORMAT_VERSION:
+            raise ValueError(f'{self.path}: format version {version}, '
+                             f'expected {FORMAT_VERSION}')
+        if bool(little) != (sys.byteorder == 'little'):
+            raise ValueError(f'{self.path}: written with another byte order')
+
+        sections = {}
+        for i, (name, typecode) in enumerate(SECTIONS):
+            offset, count = SECTION_ENTRY.unpack_from(
+                view, HEADER.size + i * SECTION_ENTRY.size)
+            size = array(typecode).itemsize
+            section = view[offset:offset + count * size].cast(typecode)
+            self._views.append(section)
+            sections[name] = section
+
+        self.node_count = nodes
+        self.edges = edges
+        self.strings = StringTable(sections['string_offsets'],
+                                   sections['string_data'])
+        self.pretty = StringColumn(self.strings, sections['pretty'])
+        self.qualified = StringColumn(self.strings, sections['qualified'])
+        self.usr = StringColumn(self.strings, sections['usr'])
+        self.location = LocationColumn(self.strings, sections['file'],
+                                       sections['line'])
+        self.flags = sections['flags']
+        self.defined = sections['defined']
+        self.callees_of = CSRRows(sections['callee_offsets'],
+                                  sections['callees'])
+        self.call_counts = CSRRows(sections['callee_offsets'],
+                                   sections['call_counts'])
+        self.edge_kinds = CSRRows(sections['callee_offsets'],
+                                  sections['edge_kinds'])
+        self._callers_of = CSRRows(sections['caller_offsets'],
+                                   sections['callers'])
+        self.ids = NameIndex(self.pretty, sections['by_pretty'])
+        self._by_spelling = sections['by_spelling']
+        self._by_qualified = sections['by_qualified']
+
+    def freeze(self):
+        """이미 CSR이므로 버릴 색인이 없다."""
+
+    def close(self):
+        """조회 결과로 받은 memoryview 조각이 남아 있으면 BufferError가 난다."""
+        for view in reversed(self._views):
+            view.release()
+        self._views = []
+        self._mmap.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return self.node_count
+
+    def __contains__(self, pretty):
+        return pretty in self.ids
+
+    def edge_count(self):
+        return self.edges
+
+    def callers_of(self):
+        return self._callers_of
+
+    def call_count(self, caller, callee):
+        """caller가 callee를 호출하는 위치 수"""
+        source = self.ids.get(caller)
+        target = self.ids.get(callee)
+        if source is None or target is None:
+            return 0
+        for i, symbol in enumerate(self.callees_of[source]):
+            if symbol == target:
+                return self.call_counts[source][i]
+        return 0
+
+    def qualified_index(self):
+        return self._by_qualified
+
+    def lookup(self, spelling):
+        """함수 이름(a::b::f의 f)으로 이름을 본 함수들의 pretty name을 찾는다."""
+        def key(symbol):
+            return spelling_of(self.qualified[symbol])
+
+        by_spelling = self._by_spelling
+        start = bisect.bisect_left(by_spelling, spelling, key=key)
+        end = bisect.bisect_right(by_spelling, spelling, lo=start, key=key)
+        return [self.pretty[symbol] for symbol in by_spelling[start:end]]
+
+    lookup_defined = callgraphutil.CallGraph.lookup_defined
+    callees = callgraphutil.CallGraph.callees
+    callers = callgraphutil.CallGraph.callers
+    fullnames = callgraphutil.CallGraph.fullnames
+    matching = callgraphutil.CallGraph.matching
+    walk = callgraphutil.CallGraph.walk
+    callers_within = callgraphutil.CallGraph.callers_within
+    call_path = callgraphutil.CallGraph.call_path
+
+
+def subgraph(graph, root, max_depth=3, max_nodes=500):
+    """
+    root에서 callee 방향으로 max_depth 단계 안에 닿는 node와 edge.
+    node가 max_nodes개를 넘으면 거기서 멈춘다.
+
+    Returns:
+        tuple: ([node], [(caller, callee, count, kind)]). root가 없으면 빈 것.
+    """
+    symbol = graph.ids.get(root)
+    if symbol is None:
+        return [], []
+
+    depth = {symbol: 0}
+    nodes = [symbol]
+    edges = []
+    for source in nodes:
+        if depth[source] >= max_depth:
+            continue
+        counts = graph.call_counts[source]
+        kinds = graph.edge_kinds[source]
+        for i, target in enumerate(graph.callees_of[source]):
+            if target not in depth:
+                if len(nodes) >= max_nodes:
+                    continue
+                depth[target] = depth[source] + 1
+                nodes.append(target)
+            edges.append((source, target, counts[i], kinds[i]))
+    return nodes, edges
+
+
+def to_json(graph, root, max_depth=3, max_nodes=500):
+    """subgraph()를 JSON으로 쓸 수 있는 dict로"""
+    nodes, edges = subgraph(graph, root, max_depth, max_nodes)
+    return {
+        'root': root,
+        'nodes': [{
+            'id': symbol,
+            'name': graph.pretty[symbol],
+            'qualified': graph.qualified[symbol],
+            'usr': graph.usr[symbol],
+            'location': graph.location[symbol],
+            'virtual': bool(graph.flags[symbol] & callgraphutil.VIRTUAL),
+        } for symbol in nodes],
+        'edges': [{
+            'caller': source,
+            'callee': target,
+            'count': count,
+            'kinds': callgraphutil.edge_kind_names(kind),
+        } for source, target, count, kind in edges],
+    }
+
+
+# DOT에서 edge kind마다의 선 모양. 여러 개면 앞의 것.
+DOT_STYLES = (
+    (callgraphutil.EDGE_DIRECT, 'solid'),
+    (callgraphutil.EDGE_OVERRIDE, 'dashed'),
+    (callgraphutil.EDGE_POINTER, 'dotted'),
+    (callgraphutil.EDGE_ADDRESS, 'dotted'),
+)
+
+
+def to_dot(graph, root, max_depth=3, max_nodes=500):
+    """subgraph()를 Graphviz DOT 문자열로"""
+    nodes, edges = subgraph(graph, root, max_depth, max_nodes)
+    lines = ['digraph callgraph {', '  node [shape=box];']
+    for symbol in nodes:
+        lines.append(f'  n{symbol} [label={json.dumps(graph.pretty[symbol])}];')
+    for source, target, count, kind in edges:
+        style = next((style for bit, style in DOT_STYLES if kind & bit),
+                     'solid')
+        label = '' if count <= 1 else f', label="{count}"'
+        lines.append(f'  n{source} -> n{target} [style={style}{label}];')
+    lines.append('}')
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,528 @@
+# callgraphutil.py
+
+import bisect
+import os
+import sys
+
+from array import array
+from collections import namedtuple
+
+# CallGraph.flags의 비트
+VIRTUAL = 1
+PURE_VIRTUAL = 2
+
+# edge가 어떻게 만들어졌는지 (CallGraph.edge_kinds의 비트)
+EDGE_DIRECT = 1     # CALL_EXPR가 가리키는 함수
+EDGE_OVERRIDE = 2   # 가상 함수 호출을 override한 함수로 이은 것
+EDGE_ADDRESS = 4    # caller 안에서 함수의 주소를 얻었다 (callback 등록 등)
+EDGE_POINTER = 8    # 함수 포인터 호출을 같은 타입의 주소가 쓰인 함수로 이은 것
+
+EDGE_KIND_NAMES = {
+    EDGE_DIRECT: 'direct',
+    EDGE_OVERRIDE: 'override',
+    EDGE_ADDRESS: 'address',
+    EDGE_POINTER: 'pointer',
+}
+
+
+def edge_kind_names(kind):
+    """edge kind 비트들의 이름"""
+    return [name for bit, name in EDGE_KIND_NAMES.items() if kind & bit]
+
+
+# walk()가 돌려주는 한 줄. depth는 root의 callee가 1이다.
+#  repeated:  앞에서 이미 펼친 함수라서 callee를 다시 펼치지 않았다.
+#  truncated: max_depth에 닿아서 callee를 펼치지 않았다.
+#  kind:      caller에서 이 함수로 오는 edge의 EDGE_* 비트
+CallStep = namedtuple('CallStep',
+                      ['depth', 'symbol', 'repeated', 'truncated', 'kind'])
+
+# callers_within()가 돌려주는 caller 하나. distance는 직접 호출하면 1이고
+# via는 root 쪽으로 한 단계 가까운 함수(distance 1이면 root)이다.
+CallerStep = namedtuple('CallerStep', ['distance', 'symbol', 'via'])
+
+
+class CallGraph:
+    """
+    함수 이름을 정수 id로 intern 해서 들고 있는 callgraph.
+
+    함수 하나는 pretty name(a::f(int)) 하나에 대응하고, 이름 문자열은 한 번만
+    저장한다. id마다 callee id들과 호출 위치 수를 array('i')로 들고 있으므로
+    edge 하나가 8 bytes이다. 같은 caller -> callee edge는 하나로 모이고 호출
+    위치 수만 더해진다.
+
+    callee 방향만 들고 있고, caller 방향 색인은 처음 필요할 때 만든 뒤
+    edge가 바뀔 때까지 다시 쓴다.
+
+    CALL_EXPR로 얻은 edge 외에 class 계층과 virtual method, 주소가 쓰인
+    함수, 함수 포인터 호출을 merge_dispatch()로 모아 두었다가
+    resolve_dispatch()에서 override/pointer edge로 잇는다. edge마다
+    EDGE_* 비트로 어떻게 만들어졌는지 남는다.
+
+    함수는 pretty name으로 구분하고 USR은 처음 알게 된 것을 기록만 한다.
+    template 멤버의 overload는 USR이 같을 수 있어서 USR로 합치면 다른
+    함수가 섞인다.
+    """
+
+    def __init__(self):
+        self.ids = {}           # pretty -> id
+        self.pretty = []        # id -> pretty
+        self.qualified = []     # id -> qualified
+        self.usr = []           # id -> usr ('' 이면 모름)
+        self.location = []      # id -> 정의의 'path:line' ('' 이면 모름)
+        self.flags = bytearray()
+        self.defined = bytearray()  # 정의/선언을 본 함수 (이름 검색 대상)
+        self.callees_of = []    # id -> array('i')
+        self.call_counts = []   # id -> array('i'), callees_of와 같은 순서
+        self.edge_kinds = []    # id -> array('b'), callees_of와 같은 순서
+        self.bases = {}         # class -> set(base class)
+        self.virtual_methods = {}  # class -> {signature: id}
+        self.address_taken = {}    # 함수 타입 -> set(id)
+        self.pointer_calls = {}    # caller id -> set(함수 타입)
+        self.merged_definitions = set()  # merge_edges()로 넣은 헤더 정의들
+        self._slots = {}  # id -> {callee id: callees_of 안의 위치}, _link()가 쓴다
+        self._callers_of = None  # id -> array('i'), callers_of()가 만든다
+        self._spellings = None   # spelling -> [id], lookup()이 만든다
+        self._by_qualified = None  # qualified 순 id, matching()이 만든다
+
+    def __len__(self):
+        return len(self.pretty)
+
+    def __contains__(self, pretty):
+        return pretty in self.ids
+
+    def edge_count(self):
+        return sum(len(callees) for callees in self.callees_of)
+
+    def intern(self, pretty, qualified=None, usr=None):
+        symbol = self.ids.get(pretty)
+        if symbol is None:
+            pretty = sys.intern(pretty)
+            symbol = len(self.pretty)
+            self.ids[pretty] = symbol
+            self.pretty.append(pretty)
+            self.qualified.append(sys.intern(qualified or pretty))
+            self.usr.append('')
+            self.location.append('')
+            self.flags.append(0)
+            self.defined.append(0)
+            self.callees_of.append(array('i'))
+            self.call_counts.append(array('i'))
+            self.edge_kinds.append(array('b'))
+            self._callers_of = None
+        elif qualified and self.qualified[symbol] == pretty:
+            self.qualified[symbol] = sys.intern(qualified)
+            self._spellings = None
+            self._by_qualified = None
+        if usr and not self.usr[symbol]:
+            self.usr[symbol] = usr
+        return symbol
+
+    def add_name(self, qualified, pretty, usr=None, location=None):
+        symbol = self.intern(pretty, qualified, usr)
+        if location and not self.location[symbol]:
+            self.location[symbol] = location
+        if not self.defined[symbol]:
+            self.defined[symbol] = 1
+            self._spellings = None
+            self._by_qualified = None
+
+    def intern_callee(self, callee):
+        """callee((qualified, pretty, is_virtual, is_pure_virtual[, usr]))의 id"""
+        qualified, pretty, is_virtual, is_pure_virtual = callee[:4]
+        usr = callee[4] if len(callee) > 4 else None
+        symbol = self.intern(pretty, qualified, usr)
+        if is_virtual:
+            self.flags[symbol] |= VIRTUAL
+        if is_pure_virtual:
+            self.flags[symbol] |= PURE_VIRTUAL
+        return symbol
+
+    def add_edge(self, caller, callee, count=1, kind=EDGE_DIRECT):
+        """
+        caller(pretty name)가 callee((qualified, pretty, is_virtual,
+        is_pure_virtual[, usr]))를 count 곳에서 호출한다.
+        """
+        self._link(self.intern(caller), self.intern_callee(callee), count,
+                   kind)
+
+    def _link(self, source, target, count, kind):
+        """edge를 넣거나 기존 edge에 count와 kind를 더한다. 새 edge면 True"""
+        callees = self.callees_of[source]
+        slots = self._slots.get(source)
+        if slots is None:
+            # freeze() 뒤에 edge를 더 넣으면 그 함수의 색인만 다시 만든다.
+            slots = self._slots[source] = {
+                callee: i for i, callee in enumerate(callees)}
+        i = slots.get(target)
+        if i is not None:
+            self.call_counts[source][i] += count
+            self.edge_kinds[source][i] |= kind
+            return False
+        slots[target] = len(callees)
+        callees.append(target)
+        self.call_counts[source].append(count)
+        self.edge_kinds[source].append(kind)
+        self._callers_of = None
+        return True
+
+    def merge_edges(self, edges):
+        """
+        한 TU의 (caller, callee, owner, kind, count)들을 넣는다. owner는
+        edge가 나온 헤더 정의이고, 앞의 TU에서 이미 넣은 정의의 edge는
+        건너뛴다.
+        """
+        owners = {edge[2] for edge in edges if edge[2] is not None}
+        new_owners = owners - self.merged_definitions
+        for caller, callee, owner, kind, count in edges:
+            if owner is None or owner in new_owners:
+                self.add_edge(caller, callee, count, kind)
+        self.merged_definitions.update(new_owners)
+
+    def merge_dispatch(self, dispatch):
+        """
+        가상 함수/함수 포인터 호출을 풀 때 쓸 정보를 넣는다. dispatch는
+        libclang-callgraph.py의 parse_tu()가 만드는 dict이다.
+
+            bases:           (class, base class)
+            virtual_methods: (class, signature, callee)
+            address_taken:   (함수 타입, callee)
+            pointer_calls:   (caller, 함수 타입)
+        """
+        for cls, base in dispatch['bases']:
+            self.bases.setdefault(cls, set()).add(base)
+        for cls, signature, callee in dispatch['virtual_methods']:
+            self.virtual_methods.setdefault(cls, {})[signature] = \
+                self.intern_callee(callee)
+        for function_type, callee in dispatch['address_taken']:
+            self.address_taken.setdefault(function_type, set()).add(
+                self.intern_callee(callee))
+        for caller, function_type in dispatch['pointer_calls']:
+            self.pointer_calls.setdefault(self.intern(caller), set()).add(
+                function_type)
+
+    def ancestors(self, cls, memo=None):
+        """cls가 (간접적으로) 상속하는 class들"""
+        if memo is not None and cls in memo:
+            return memo[cls]
+        seen = set()
+        stack = list(self.bases.get(cls, ()))
+        while stack:
+            base = stack.pop()
+            if base in seen or base == cls:
+                continue
+            seen.add(base)
+            if memo is not None and base in memo:
+                seen |= memo[base]
+                continue
+            stack.extend(self.bases.get(base, ()))
+        if memo is not None:
+            memo[cls] = seen
+        return seen
+
+    def overriders(self):
+        """virtual method id -> 그 method를 (간접적으로) override하는 id들"""
+        memo = {}
+        overriders = {}
+        for cls, methods in self.virtual_methods.items():
+            for base in self.ancestors(cls, memo):
+                base_methods = self.virtual_methods.get(base)
+                if not base_methods:
+                    continue
+                for signature, method in methods.items():
+                    overridden = base_methods.get(signature)
+                    if overridden is not None and overridden != method:
+                        overriders.setdefault(overridden, []).append(method)
+        return overriders
+
+    def resolve_dispatch(self):
+        """
+        가상 함수 호출을 override한 method들로(EDGE_OVERRIDE), 함수 포인터
+        호출을 같은 함수 타입의 주소가 쓰인 함수들로(EDGE_POINTER) 잇는다.
+        모든 TU를 넣은 뒤 한 번 부른다. edge와 class 계층을 한 번씩만
+        훑는다.
+
+        Returns:
+            int: 새로 생긴 edge 수
+        """
+        overriders = self.overriders()
+        added = 0
+        if overriders:
+            for source in range(len(self.pretty)):
+                callees = self.callees_of[source]
+                kinds = self.edge_kinds[source]
+                counts = self.call_counts[source]
+                # 새로 붙는 edge는 다시 펼치지 않는다.
+                for i in range(len(callees)):
+                    if not kinds[i] & EDGE_DIRECT:
+                        continue
+                    for method in overriders.get(callees[i], ()):
+                        added += self._link(source, method, counts[i],
+                                            EDGE_OVERRIDE)
+        for source, function_types in self.pointer_calls.items():
+            for function_type in function_types:
+                for target in self.address_taken.get(function_type, ()):
+                    if target != source:
+                        added += self._link(source, target, 1, EDGE_POINTER)
+        self.freeze()
+        return added
+
+    def freeze(self):
+        """
+        edge를 다 넣은 뒤 부른다. _link()가 쓰던 함수별 callee 위치 색인을
+        버려서 adjacency array만 남긴다. resolve_dispatch()와
+        callgraphfile.write()가 부른다.
+        """
+        self._slots = {}
+
+    def call_count(self, caller, callee):
+        """caller가 callee를 호출하는 위치 수"""
+        source = self.ids.get(caller)
+        target = self.ids.get(callee)
+        if source is None or target is None:
+            return 0
+        callees = self.callees_of[source]
+        if target not in callees:
+            return 0
+        return self.call_counts[source][callees.index(target)]
+
+    def callees(self, pretty):
+        symbol = self.ids.get(pretty)
+        if symbol is None:
+            return []
+        return [self.pretty[target] for target in self.callees_of[symbol]]
+
+    def callers_of(self):
+        """id -> 그 함수를 호출하는 id들. callees_of를 한 번 훑어서 만든다."""
+        if self._callers_of is None:
+            callers_of = [array('i') for _ in self.pretty]
+            for source, callees in enumerate(self.callees_of):
+                for target in callees:
+                    callers_of[target].append(source)
+            self._callers_of = callers_of
+        return self._callers_of
+
+    def callers(self, pretty):
+        symbol = self.ids.get(pretty)
+        if symbol is None:
+            return []
+        return [self.pretty[source] for source in self.callers_of()[symbol]]
+
+    def lookup(self, spelling):
+        """함수 이름(a::b::f의 f)으로 이름을 본 함수들의 pretty name을 찾는다."""
+        if self._spellings is None:
+            spellings = {}
+            for symbol, qualified in enumerate(self.qualified):
+                if self.defined[symbol]:
+                    spellings.setdefault(qualified.rsplit('::', 1)[-1],
+                                         []).append(symbol)
+            self._spellings = spellings
+        return sorted(self.pretty[symbol]
+                      for symbol in self._spellings.get(spelling, ()))
+
+    def lookup_defined(self, spelling, path, first_line, last_line=None):
+        """
+        lookup(spelling) 중 path의 first_line부터 last_line 사이에 정의된
+        함수들. 다른 파일의 같은 이름 함수(get, init 등)는 빠진다.
+        last_line을 모르면 first_line 뒤에서 가장 가까운 정의를 고른다.
+
+        후보 중 정의 위치를 아는 것이 하나도 없으면(위치를 기록하기 전의
+        저장소 등) lookup()처럼 이름으로만 찾는다.
+        """
+        candidates = self.lookup(spelling)
+        path = os.path.realpath(path)
+        located = False
+        found = []
+        for pretty in candidates:
+            location = self.location[self.ids.get(pretty)]
+            if not location:
+                continue
+            located = True
+            location_path, _, line = location.rpartition(':')
+            line = int(line)
+            if location_path == path and line >= first_line and \
+                    (last_line is None or line <= last_line):
+                found.append((line, pretty))
+        if not located:
+            return candidates
+        if last_line is None and found:
+            nearest = min(line for line, _ in found)
+            return [pretty for line, pretty in found if line == nearest]
+        return [pretty for _, pretty in found]
+
+    def callers_within(self, root, max_depth=3, max_fanout=16, limit=64):
+        """
+        root를 직접 또는 간접적으로 호출하는 함수들을 가까운 순서로 찾는다.
+
+        너비 우선으로 max_depth 단계까지 올라간다. 함수 하나에서는 caller를
+        max_fanout개까지만 따라가므로 많이 쓰이는 함수에서도 결과가 한없이
+        커지지 않는다. root 자신과 재귀 호출은 결과에 없다. 결과가 limit개를
+        넘으면 그 단계까지만 보고 앞의 limit개를 돌려준다.
+
+        Returns:
+            list: (distance, pretty name) 순서로 정렬된 CallerStep.
+        """
+        symbol = self.ids.get(root)
+        if symbol is None:
+            return []
+
+        callers_of = self.callers_of()
+        steps = []
+        seen = {symbol}
+        frontier = [symbol]
+        for distance in range(1, max_depth + 1):
+            level = []
+            for target in frontier:
+                for source in callers_of[target][:max_fanout]:
+                    if source in seen:
+                        continue
+                    seen.add(source)
+                    level.append(CallerStep(distance, source, target))
+            if not level:
+                break
+            level.sort(key=lambda step: self.pretty[step.symbol])
+            steps.extend(level)
+            if limit is not None and len(steps) >= limit:
+                return steps[:limit]
+            frontier = [step.symbol for step in level]
+        return steps
+
+    def call_path(self, caller, callee, max_depth=15):
+        """
+        caller에서 callee까지 가장 짧은 호출 경로를 찾는다.
+
+        caller에서 callee 방향(callees_of)과 callee에서 caller 방향
+        (callers_of)으로 번갈아 너비 우선 탐색한다. 매번 frontier가 작은
+        쪽을 한 단계 넓히므로 큰 그래프에서도 경로 주변만 본다.
+
+        Returns:
+            list: caller부터 callee까지의 pretty name. max_depth 단계 안에
+                  닿지 않으면 빈 리스트.
+        """
+        source = self.ids.get(caller)
+        target = self.ids.get(callee)
+        if source is None or target is None:
+            return []
+        if source == target:
+            return [caller]
+
+        callers_of = self.callers_of()
+        forward = {source: None}    # id -> caller 쪽 이전 id
+        backward = {target: None}   # id -> callee 쪽 다음 id
+        forward_frontier = [source]
+        backward_frontier = [target]
+        meet = None
+        for _ in range(max_depth):
+            if len(forward_frontier) <= len(backward_frontier):
+                frontier, edges = forward_frontier, self.callees_of
+                parent, other = forward, backward
+            else:
+                frontier, edges = backward_frontier, callers_of
+                parent, other = backward, forward
+            level = []
+            for symbol in frontier:
+                for next_symbol in edges[symbol]:
+                    if next_symbol in parent:
+                        continue
+                    parent[next_symbol] = symbol
+                    if next_symbol in other:
+                        meet = next_symbol
+                        break
+                    level.append(next_symbol)
+                if meet is not None:
+                    break
+            if meet is not None or not level:
+                break
+            if parent is forward:
+                forward_frontier = level
+            else:
+                backward_frontier = level
+        if meet is None:
+            return []
+
+        path = []
+        symbol = meet
+        while symbol is not None:
+            path.append(self.pretty[symbol])
+            symbol = forward[symbol]
+        path.reverse()
+        symbol = backward[meet]
+        while symbol is not None:
+            path.append(self.pretty[symbol])
+            symbol = backward[symbol]
+        return path
+
+    def fullnames(self):
+        """이름을 본 함수들의 (qualified, pretty)"""
+        return [(self.qualified[symbol], self.pretty[symbol])
+                for symbol in range(len(self.pretty)) if self.defined[symbol]]
+
+    def qualified_index(self):
+        """이름을 본 함수들의 id를 (qualified, pretty) 순으로 정렬한 것"""
+        if self._by_qualified is None:
+            self._by_qualified = array('i', sorted(
+                (symbol for symbol in range(len(self.pretty))
+                 if self.defined[symbol]),
+                key=lambda symbol: (self.qualified[symbol],
+                                    self.pretty[symbol])))
+        return self._by_qualified
+
+    def matching(self, prefix, limit=None):
+        """
+        qualified name이 prefix로 시작하는 함수들의 pretty name을 qualified
+        name 순으로 찾는다. 정렬된 색인에서 prefix가 들어갈 자리부터 읽으므로
+        함수 수가 아니라 결과 수에 비례한다.
+        """
+        index = self.qualified_index()
+        i = bisect.bisect_left(index, prefix, key=self.qualified.__getitem__)
+        matches = []
+        while i < len(index) and (limit is None or len(matches) < limit):
+            symbol = index[i]
+            if not self.qualified[symbol].startswith(prefix):
+                break
+            matches.append(self.pretty[symbol])
+            i += 1
+        return matches
+
+    def walk(self, root, max_depth=15):
+        """
+        root에서 시작하는 호출 트리를 깊이 우선으로 펼친다.
+
+        한 번 펼친 함수는 다시 나와도 repeated로 표시만 하고 펼치지 않으므로
+        재귀 호출이 있어도 끝난다. 재귀 대신 stack을 쓰므로 깊이 제한을
+        크게 잡아도 된다.
+
+        Returns:
+            list: 출력 순서대로의 CallStep. root는 포함하지 않는다.
+        """
+        symbol = self.ids.get(root)
+        if symbol is None:
+            return []
+
+        steps = []
+        visited = bytearray(len(self.pretty))
+        # (caller id, 다음 index, depth)
+        stack = [(symbol, 0, 1)]
+        while stack:
+            source, i, depth = stack[-1]
+            callees = self.callees_of[source]
+            if i >= len(callees):
+                stack.pop()
+                continue
+            stack[-1] = (source, i + 1, depth)
+
+            target = callees[i]
+            kind = self.edge_kinds[source][i]
+            if visited[target]:
+                steps.append(CallStep(depth, target, True, False, kind))
+                continue
+            visited[target] = 1
+
+            children = self.callees_of[target]
+            if children and depth >= max_depth:
+                steps.append(CallStep(depth, target, False, True, kind))
+                continue
+            steps.append(CallStep(depth, target, False, False, kind))
+            if children:
+                stack.append((target, 0, depth + 1))
+        return steps
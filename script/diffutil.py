@@ -1,5 +1,6 @@
 # diffutil.py
 
+import io
 import re
 import sys
 
@@ -10,83 +11,114 @@ class DiffFile:
         self.old_path = old_path
         self.new_path = new_path
         self.hunks = []
-        self.diff_text = None
+        # 'diff --git' 줄부터 첫 hunk 전까지의 header 줄들
+        self.header_lines = []
+        self._diff_text = None
 
     def add_hunk(self, hunk):
         self.hunks.append(hunk)
     def add_diff_text(self, diff_text):
-        self.diff_text = diff_text
+        self._diff_text = diff_text
+
+    @property
+    def diff_text(self):
+        """이 파일의 diff. 따로 지정하지 않았으면 header와 hunk로 다시 만든다."""
+        if self._diff_text is not None:
+            return self._diff_text
+        lines = list(self.header_lines)
+        for hunk in self.hunks:
+            if hunk.header is not None:
+                lines.append(hunk.header)
+            lines.extend(hunk.changes)
+        return '\n'.join(lines)
 
 class DiffHunk:
-    def __init__(self, old_start, old_lines, new_start, new_lines, changes):
+    def __init__(self, old_start, old_lines, new_start, new_lines, changes,
+                 header=None):
         self.old_start = old_start
         self.old_lines = old_lines
         self.new_start = new_start
         self.new_lines = new_lines
         self.changes = changes
+        self.header = header
 
 class GitDiffParser:
     def parse(self, diff_text):
-        files = []
-        lines = diff_text.split('\n')
-        i = 0
-        while i < len(lines):
-            if lines[i].startswith('diff --git'):
-                file, i = self.parse_header(lines, i)
-                files.append(file)
-            elif lines[i].startswith('@@'):
-                hunk, i = self.parse_hunk(lines, i)
-                files[-1].add_hunk(hunk)
-                files[-1].add_diff_text(diff_text)
-            else:
-                i += 1
-        return files
+        return list(self.parse_stream(io.StringIO(diff_text)))
+
+    def parse_stream(self, stream):
+        """
+        file-like object(파일, `git diff` subprocess의 stdout 등)에서
+        한 줄씩 읽으면서 DiffFile을 하나씩 yield 한다.
+
+        diff 전체를 메모리에 올리지 않으며, 각 DiffFile은 자신의
+        header와 hunk만 갖는다.
+        """
+        file = None
+        hunk = None
+        for line in stream:
+            if line.endswith('\n'):
+                line = line[:-1]
+
+            if line.startswith('diff --git'):
+                if file is not None:
+                    yield file
+                file = self.parse_header(line)
+                hunk = None
+            elif line.startswith('@@'):
+                hunk = self.parse_hunk(line)
+                file.add_hunk(hunk)
+            elif hunk is not None:
+                hunk.changes.append(line)
+            elif file is not None:
+                file.header_lines.append(line)
+
+        if file is not None:
+            yield file
 
-    def parse_header(self, lines, i):
-        old_path = re.search(r'a/(.+?) ', lines[i]).group(1)
-        new_path = re.search(r'b/(.+?)$', lines[i]).group(1)
+    def parse_header(self, line):
+        old_path = re.search(r'a/(.+?) ', line).group(1)
+        new_path = re.search(r'b/(.+?)$', line).group(1)
         file = DiffFile(old_path, new_path)
-        i += 1
-        return file, i
+        file.header_lines.append(line)
+        return file
 
-    def parse_hunk(self, lines, i):
-        header = lines[i]
+    def parse_hunk(self, header):
         match = re.match(r'@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@', header)
         old_start = int(match.group(1))
         old_lines = int(match.group(2)) if match.group(2) else 1
         new_start = int(match.group(3))
         new_lines = int(match.group(4)) if match.group(4) else 1
-        i += 1
-        changes = []
-        while i < len(lines) and not lines[i].startswith('@@') and not lines[i].startswith('diff --git'):
-            changes.append(lines[i])
-            i += 1
-        hunk = DiffHunk(old_start, old_lines, new_start, new_lines, changes)
-        return hunk, i
-
-# Returns a dictionary of files and line numbers that have changes
+        return DiffHunk(old_start, old_lines, new_start, new_lines, [], header)
+
+# Returns the set of line numbers changed in a single file
+def changed_lines(diff):
+        lines = set()
+
+        for hunk in diff.hunks:
+            lineno = hunk.new_start
+            for change in hunk.changes:
+                if change.startswith(("+", "-")):
+                    lines.add(lineno)
+                if not change.startswith("-"):
+                    lineno += 1
+        return lines
+
+# Returns a dictionary of files and line numbers that have changes.
+# diffs may be a generator such as GitDiffParser.parse_stream().
 def changed_line_numbers(diffs):
         files = {}
 
         for diff in diffs:
-            curr_file = diff.new_path
-            for hunk in diff.hunks:
-                lineno = hunk.new_start
-                for change in hunk.changes:
-                    if change.startswith(("+", "-")):
-                        if curr_file not in files:
-                            files[curr_file] = set()
-                        files[curr_file].add(lineno)
-                    if not change.startswith("-"):
-                        lineno += 1
+            lines = changed_lines(diff)
+            if lines:
+                files.setdefault(diff.new_path, set()).update(lines)
         return files
     
 # Sample test code
 if __name__ == '__main__':
-    diff_text = sys.stdin.read()
-
     parser = GitDiffParser()
-    files = parser.parse(diff_text)
+    files = parser.parse_stream(sys.stdin)
 
     for file in files:
         print(f"Old Path: {file.old_path}")
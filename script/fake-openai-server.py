@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+
+"""
+OpenAI 호환 chat completions API를 흉내 내는 로컬 HTTP 서버
+
+실제 API를 호출하지 않고 plumbing.py의 review 경로를 시험할 때 쓴다.
+
+    python script/fake-openai-server.py --port 8000 --latency 0.5 --fail-rate 0.2
+    OPENAI_BASE_URL=http://127.0.0.1:8000/v1 OPENAI_API_KEY=fake \
+        python script/plumbing.py ...
+
+--fail-rate 비율만큼 429 또는 503을 돌려주므로 재시도 동작도 확인할 수 있다.
+"""
+
+import argparse
+import json
+import random
+import threading
+import time
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def send_json(self, status, body, headers=None):
+        data = json.dumps(body, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        request = json.loads(self.rfile.read(length) or b'{}')
+
+        if not self.path.rstrip('/').endswith('/chat/completions'):
+            self.send_json(404, {'error': {'message': 'not found'}})
+            return
+
+        server = self.server
+        with server.lock:
+            server.requests += 1
+            in_flight = server.in_flight = server.in_flight + 1
+            server.max_in_flight = max(server.max_in_flight, in_flight)
+        try:
+            time.sleep(server.latency)
+
+            if random.random() < server.fail_rate:
+                with server.lock:
+                    server.failures += 1
+                if random.random() < 0.5:
+                    self.send_json(429, {'error': {'message': 'rate limited',
+                                                   'type': 'rate_limit'}},
+                                   {'Retry-After': '0.1'})
+                else:
+                    self.send_json(503, {'error': {'message': 'unavailable'}})
+                return
+
+            prompt = request['messages'][-1]['content']
+            content = "Fake review"
+            if prompt:
+                content += f" ({len(prompt)} chars): {prompt.splitlines()[0]}"
+            self.send_json(200, {
+                'id': f'chatcmpl-fake-{server.requests}',
+                'object': 'chat.completion',
+                'created': int(time.time()),
+                'model': request.get('model', 'fake'),
+                'choices': [{
+                    'index': 0,
+                    'message': {'role': 'assistant', 'content': content},
+                    'finish_reason': 'stop'
+                }],
+                'usage': {'prompt_tokens': len(prompt) // 4,
+                          'completion_tokens': len(content) // 4,
+                          'total_tokens': (len(prompt) + len(content)) // 4}
+            })
+        finally:
+            with server.lock:
+                server.in_flight -= 1
+
+
+def make_server(host='127.0.0.1', port=0, latency=0.0, fail_rate=0.0,
+                verbose=False):
+    """port 0이면 빈 포트를 쓴다. server.server_address로 확인할 수 있다."""
+    server = ThreadingHTTPServer((host, port), FakeOpenAIHandler)
+    server.daemon_threads = True
+    server.latency = latency
+    server.fail_rate = fail_rate
+    server.verbose = verbose
+    server.lock = threading.Lock()
+    server.requests = 0
+    server.failures = 0
+    server.in_flight = 0
+    server.max_in_flight = 0
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--latency", type=float, default=0.0,
+                        help="Seconds to wait before answering each request")
+    parser.add_argument("--fail-rate", type=float, default=0.0,
+                        help="Fraction of requests answered with 429 or 503")
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+
+    server = make_server(args.host, args.port, args.latency, args.fail_rate,
+                         args.verbose)
+    host, port = server.server_address[:2]
+    print(f"Fake OpenAI server is running at http://{host}:{port}/v1")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print(f"requests={server.requests} failures={server.failures} "
+              f"max_in_flight={server.max_in_flight}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,126 @@
+# includeutil.py
+
+import json
+import os
+import tempfile
+
+# 저장 형식이 바뀌면 올린다. 다른 version의 파일은 읽지 않는다.
+INCLUDE_GRAPH_VERSION = 1
+
+
+def include_graph_path(compile_commands):
+    """compile_commands.json 옆에 두는 include graph 파일 경로"""
+    return os.path.join(os.path.dirname(os.path.abspath(compile_commands)),
+                        'compile_commands.includes.json')
+
+
+class IncludeGraph:
+    """
+    TU -> TU가 (간접적으로) include하는 파일들의 색인.
+
+    libclang의 tu.get_includes()로 채우고 compile database 옆에 JSON으로
+    저장한다. TU를 파싱할 때마다 그 TU의 항목만 갱신하므로 프로젝트 전체를
+    다시 파싱하지 않아도 최신 상태에 가깝게 유지된다. 경로는 모두
+    realpath로 저장한다.
+
+    헤더가 바뀌면 includers()가 그 헤더를 쓰는 TU 전체를,
+    select_tus()가 바뀐 헤더들을 모두 덮는 가장 작은 TU 집합을 알려 준다.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.includes = {}  # tu -> set(included paths)
+        self._reverse = None
+        self.dirty = False
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.path, 'r') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        if data.get('version') != INCLUDE_GRAPH_VERSION:
+            return
+        self.includes = {tu: set(paths)
+                         for tu, paths in data['includes'].items()}
+        self._reverse = None
+
+    def save(self):
+        """바뀐 것이 있을 때만 저장한다."""
+        if not self.dirty:
+            return
+        data = {
+            'version': INCLUDE_GRAPH_VERSION,
+            'includes': {tu: sorted(paths)
+                         for tu, paths in sorted(self.includes.items())}
+        }
+        # cacheutil.DiskCache와 같이 임시 파일에 쓴 뒤 rename 한다.
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(data, f)
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        self.dirty = False
+
+    def update(self, tu, includes):
+        """tu를 파싱해서 얻은 include 목록(파일 이름들)으로 항목을 바꾼다."""
+        tu = os.path.realpath(tu)
+        paths = {os.path.realpath(path) for path in includes}
+        if self.includes.get(tu) == paths:
+            return
+        self.includes[tu] = paths
+        self._reverse = None
+        self.dirty = True
+
+    def retain(self, tus):
+        """compile database에서 사라진 TU의 항목을 지운다."""
+        keep = {os.path.realpath(tu) for tu in tus}
+        for tu in [tu for tu in self.includes if tu not in keep]:
+            del self.includes[tu]
+            self._reverse = None
+            self.dirty = True
+
+    def reverse(self):
+        """included path -> 그 파일을 include하는 TU들"""
+        if self._reverse is None:
+            reverse = {}
+            for tu, paths in self.includes.items():
+                for path in paths:
+                    reverse.setdefault(path, set()).add(tu)
+            self._reverse = reverse
+        return self._reverse
+
+    def includers(self, path):
+        return sorted(self.reverse().get(os.path.realpath(path), ()))
+
+    def select_tus(self, headers):
+        """
+        headers를 모두 한 번 이상 include하는 TU들을 greedy set cover로 고른다.
+        어떤 TU도 include하지 않는 헤더는 결과에 없다.
+
+        Returns:
+            dict: TU -> 그 TU를 파싱해서 볼 헤더들(realpath)의 리스트.
+                  많이 덮는 TU가 먼저 온다.
+        """
+        reverse = self.reverse()
+        remaining = {os.path.realpath(h) for h in headers} & reverse.keys()
+        candidates = set()
+        for header in remaining:
+            candidates |= reverse[header]
+
+        selected = {}
+        while remaining:
+            # 덮는 헤더가 같으면 경로 순으로 골라서 결과가 항상 같게 한다.
+            tu = min(candidates,
+                     key=lambda t: (-len(self.includes[t] & remaining), t))
+            covered = self.includes[tu] & remaining
+            selected[tu] = sorted(covered)
+            remaining -= covered
+            candidates.discard(tu)
+        return selected
@@ -0,0 +1,57 @@
+# intervalutil.py
+
+import bisect
+
+
+class IntervalIndex:
+    """
+    중첩될 수 있는 함수 범위들을 겹치지 않는 구간으로 펼쳐 둔 색인.
+
+    extents는 (이름, 종류, 시작 라인, 끝 라인) 형식이다. libclang의
+    buildutil.function_extents()와 clangd documentSymbol에서 만든
+    lsputil.flatten_symbols()의 결과를 모두 받는다.
+
+    각 구간은 그 라인을 감싸는 가장 안쪽 함수(지역 클래스의 메소드 등)에
+    대응하고, 라인 하나는 이진 탐색으로 찾는다.
+    """
+
+    def __init__(self, extents):
+        self.starts = []
+        self.ends = []
+        self.owners = []
+
+        # 시작 라인 오름차순, 같으면 긴 범위(바깥 함수)가 먼저
+        ordered = sorted(extents, key=lambda e: (e[2], -e[3]))
+        stack = []
+        pos = None
+        for extent in ordered:
+            start_line = extent[2]
+            while stack and stack[-1][3] < start_line:
+                top = stack.pop()
+                self._add(pos, top[3], top)
+                pos = max(pos, top[3] + 1)
+            if stack:
+                self._add(pos, start_line - 1, stack[-1])
+            stack.append(extent)
+            pos = start_line
+        while stack:
+            top = stack.pop()
+            self._add(pos, top[3], top)
+            pos = max(pos, top[3] + 1)
+
+    def _add(self, start_line, end_line, extent):
+        if start_line <= end_line:
+            self.starts.append(start_line)
+            self.ends.append(end_line)
+            self.owners.append(extent)
+
+    def lookup(self, line_no):
+        """line_no를 감싸는 가장 안쪽 함수의 extent, 없으면 None"""
+        i = bisect.bisect_right(self.starts, line_no) - 1
+        if i >= 0 and line_no <= self.ends[i]:
+            return self.owners[i]
+        return None
+
+    def lookup_lines(self, line_numbers):
+        """라인 번호마다 lookup()한 결과의 리스트"""
+        return [self.lookup(line_no) for line_no in line_numbers]
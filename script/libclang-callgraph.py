@@ -4,22 +4,57 @@
 
 """
 Dumps a callgraph of a function in a codebase
-usage: callgraph.py file.cpp|compile_commands.json [-x exclude-list] [extra clang args...]
+usage: callgraph.py file.cpp|compile_commands.json|callgraph.cgraph [-x exclude-list] [--jobs N] [extra clang args...]
 The easiest way to generate the file compile_commands.json for any make based
 compilation chain is to use Bear and recompile with `bear make`.
 
+With --jobs N, translation units are parsed by N worker processes
+(0 means one per CPU) and their results are merged in compile database order.
+
+With --db callgraph.sqlite, the callgraph is kept in a SQLite store that
+records which TU produced which edges. Only TUs that are new, whose flags
+changed, or whose own file or included files changed are re-parsed; the
+change set comes from `--git-range A..B` (run in the compile database's git
+repository) or, without it, from the recorded file mtimes.
+
+Besides direct calls, a call to a virtual method is linked to every
+overriding method of the derived classes ([override]), a function whose
+address is taken inside another function is linked from it ([address]), and
+a call through a function pointer is linked to every address-taken function
+of the same type ([pointer]).
+
+With --export callgraph.cgraph, the callgraph is written in a binary
+columnar file that can be given instead of the compile database later; it is
+memory-mapped and queried without parsing anything. --format json|dot prints
+the --lookup result as a JSON or Graphviz subgraph (--depth levels deep)
+instead of the indented text.
+
+With --batch FILE (- for stdin), every line of FILE is a query answered
+against the same parse, and one JSON object per query is printed (JSON
+Lines): the call tree when the function has callees, otherwise the functions
+whose qualified name starts with the query. Progress output goes to stderr.
+
 When running the python script, after parsing all the codebase, you are
 prompted to type in the function's name for which you wan to obtain the
 callgraph
 """
 from pprint import pprint
-from collections import defaultdict
+from collections import Counter, namedtuple
+from contextlib import redirect_stdout
+from functools import partial
+import multiprocessing
 import os
+import subprocess
 import sys
 import platform
 import json
 import yaml
-import re
+
+import buildutil as bu
+import callgraphdb
+import callgraphfile
+import callgraphutil
+import includeutil
 
 config_path = os.path.join(os.path.dirname(__file__), 'config.json')
 
@@ -31,7 +66,7 @@ python_clang_package_dir = config.get('python_clang_package_dir')
 if python_clang_package_dir is not None:
     sys.path.append(python_clang_package_dir)
 
-from clang.cindex import CursorKind, Index, Config
+from clang.cindex import CursorKind, Index, Config, TypeKind
 
 libclang_dir = config.get('libclang_dir')
 
@@ -41,41 +76,188 @@ if libclang_dir is None:
 else:
     Config.set_library_path(libclang_dir)
 
-CALLGRAPH = defaultdict(list)
-FULLNAMES = defaultdict(set)
+GRAPH = callgraphutil.CallGraph()
+
+# 호출되는 함수의 정보. Cursor와 달리 pickle 가능해서
+# worker process에서 parent로 넘길 수 있다.
+Callee = namedtuple('Callee',
+                    ['qualified', 'pretty', 'is_virtual', 'is_pure_virtual',
+                     'usr'],
+                    defaults=('',))
 
 def get_diag_info(diag):
     return {
         'severity': diag.severity,
-        'location': diag.location,
+        'location': str(diag.location),
         'spelling': diag.spelling,
-        'ranges': list(diag.ranges),
-        'fixits': list(diag.fixits)
+        'ranges': [str(r) for r in diag.ranges],
+        'fixits': [str(f) for f in diag.fixits]
     }
 
 
-def fully_qualified(c):
-    if c is None:
+def make_callee(c):
+    qualified, pretty = NAMES.names(c)
+    return Callee(qualified, pretty, c.is_virtual_method(),
+                  c.is_pure_virtual_method(), c.get_usr())
+
+
+class NameResolver:
+    """
+    함수의 qualified name('a::B::f')과 pretty name('a::B::f(int)')을 만들고
+    scope 부분을 기억해 두는 이름 계층.
+
+    namespace나 class 같은 scope의 qualified name을 USR마다 한 번만 만들고,
+    함수 이름은 semantic parent의 캐시에 자신의 spelling/displayname만 붙여
+    만든다. 같은 헤더를 include하는 TU들도 한 process 안에서는 캐시를 함께
+    쓴다.
+
+    함수 자체는 USR로 캐시하지 않는다. 의존 타입을 인자로 받는 template
+    멤버의 overload(std::pair::operator= 등)는 USR이 같을 수 있어서 이름이
+    섞인다.
+    """
+
+    def __init__(self):
+        self.scopes = {}  # scope usr -> qualified
+
+    def scope(self, c):
+        """c와 그 semantic parent들의 spelling을 '::'로 이은 것"""
+        # 캐시에 있는 조상까지 올라간 뒤 내려오면서 채운다.
+        chain = []
+        prefix = ''
+        while c is not None and c.kind != CursorKind.TRANSLATION_UNIT:
+            usr = c.get_usr()
+            if usr and usr in self.scopes:
+                prefix = self.scopes[usr]
+                break
+            chain.append((usr, c.spelling))
+            c = c.semantic_parent
+        for usr, spelling in reversed(chain):
+            prefix = prefix + '::' + spelling if prefix else spelling
+            if usr:
+                self.scopes[usr] = prefix
+        return prefix
+
+    def names(self, c):
+        """(qualified name, pretty name)"""
+        if c is None:
+            return '', ''
+        scope = self.scope(c.semantic_parent)
+        if scope:
+            return scope + '::' + c.spelling, scope + '::' + c.displayname
+        return c.spelling, c.displayname
+
+
+# worker process마다 하나씩 생긴다.
+NAMES = NameResolver()
+
+# 헤더에 있는 정의 중 이 process에서 이미 순회한 것들 ('파일:offset').
+# 다음 TU에서 같은 정의를 만나면 하위 트리를 건너뛴다.
+VISITED_DEFINITIONS = set()
+
+# 헤더에 정의될 수 있고 안쪽에 함수 body를 갖는 것들
+DEFINITION_KINDS = {
+    CursorKind.FUNCTION_DECL,
+    CursorKind.CXX_METHOD,
+    CursorKind.CONSTRUCTOR,
+    CursorKind.DESTRUCTOR,
+    CursorKind.CONVERSION_FUNCTION,
+    CursorKind.FUNCTION_TEMPLATE,
+    CursorKind.CLASS_DECL,
+    CursorKind.STRUCT_DECL,
+    CursorKind.CLASS_TEMPLATE,
+    CursorKind.CLASS_TEMPLATE_PARTIAL_SPECIALIZATION,
+}
+
+# 주소를 얻어서 함수 포인터로 넘길 수 있는 것들
+FUNCTION_KINDS = {
+    CursorKind.FUNCTION_DECL,
+    CursorKind.CXX_METHOD,
+    CursorKind.FUNCTION_TEMPLATE,
+}
+
+CLASS_KINDS = {
+    CursorKind.CLASS_DECL,
+    CursorKind.STRUCT_DECL,
+    CursorKind.CLASS_TEMPLATE,
+    CursorKind.CLASS_TEMPLATE_PARTIAL_SPECIALIZATION,
+}
+
+# 함수 포인터로 호출할 때 CALL_EXPR가 가리키는 것들
+POINTER_KINDS = {
+    CursorKind.VAR_DECL,
+    CursorKind.PARM_DECL,
+    CursorKind.FIELD_DECL,
+}
+
+# CALL_EXPR의 callee를 감싸기만 하는 식 (implicit cast, 괄호)
+CALLEE_WRAPPER_KINDS = {
+    CursorKind.UNEXPOSED_EXPR,
+    CursorKind.PAREN_EXPR,
+}
+
+_realpaths = {}
+
+
+def header_definition_key(node):
+    """
+    main file이 아닌 곳(헤더)에 있는 정의의 '파일:offset'. main file에 있으면
+    None. 같은 헤더를 다른 경로로 include해도 같은 키가 되도록 realpath를 쓴다.
+    """
+    start = node.extent.start
+    if start.file is None:
+        return None
+    name = start.file.name
+    if name == node.translation_unit.spelling:
+        return None
+    return f'{realpath(name)}:{start.offset}'
+
+
+def realpath(name):
+    path = _realpaths.get(name)
+    if path is None:
+        path = _realpaths[name] = os.path.realpath(name)
+    return path
+
+
+def definition_location(node):
+    """정의이면 'real path:line', 선언이면 ''"""
+    if not node.is_definition():
         return ''
-    elif c.kind == CursorKind.TRANSLATION_UNIT:
+    location = node.location
+    if location.file is None:
         return ''
-    else:
-        res = fully_qualified(c.semantic_parent)
-        if res != '':
-            return res + '::' + c.spelling
-        return c.spelling
+    return f'{realpath(location.file.name)}:{location.line}'
 
 
-def fully_qualified_pretty(c):
-    if c is None:
-        return ''
-    elif c.kind == CursorKind.TRANSLATION_UNIT:
-        return ''
-    else:
-        res = fully_qualified(c.semantic_parent)
-        if res != '':
-            return res + '::' + c.displayname
-        return c.displayname
+def function_type(t):
+    """
+    함수 타입, 함수 포인터/참조 타입이면 canonical 함수 타입의 spelling
+    ('int (int, int)'), 아니면 None. typedef가 달라도 같은 값이 된다.
+    """
+    t = t.get_canonical()
+    if t.kind in (TypeKind.POINTER, TypeKind.LVALUEREFERENCE,
+                  TypeKind.RVALUEREFERENCE):
+        t = t.get_pointee()
+    if t.kind in (TypeKind.FUNCTIONPROTO, TypeKind.FUNCTIONNOPROTO):
+        return t.spelling
+    return None
+
+
+def method_signature(c):
+    """
+    override 관계를 찾을 때 쓰는 method의 이름과 인자 타입.
+    반환 타입은 covariant일 수 있으므로 넣지 않는다.
+    """
+    args = ', '.join(a.get_canonical().spelling
+                     for a in c.type.argument_types())
+    const = ' const' if c.is_const_method() else ''
+    return f'{c.spelling}({args}){const}'
+
+
+def new_dispatch():
+    """show_info()가 채우는 dispatch 정보 (CallGraph.merge_dispatch() 참고)"""
+    return {'bases': [], 'virtual_methods': [], 'address_taken': [],
+            'pointer_calls': []}
 
 
 def is_excluded(node, xfiles, xprefs):
@@ -86,7 +268,10 @@ def is_excluded(node, xfiles, xprefs):
         if node.extent.start.file.name.startswith(xf):
             return True
 
-    fqp = fully_qualified_pretty(node)
+    if not xprefs:
+        return False
+
+    fqp = NAMES.names(node)[1]
 
     for xp in xprefs:
         if fqp.startswith(xp):
@@ -95,62 +280,131 @@ def is_excluded(node, xfiles, xprefs):
     return False
 
 
-def show_info(node, xfiles, xprefs, cur_fun=None):
+def show_info(node, xfiles, xprefs, edges, names, cur_fun=None, owner=None,
+              visited=None, dispatch=None, in_callee=False):
+    """
+    edges에 (caller, Callee, owner, edge kind)를 모은다. owner는 edge를
+    감싸는 헤더 정의의 키이고 main file의 정의 안이면 None이다.
+    visited(set)가 주어지면 이미 순회한 헤더 정의의 하위 트리는 건너뛴다.
+
+    호출하지 않고 이름만 쓴 함수(callback 등록 등)는 EDGE_ADDRESS edge가
+    된다. dispatch(new_dispatch())가 주어지면 가상 함수 호출과 함수 포인터
+    호출을 나중에 풀 수 있도록 class 계층, virtual method, 주소가 쓰인
+    함수, 함수 포인터 호출도 같은 순회에서 모은다. in_callee는 node가
+    CALL_EXPR의 callee 자리에 있다는 뜻이다.
+    """
     try: # Workaround: Unknown template argument kind 437 
-        if node.kind == CursorKind.FUNCTION_TEMPLATE:
+        kind = node.kind
+        if owner is None and visited is not None and \
+                kind in DEFINITION_KINDS and node.is_definition():
+            key = header_definition_key(node)
+            if key is not None:
+                if key in visited:
+                    return
+                visited.add(key)
+                owner = key
+
+        if kind == CursorKind.FUNCTION_TEMPLATE:
             if not is_excluded(node, xfiles, xprefs):
                 cur_fun = node
-                FULLNAMES[fully_qualified(cur_fun)].add(
-                    fully_qualified_pretty(cur_fun))
+                names.append(NAMES.names(cur_fun) + (
+                    cur_fun.get_usr(), definition_location(cur_fun)))
 
-        if node.kind == CursorKind.CXX_METHOD or \
-                node.kind == CursorKind.FUNCTION_DECL:
+        if kind == CursorKind.CXX_METHOD or kind == CursorKind.FUNCTION_DECL:
             if not is_excluded(node, xfiles, xprefs):
                 cur_fun = node
-                FULLNAMES[fully_qualified(cur_fun)].add(
-                    fully_qualified_pretty(cur_fun))
-
-        if node.kind == CursorKind.CALL_EXPR:
-            if node.referenced and not is_excluded(node.referenced, xfiles, xprefs):
-                CALLGRAPH[fully_qualified_pretty(cur_fun)].append(node.referenced)
-
+                names.append(NAMES.names(cur_fun) + (
+                    cur_fun.get_usr(), definition_location(cur_fun)))
+                if dispatch is not None and kind == CursorKind.CXX_METHOD \
+                        and node.is_virtual_method():
+                    dispatch['virtual_methods'].append(
+                        (NAMES.scope(node.semantic_parent),
+                         method_signature(node), make_callee(node)))
+
+        if dispatch is not None and kind in CLASS_KINDS and \
+                node.is_definition():
+            for c in node.get_children():
+                if c.kind == CursorKind.CXX_BASE_SPECIFIER and c.referenced:
+                    dispatch['bases'].append((NAMES.scope(node),
+                                              NAMES.scope(c.referenced)))
+
+        if (kind == CursorKind.DECL_REF_EXPR or
+                kind == CursorKind.MEMBER_REF_EXPR) and not in_callee:
+            ref = node.referenced
+            if ref is not None and ref.kind in FUNCTION_KINDS and \
+                    not is_excluded(ref, xfiles, xprefs):
+                callee = make_callee(ref)
+                if cur_fun is not None:
+                    edges.append((NAMES.names(cur_fun)[1], callee, owner,
+                                  callgraphutil.EDGE_ADDRESS))
+                # 멤버 함수 포인터는 일반 함수 포인터로 호출할 수 없다.
+                if dispatch is not None and \
+                        (ref.kind != CursorKind.CXX_METHOD or
+                         ref.is_static_method()):
+                    ftype = function_type(ref.type)
+                    if ftype is not None:
+                        dispatch['address_taken'].append((ftype, callee))
+
+        if kind == CursorKind.CALL_EXPR:
+            ref = node.referenced
+            if ref and not is_excluded(ref, xfiles, xprefs):
+                edges.append((NAMES.names(cur_fun)[1],
+                              make_callee(ref), owner,
+                              callgraphutil.EDGE_DIRECT))
+            if dispatch is not None and cur_fun is not None and \
+                    (ref is None or ref.kind in POINTER_KINDS):
+                children = list(node.get_children())
+                ftype = function_type(children[0].type) if children else None
+                if ftype is not None:
+                    dispatch['pointer_calls'].append(
+                        (NAMES.names(cur_fun)[1], ftype))
+            # callee 자리에서 호출되는 함수를 가리키는 식은 주소를 얻은 것이 아니다.
+            for c in node.get_children():
+                c_ref = c.referenced if ref is not None else None
+                show_info(c, xfiles, xprefs, edges, names, cur_fun, owner,
+                          visited, dispatch,
+                          c_ref is not None and c_ref == ref)
+            return
+
+        in_callee = in_callee and kind in CALLEE_WRAPPER_KINDS
         for c in node.get_children():
-            show_info(c, xfiles, xprefs, cur_fun)
+            show_info(c, xfiles, xprefs, edges, names, cur_fun, owner,
+                      visited, dispatch, in_callee)
     except ValueError as e:
         print(f"Warning: {e}")
 
 
-def pretty_print(n):
+def pretty_print(graph, symbol):
     v = ''
-    if n.is_virtual_method():
+    if graph.flags[symbol] & callgraphutil.VIRTUAL:
         v = ' virtual'
-    if n.is_pure_virtual_method():
+    if graph.flags[symbol] & callgraphutil.PURE_VIRTUAL:
         v = ' = 0'
-    return fully_qualified_pretty(n) + v
+    return graph.pretty[symbol] + v
 
 
-def print_calls(fun_name, so_far, depth=0):
-    if depth >= 15:
-        print('...<too deep>...')
-        return
-    if fun_name in CALLGRAPH:
-        for f in CALLGRAPH[fun_name]:
-            print('  ' * (depth + 1) + pretty_print(f))
-            if f in so_far:
-                continue
-            so_far.append(f)
-            if fully_qualified_pretty(f) in CALLGRAPH:
-                print_calls(fully_qualified_pretty(f), so_far, depth + 1)
-            else:
-                print_calls(fully_qualified(f), so_far, depth + 1)
+def edge_tag(kind):
+    """CALL_EXPR로 찾은 edge가 아니면 어떻게 이었는지 붙인다."""
+    if kind & callgraphutil.EDGE_DIRECT:
+        return ''
+    return ' [' + ', '.join(callgraphutil.edge_kind_names(kind)) + ']'
+
+
+def print_calls(fun_name, max_depth=15):
+    for step in GRAPH.walk(fun_name, max_depth):
+        print('  ' * step.depth + pretty_print(GRAPH, step.symbol) +
+              edge_tag(step.kind))
+        if step.truncated:
+            print('...<too deep>...')
 
 
 def read_compile_commands(filename):
-    if filename.endswith('.json'):
-        with open(filename) as compdb:
-            return json.load(compdb)
-    else:
-        return [{'command': '', 'file': filename}]
+    """
+    compile database의 TU들. plumbing.py와 같이 bu.CompileDatabase로 읽으므로
+    file은 directory 기준으로 푼 realpath이고 args는 libclang 인자다.
+    """
+    return [{'file': path, 'args': bu.command_args(cmd)}
+            for path, cmd in bu.CompileDatabase(filename)]
 
 
 def read_args(args):
@@ -160,6 +414,13 @@ def read_args(args):
     excluded_paths = []
     config_filename = None
     lookup = None
+    jobs = 1
+    callgraph_db = None
+    git_range = None
+    export = None
+    output_format = 'text'
+    depth = None
+    batch = None
     i = 0
     while i < len(args):
         if args[i] == '-x':
@@ -174,6 +435,27 @@ def read_args(args):
         elif args[i] == '--lookup':
             i += 1
             lookup = args[i]
+        elif args[i] in ('-j', '--jobs'):
+            i += 1
+            jobs = int(args[i])
+        elif args[i] == '--db':
+            i += 1
+            callgraph_db = args[i]
+        elif args[i] == '--git-range':
+            i += 1
+            git_range = args[i]
+        elif args[i] == '--export':
+            i += 1
+            export = args[i]
+        elif args[i] == '--format':
+            i += 1
+            output_format = args[i]
+        elif args[i] == '--depth':
+            i += 1
+            depth = int(args[i])
+        elif args[i] == '--batch':
+            i += 1
+            batch = args[i]
         elif args[i][0] == '-':
             clang_args.append(args[i])
         else:
@@ -190,7 +472,14 @@ def read_args(args):
         'excluded_paths': excluded_paths,
         'config_filename': config_filename,
         'lookup': lookup,
-        'ask': (lookup is None)
+        'jobs': jobs or os.cpu_count(),
+        'callgraph_db': callgraph_db,
+        'git_range': git_range,
+        'export': export,
+        'format': output_format,
+        'depth': depth,
+        'batch': batch,
+        'ask': (lookup is None and batch is None)
     }
 
 
@@ -202,60 +491,186 @@ def load_config_file(cfg):
             cfg['excluded_prefixes'] += data['excluded_prefixes']
             cfg['excluded_paths'] += data['excluded_paths']
 
-#Workaround: -sysroot와 -system 인자를 포함하여 추출
-def extract_args(command):
-    # 공백으로 문자열 분리
-    parts = command.split()
-    
-    # 정규 표현식 패턴 정의
-    pattern = re.compile(r'^-I|-D|-isysroot|-isystem|-std=')
-    
-    # 패턴에 맞는 인자 추출
-    extracted_args = []
-    i = 0
-    while i < len(parts):
-        if pattern.match(parts[i]):
-            extracted_args.append(parts[i])
-            # -sysroot와 -system는 다음 인자도 포함해야 함
-            if (parts[i] == '-isysroot' or parts[i] == '-isystem') and i + 1 < len(parts):
-                extracted_args.append(parts[i + 1])
-                i += 1
-        i += 1
-    
-    return extracted_args
+def parse_tu(cmd, cfg):
+    """
+    TU 하나를 파싱해서 call edge와 함수 이름을 모은다.
+
+    worker process에서 실행될 수 있으므로 전역 GRAPH를
+    건드리지 않고 pickle 가능한 결과만 반환한다.
+    """
+    index = Index.create()
+
+    c = cmd['args'] + cfg['clang_args']
+    result = {'file': cmd['file'], 'args': c, 'diags': [],
+              'edges': [], 'names': [], 'includes': [],
+              'dispatch': new_dispatch()}
+
+    tu = index.parse(cmd['file'], c)
+    if not tu:
+        result['diags'].append('unable to load input')
+        return result
+
+    for d in tu.diagnostics:
+        if d.severity == d.Error or d.severity == d.Fatal:
+            result['diags'] = list(map(get_diag_info, tu.diagnostics))
+            # TODO: Error을 출력만 하자. Error이 있어도 동작은 하는 듯 하니.
+            # python clang package version 14가 아닌 경우 발생하는 듯.
+            break
+
+    # 저장소를 쓰면 TU마다 레코드가 완전해야 하므로 TU 안에서만 건너뛴다.
+    visited = set() if cfg['callgraph_db'] else VISITED_DEFINITIONS
+    edges = []
+    dispatch = new_dispatch()
+    show_info(tu.cursor, cfg['excluded_paths'], cfg['excluded_prefixes'],
+              edges, result['names'], visited=visited, dispatch=dispatch)
+    # 같은 caller -> callee 호출은 한 edge로 모으고 호출 위치 수를 센다.
+    result['edges'] = [edge + (count,)
+                       for edge, count in Counter(edges).items()]
+    # 선언과 정의가 모두 이름을 남기므로 한 번씩만 둔다.
+    result['names'] = list(dict.fromkeys(result['names']))
+    result['dispatch'] = {key: list(dict.fromkeys(values))
+                          for key, values in dispatch.items()}
+    result['includes'] = [i.include.name for i in tu.get_includes()]
+    return result
+
+
+def print_tu_result(result):
+    print(result['args'])
+    print(result['file'])
+    if result['diags']:
+        print(' '.join(result['args']))
+        pprint(('diags', result['diags']))
+
+
+def merge_tu_result(result):
+    # caller는 pretty name만 있으므로 USR이 있는 이름을 먼저 넣는다.
+    for name, pretty, usr, location in result['names']:
+        GRAPH.add_name(name, pretty, usr, location)
+    GRAPH.merge_edges(result['edges'])
+    GRAPH.merge_dispatch(result['dispatch'])
+
+
+def parse_tus(cmds, cfg):
+    if cfg['jobs'] <= 1:
+        for cmd in cmds:
+            yield parse_tu(cmd, cfg)
+        return
+
+    # imap은 입력 순서대로 결과를 돌려주므로 병합 결과가 항상 같다.
+    with multiprocessing.Pool(cfg['jobs']) as pool:
+        yield from pool.imap(partial(parse_tu, cfg=cfg), cmds)
+
+
+def git_changed_files(cwd, git_range):
+    """git range에서 바뀐 파일들의 real path"""
+    top = subprocess.check_output(
+        ['git', 'rev-parse', '--show-toplevel'], cwd=cwd, text=True).strip()
+    out = subprocess.check_output(
+        ['git', 'diff', '--name-only', git_range], cwd=top, text=True)
+    return {os.path.realpath(os.path.join(top, line))
+            for line in out.splitlines() if line}
+
+
+def update_callgraph_db(cfg, cmds, include_graph=None, graph=None):
+    """
+    바뀐 TU만 다시 파싱해서 저장소를 갱신하고 graph(기본은 전역 GRAPH)를
+    채운다. 다시 파싱한 TU 수를 돌려준다.
+    """
+    db = callgraphdb.CallGraphDB(cfg['callgraph_db'])
+
+    changed = None
+    if cfg['git_range']:
+        compdb_dir = os.path.dirname(os.path.abspath(cfg['db']))
+        changed = git_changed_files(compdb_dir, cfg['git_range'])
+
+    by_file = {cmd['file']: cmd for cmd in cmds}
+    tus = [(cmd['file'], cmd['args'] + cfg['clang_args']) for cmd in cmds]
+    stale = db.stale_files(tus, changed)
+    print(f'{len(stale)} of {len(tus)} translation units to re-index')
+
+    db.retain_files(by_file.keys())
+    for result in parse_tus([by_file[f] for f in stale], cfg):
+        print_tu_result(result)
+        db.store(result)
+        if include_graph is not None:
+            include_graph.update(result['file'], result['includes'])
+
+    db.load_graph(GRAPH if graph is None else graph)
+    db.close()
+    return len(stale)
+
 
 def analyze_source_files(cfg):
     print('reading source files...')
-    for cmd in read_compile_commands(cfg['db']):
-        index = Index.create()
-
-        c = extract_args(cmd['command']) + cfg['clang_args']
-        print(c)
-        tu = index.parse(cmd['file'], c)
-        print(cmd['file'])
-        if not tu:
-            print("unable to load input")
-
-        for d in tu.diagnostics:
-            if d.severity == d.Error or d.severity == d.Fatal:
-                print(' '.join(c))
-                pprint(('diags', list(map(get_diag_info, tu.diagnostics))))
-                # TODO: Error을 출력만 하자. Error이 있어도 동작은 하는 듯 하니.
-                # python clang package version 14가 아닌 경우 발생하는 듯.
-                #return
-        show_info(tu.cursor, cfg['excluded_paths'], cfg['excluded_prefixes'])
-
-
-def print_callgraph(fun):
-    if fun in CALLGRAPH:
+    cmds = read_compile_commands(cfg['db'])
+
+    # plumbing.py가 헤더 변경을 TU로 옮길 때 쓰는 include graph를 함께 갱신한다.
+    include_graph = None
+    if cfg['db'].endswith('.json'):
+        include_graph = includeutil.IncludeGraph(
+            includeutil.include_graph_path(cfg['db']))
+        include_graph.retain(cmd['file'] for cmd in cmds)
+
+    if cfg['callgraph_db']:
+        update_callgraph_db(cfg, cmds, include_graph)
+    else:
+        for result in parse_tus(cmds, cfg):
+            print_tu_result(result)
+            merge_tu_result(result)
+            if include_graph is not None:
+                include_graph.update(result['file'], result['includes'])
+        GRAPH.resolve_dispatch()
+
+    if include_graph is not None:
+        include_graph.save()
+
+
+def print_callgraph(fun, output_format='text', depth=None):
+    if depth is None:
+        depth = 3
+    if GRAPH.callees(fun) and output_format == 'json':
+        print(json.dumps(callgraphfile.to_json(GRAPH, fun, depth), indent=1))
+    elif GRAPH.callees(fun) and output_format == 'dot':
+        print(callgraphfile.to_dot(GRAPH, fun, depth), end='')
+    elif GRAPH.callees(fun):
         print(fun)
-        print_calls(fun, list())
+        print_calls(fun)
     else:
         print('matching:')
-        for f, ff in FULLNAMES.items():
-            if f.startswith(fun):
-                for fff in ff:
-                    print(fff)
+        for pretty in GRAPH.matching(fun):
+            print(pretty)
+
+
+def query_result(fun, max_depth=15, graph=None):
+    """--batch의 한 줄. callee가 있으면 호출 트리, 없으면 prefix가 맞는 함수들"""
+    if graph is None:
+        graph = GRAPH
+    if not graph.callees(fun):
+        return {'query': fun, 'found': False,
+                'matching': graph.matching(fun)}
+    return {'query': fun, 'found': True, 'calls': [{
+        'depth': step.depth,
+        'name': graph.pretty[step.symbol],
+        'virtual': bool(graph.flags[step.symbol] & callgraphutil.VIRTUAL),
+        'kinds': callgraphutil.edge_kind_names(step.kind),
+        'repeated': step.repeated,
+        'truncated': step.truncated,
+    } for step in graph.walk(fun, max_depth)]}
+
+
+def run_batch(path, max_depth=None):
+    if max_depth is None:
+        max_depth = 15
+    f = sys.stdin if path == '-' else open(path)
+    try:
+        for line in f:
+            fun = line.strip()
+            if fun:
+                print(json.dumps(query_result(fun, max_depth),
+                                 ensure_ascii=False))
+    finally:
+        if f is not sys.stdin:
+            f.close()
 
 
 def ask_and_print_callgraph():
@@ -268,17 +683,30 @@ def ask_and_print_callgraph():
 
 def main():
     if len(sys.argv) < 2:
-        print('usage: ' + sys.argv[0] + ' file.cpp|compile_database.json '
-              '[extra clang args...]')
+        print('usage: ' + sys.argv[0] + ' file.cpp|compile_database.json'
+              '|callgraph' + callgraphfile.EXTENSION +
+              ' [extra clang args...]')
         return
 
     cfg = read_args(sys.argv)
     load_config_file(cfg)
 
-    analyze_source_files(cfg)
-
+    global GRAPH
+    # --batch의 stdout은 JSON만 남긴다.
+    with redirect_stdout(sys.stderr if cfg['batch'] else sys.stdout):
+        if cfg['db'].endswith(callgraphfile.EXTENSION):
+            GRAPH = callgraphfile.MappedCallGraph(cfg['db'])
+        else:
+            analyze_source_files(cfg)
+        if cfg['export']:
+            callgraphfile.write(GRAPH, cfg['export'])
+            print(f"wrote {cfg['export']}: {len(GRAPH)} functions, "
+                  f"{GRAPH.edge_count()} edges")
+
+    if cfg['batch']:
+        run_batch(cfg['batch'], cfg['depth'])
     if cfg['lookup']:
-        print_callgraph(cfg['lookup'])
+        print_callgraph(cfg['lookup'], cfg['format'], cfg['depth'])
     if cfg['ask']:
         ask_and_print_callgraph()
 
@@ -1,129 +1,22 @@
 #!/usr/bin/env python3
 
 import argparse
-import json
-import subprocess
+import asyncio
 import threading
-import time
 import os
 
 from openai import OpenAI
 
-from urllib.parse import urlparse
+from lsputil import ClangdPool
 
-def read_response(process):
-    # Read the Content-Length header
-    content_length_header = process.stdout.readline().decode('utf-8').strip()
-    content_length = int(content_length_header.split(': ')[1])
-    print("Content-Length:", content_length, "\n")
+def print_notification(method, params):
+    print("RECV Notification:", method, params, "\n")
 
-    # Read the empty line
-    process.stdout.readline()   
-    
-    # Read the response based on the Content-Length
-    response = process.stdout.read(content_length).decode('utf-8')
-
-    return json.loads(response)
-
-def receive_notification_and_response(process):
-    response = read_response(process)
-
-    while "id" not in response:
-        print("RECV Notification:", response, "\n")
-        response = read_response(process)
-    
-    print("RECV Response:", response, "\n")
-    return response
-    
-
-def send_notification(process, method, params):
-    request = {
-        "jsonrpc": "2.0",
-        "method": method,
-        "params": params
-    }
-    print("SEND Notification:", request, "\n")
-
-    request_str = json.dumps(request) + '\n'
- 
-    content_length = len(request_str)
-    headers = f"Content-Length: {content_length}\r\n\r\n"
-    process.stdin.write(headers.encode('utf-8'))
-    
-    process.stdin.write(request_str.encode('utf-8'))
-    process.stdin.flush()
-
-req_id = 1
-
-def send_request(process, method, params):
-    global req_id
-
-    request = {
-        "jsonrpc": "2.0",
-        "id": req_id,
-        "method": method,
-        "params": params
-    }
-    req_id += 1
-
-    print("SEND Request:", request, "\n")
-
-    request_str = json.dumps(request) + '\n'
- 
-    content_length = len(request_str)
-    headers = f"Content-Length: {content_length}\r\n\r\n"
-    process.stdin.write(headers.encode('utf-8'))
-    
-    process.stdin.write(request_str.encode('utf-8'))
-    process.stdin.flush()
-    
-    return receive_notification_and_response(process)
-
-def open_file(process, uri):
-    parsed_uri = urlparse(uri)
-    file_path = parsed_uri.path
-
-    # Read the file content
-    with open(file_path, 'r') as file:
-        file_text = file.read()
-
-    # Send a textDocument/completion request
-    send_notification(process, "textDocument/didOpen", {
-        "textDocument": {"uri": uri,
-                         "languageId": "c",
-                         "version": 1,
-                         "text": file_text
-                        }
-    })
-
-def open_files(process, files):
-    for file in files:
-        open_file(process, file)
-
-def get_files(comile_commands_dir):
-    compile_commands = os.path.join(comile_commands_dir, 'compile_commands.json')
-    with open(compile_commands, 'r') as f:
-        compile_commands = json.load(f)
-    
-    files = []
-    for compile_command in compile_commands:
-        files.append('file://'+compile_command['file'])
-    
-    return files
-
-def get_symbol_at_line(process, uri, line):
-    # Send a textDocument/documentSymbol request
-    response = send_request(process, "textDocument/documentSymbol", {
-        "textDocument": {"uri": uri}
-    })
-
-    # Process the documentSymbol response
-    if "result" in response:
-        symbols = response["result"]
-        for symbol in symbols:
-            if symbol["location"]["range"]["start"]["line"] <= line <= symbol["location"]["range"]["end"]["line"]:
-                return symbol
-    return None
+async def get_symbol_at_line(worker, path, line):
+    # documentSymbol은 문서 version마다 한 번만 요청한다.
+    # line은 0부터, symbol index는 1부터 센다.
+    symbol, = await worker.symbols.lookup_lines(path, [line + 1])
+    return symbol
         
 def review_code(file_path):
     with open(file_path, 'r') as file:
@@ -143,50 +36,55 @@ def review_code(file_path):
     print("Code review response for file:", file_path)
     print(completion.choices[0].message.content)
 
-def lsp_main(process, compile_commands_dir, sandbox_project_dir):
-    # Initialize the server
-    send_request(process, "initialize", {
-        "processId": None,
-        "rootUri": None,
-        "capabilities": {
-            "textDocument": {
-                "references": {
-                    "dynamicRegistration": True,
-                    "container": True  # clangd 16 or later
-                }
-            }
-         }
-    })
-    
-    open_files(process, get_files(compile_commands_dir))
-
-    # Wait for seconds
-    time.sleep(1)
-
-    main_uri = 'file://'+os.path.join(sandbox_project_dir, 'src', 'main.c')
-    util_uri = 'file://'+os.path.join(sandbox_project_dir, 'src', 'util.c')
-
-    # Send another request
-    send_request(process, "textDocument/definition", {
-        "textDocument": {"uri": main_uri},
-        "position": {"line": 19-1, "character": 15-1} # zero-based line and character
-    })
-
-    send_request(process, "textDocument/references", {
-        "textDocument": {"uri": util_uri},
-        "position": {"line": 68, "character": 4},  # Adjusted for 0-based indexing
-        "context": {"includeDeclaration": False}
-    })
+async def lsp_main(worker, compile_commands_dir, sandbox_project_dir):
+    client = worker.client
+    client.subscribe("*", print_notification)
+
+    main_path = os.path.join(sandbox_project_dir, 'src', 'main.c')
+    util_path = os.path.join(sandbox_project_dir, 'src', 'util.c')
+
+    # 질의하는 파일만 연다. 프로젝트 전체를 미리 열지 않는다.
+    async with worker.documents.use(main_path) as main_uri, \
+               worker.documents.use(util_path) as util_uri:
+        # 응답을 기다리지 않고 두 요청을 함께 보낸다. 응답은 id로 짝지어진다.
+        definition, references = await asyncio.gather(
+            client.request("textDocument/definition", {
+                "textDocument": {"uri": main_uri},
+                "position": {"line": 19-1, "character": 15-1} # zero-based line and character
+            }),
+            client.request("textDocument/references", {
+                "textDocument": {"uri": util_uri},
+                "position": {"line": 68, "character": 4},  # Adjusted for 0-based indexing
+                "context": {"includeDeclaration": False}
+            })
+        )
+    print("RECV Definition:", definition, "\n")
+    print("RECV References:", references, "\n")
 
     # Get symbol at specific line
-    symbol = get_symbol_at_line(process, main_uri, 18)
+    symbol = await get_symbol_at_line(worker, main_path, 18)
     if symbol:
         print("Symbol at line 18:", symbol)
     else:
         print("No symbol found at line 18.")
 
-    # Shutdown the server
-    send_request(process, "shutdown", {})    
+async def run_lsp(args):
+    with open('err.txt', 'w') as err_file:   
+        pool = ClangdPool(
+            args=['--log=verbose', '--clang-tidy',
+                  '--completion-style=detailed'],
+            stderr=err_file
+        )
+
+        # initialize와 background index가 끝날 때까지 기다린 worker를 빌린다.
+        # 긴 시간 도는 서비스라면 pool을 리뷰 사이에 그대로 둔다.
+        async with pool.borrow(args.sandbox_project_dir,
+                               args.compile_commands_dir) as worker:
+            await lsp_main(worker, args.compile_commands_dir,
+                           args.sandbox_project_dir)
+
+        # Shutdown the server
+        await pool.close()
 
 def run_client():   
     parser = argparse.ArgumentParser()
@@ -211,23 +109,9 @@ def run_client():
     if not os.path.isabs(args.sandbox_project_dir):
         args.sandbox_project_dir = os.path.abspath(args.sandbox_project_dir)
 
-    with open('err.txt', 'w') as err_file:   
-        process = subprocess.Popen(
-            ['clangd', '--log=verbose', '--background-index', '--clang-tidy',
-                       '--completion-style=detailed',
-                       '--compile-commands-dir='+args.compile_commands_dir],
-            stdin=subprocess.PIPE,
-            stdout=subprocess.PIPE,
-            stderr=err_file
-        )
-
-        lsp_main(process, args.compile_commands_dir, args.sandbox_project_dir)
-
-        review_code(os.path.join(args.sandbox_project_dir, 'src', 'main.c'))
+    asyncio.run(run_lsp(args))
 
-        process.stdin.close()
-        process.stdout.close()
-        process.wait()
+    review_code(os.path.join(args.sandbox_project_dir, 'src', 'main.c'))
 
 if __name__ == "__main__":
     client_thread = threading.Thread(target=run_client)
@@ -0,0 +1,696 @@
+# lsputil.py
+
+import asyncio
+import collections
+import contextlib
+import hashlib
+import itertools
+import json
+import os
+import pathlib
+import sys
+
+from collections import defaultdict
+from urllib.parse import unquote, urlparse
+
+from intervalutil import IntervalIndex
+
+# background index가 끝나기를 기다리는 기본 시간(초). indexing이 꺼져 있거나
+# 중간에 죽으면 끝났다는 progress가 오지 않는다.
+INDEX_TIMEOUT = 300
+
+
+def path_to_uri(path):
+    return pathlib.Path(path).absolute().as_uri()
+
+
+def uri_to_path(uri):
+    return unquote(urlparse(uri).path)
+
+
+def encode_message(message):
+    """JSON-RPC 메시지를 LSP base protocol의 byte열로 만든다."""
+    body = json.dumps(message, ensure_ascii=False).encode('utf-8')
+    # Content-Length는 문자 수가 아니라 UTF-8 byte 수
+    return b'Content-Length: %d\r\n\r\n' % len(body) + body
+
+
+class MessageReader:
+    """
+    LSP base protocol framing 계층.
+
+    feed()로 받은 byte를 하나의 bytearray에 쌓아 두고, 완성된 메시지를
+    memoryview로 잘라 바로 JSON으로 decode 한다. 모든 header를 읽으며
+    (이름은 대소문자 구분 없음) Content-Type의 charset도 따른다.
+    """
+
+    def __init__(self):
+        self.buffer = bytearray()
+        self.start = 0
+        # header는 읽었지만 body가 아직 다 오지 않은 메시지의
+        # (self.start 기준 body 시작 offset, body 길이, charset).
+        # 큰 body를 기다리는 동안 header를 다시 찾지 않기 위해 둔다.
+        self.expected = None
+
+    def feed(self, data):
+        self.buffer += data
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        message = self.next_message()
+        if message is None:
+            raise StopIteration
+        return message
+
+    def next_message(self):
+        """완성된 메시지가 있으면 decode해서 돌려주고, 없으면 None."""
+        buffer = self.buffer
+        if self.expected is None:
+            header_end = buffer.find(b'\r\n\r\n', self.start)
+            if header_end < 0:
+                self._compact()
+                return None
+            self.expected = self.parse_header_block(
+                memoryview(buffer)[self.start:header_end])
+            self.expected[0] = header_end + 4 - self.start
+
+        body_offset, content_length, charset = self.expected
+        body_start = self.start + body_offset
+        body_end = body_start + content_length
+        if len(buffer) < body_end:
+            self._compact()
+            return None
+
+        with memoryview(buffer) as view:
+            message = json.loads(str(view[body_start:body_end], charset))
+        self.start = body_end
+        self.expected = None
+        return message
+
+    @classmethod
+    def parse_header_block(cls, view):
+        headers = cls.parse_headers(view)
+        try:
+            content_length = int(headers['content-length'])
+        except (KeyError, ValueError):
+            raise ValueError(f"Invalid LSP headers: {headers}")
+
+        charset = 'utf-8'
+        for param in headers.get('content-type', '').split(';')[1:]:
+            name, _, value = param.partition('=')
+            if name.strip().lower() == 'charset':
+                charset = value.strip().strip('"')
+                if charset.lower() == 'utf8':  # 예전 vscode가 쓰던 값
+                    charset = 'utf-8'
+        return [None, content_length, charset]
+
+    @staticmethod
+    def parse_headers(view):
+        headers = {}
+        for line in str(view, 'ascii').split('\r\n'):
+            name, sep, value = line.partition(':')
+            if sep:
+                headers[name.strip().lower()] = value.strip()
+        return headers
+
+    def _compact(self):
+        # 읽은 메시지들은 다음 feed() 전에 한 번에 버린다.
+        if self.start:
+            del self.buffer[:self.start]
+            self.start = 0
+
+
+class LspError(Exception):
+    """LSP 서버가 error로 응답한 요청"""
+
+    def __init__(self, error):
+        super().__init__(f"{error.get('message')} (code {error.get('code')})")
+        self.code = error.get('code')
+        self.message = error.get('message')
+        self.data = error.get('data')
+
+
+class LspClient:
+    """
+    asyncio 기반 JSON-RPC(LSP) client.
+
+    응답을 기다리지 않고 여러 요청을 보낼 수 있으며, 응답은 id로 요청과
+    짝지어진다. Notification은 subscribe()로 등록한 callback에 전달되고,
+    서버가 보내는 요청(window/workDoneProgress/create 등)에는
+    request_handlers의 handler로, 없으면 null로 답한다.
+    """
+
+    # stdout에서 한 번에 읽을 byte 수
+    read_size = 1 << 16
+
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.process = None
+        self.ids = itertools.count(1)
+        self.pending = {}
+        self.subscribers = defaultdict(list)
+        self.request_handlers = {}
+        self.reader_task = None
+
+    @classmethod
+    async def spawn(cls, cmd, stderr=None):
+        """cmd(예: clangd)를 실행하고 stdin/stdout으로 연결한다."""
+        process = await asyncio.create_subprocess_exec(
+            *cmd,
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=stderr
+        )
+        client = cls(process.stdout, process.stdin)
+        client.process = process
+        client.start()
+        return client
+
+    def start(self):
+        self.reader_task = asyncio.create_task(self._read_loop())
+
+    async def _send(self, message):
+        self.writer.write(encode_message(message))
+        await self.writer.drain()
+
+    async def _read_loop(self):
+        error = ConnectionError("LSP server closed the connection")
+        framer = MessageReader()
+        try:
+            while True:
+                data = await self.reader.read(self.read_size)
+                if not data:
+                    break
+                framer.feed(data)
+                for message in framer:
+                    self._dispatch(message)
+        except Exception as e:
+            error = e
+        finally:
+            for future in self.pending.values():
+                if not future.done():
+                    future.set_exception(error)
+            self.pending.clear()
+
+    def _dispatch(self, message):
+        method = message.get('method')
+        if method is not None:
+            if 'id' in message:
+                asyncio.create_task(self._answer(message))
+                return
+            params = message.get('params')
+            for callback in list(self.subscribers.get(method, [])) + \
+                    list(self.subscribers.get('*', [])):
+                callback(method, params)
+            return
+
+        future = self.pending.pop(message.get('id'), None)
+        if future is None or future.done():
+            return
+        if 'error' in message:
+            future.set_exception(LspError(message['error']))
+        else:
+            future.set_result(message.get('result'))
+
+    async def _answer(self, message):
+        handler = self.request_handlers.get(message['method'])
+        result = None
+        if handler is not None:
+            result = handler(message.get('params'))
+            if asyncio.iscoroutine(result):
+                result = await result
+        await self._send({"jsonrpc": "2.0", "id": message['id'],
+                          "result": result})
+
+    def subscribe(self, method, callback):
+        """
+        method('*'이면 모든 notification)에 callback(method, params)을
+        등록한다. 등록을 해제하는 함수를 돌려준다.
+        """
+        self.subscribers[method].append(callback)
+        return lambda: self.subscribers[method].remove(callback)
+
+    async def notify(self, method, params=None):
+        message = {"jsonrpc": "2.0", "method": method}
+        if params is not None:
+            message["params"] = params
+        await self._send(message)
+
+    def cancel(self, request_id):
+        """$/cancelRequest를 보낸다. 응답은 더 이상 기다리지 않는다."""
+        future = self.pending.pop(request_id, None)
+        if future is not None and not future.done():
+            future.cancel()
+        return asyncio.ensure_future(
+            self.notify("$/cancelRequest", {"id": request_id}))
+
+    async def request(self, method, params=None, timeout=None):
+        """
+        요청을 보내고 응답의 result를 돌려준다.
+
+        timeout(초)이 지나거나 호출한 task가 취소되면 서버에
+        $/cancelRequest를 보내고 asyncio.TimeoutError/CancelledError를 낸다.
+        """
+        request_id = next(self.ids)
+        future = asyncio.get_running_loop().create_future()
+        self.pending[request_id] = future
+
+        message = {"jsonrpc": "2.0", "id": request_id, "method": method}
+        if params is not None:
+            message["params"] = params
+        await self._send(message)
+
+        try:
+            return await asyncio.wait_for(future, timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError):
+            self.cancel(request_id)
+            raise
+
+    async def initialize(self, root_uri=None, capabilities=None,
+                         timeout=None):
+        result = await self.request("initialize", {
+            "processId": None,
+            "rootUri": root_uri,
+            "capabilities": capabilities or {}
+        }, timeout)
+        await self.notify("initialized", {})
+        return result
+
+    async def shutdown(self, timeout=10):
+        """shutdown/exit를 보내고 서버 process가 끝나기를 기다린다."""
+        try:
+            await self.request("shutdown", timeout=timeout)
+            await self.notify("exit")
+        except (ConnectionError, asyncio.TimeoutError):
+            pass
+        self.writer.close()
+        if self.process is not None:
+            try:
+                await asyncio.wait_for(self.process.wait(), timeout)
+            except asyncio.TimeoutError:
+                self.process.kill()
+                await self.process.wait()
+        if self.reader_task is not None:
+            await self.reader_task
+
+
+def language_id(path):
+    return 'c' if path.endswith('.c') else 'cpp'
+
+
+class OpenDocument:
+    def __init__(self, uri, version, stat, digest):
+        self.uri = uri
+        self.version = version
+        self.stat = stat
+        self.digest = digest
+        self.pins = 0
+
+
+class DocumentManager:
+    """
+    서버에 열어 둔 문서를 LRU로 관리한다.
+
+    질의가 처음 닿는 파일만 didOpen 하고, 열린 문서가 max_open개를 넘으면
+    가장 오래 쓰지 않은 문서부터 didClose 한다. 파일 내용이 바뀌었으면
+    didChange로 새 내용을 보낸다. 프로젝트 크기와 상관없이 서버가 들고 있는
+    AST 수가 max_open개 정도로 묶인다.
+
+        async with documents.use(path) as uri:
+            await client.request("textDocument/documentSymbol", ...)
+
+    use() 안에 있는 문서는 쫓아내지 않는다. version은 manager 안에서 계속
+    증가하므로 닫았다가 다시 연 문서도 이전과 다른 version을 받는다.
+    """
+
+    def __init__(self, client, max_open=32):
+        self.client = client
+        self.max_open = max_open
+        self.last_version = 0
+        self.documents = collections.OrderedDict()  # path -> OpenDocument
+        self.lock = asyncio.Lock()
+        self.opens = 0
+        self.changes = 0
+        self.closes = 0
+
+    async def ensure_open(self, path):
+        """path가 최신 내용으로 열려 있게 하고 uri를 돌려준다."""
+        path = os.path.realpath(path)
+        async with self.lock:
+            await self._sync(path)
+            await self._evict(keep=path)
+            return self.documents[path].uri
+
+    async def _sync(self, path):
+        st = os.stat(path)
+        stat = (st.st_mtime_ns, st.st_size)
+        document = self.documents.get(path)
+        if document is not None:
+            self.documents.move_to_end(path)
+            if document.stat == stat:
+                return
+
+        with open(path, 'r') as f:
+            text = f.read()
+        digest = hashlib.sha1(text.encode('utf-8')).digest()
+
+        self.last_version += 1
+        if document is None:
+            uri = path_to_uri(path)
+            self.documents[path] = OpenDocument(uri, self.last_version, stat,
+                                                digest)
+            self.opens += 1
+            await self.client.notify("textDocument/didOpen", {
+                "textDocument": {"uri": uri,
+                                 "languageId": language_id(path),
+                                 "version": self.last_version,
+                                 "text": text}
+            })
+            return
+
+        document.stat = stat
+        if document.digest == digest:
+            return
+        document.digest = digest
+        document.version = self.last_version
+        self.changes += 1
+        await self.client.notify("textDocument/didChange", {
+            "textDocument": {"uri": document.uri,
+                             "version": document.version},
+            "contentChanges": [{"text": text}]
+        })
+
+    async def _evict(self, keep=None):
+        """
+        max_open개를 넘은 만큼 잡혀 있지 않은 문서를 오래된 것부터 닫는다.
+        keep(방금 연 문서)은 닫지 않으므로, 나머지가 모두 잡혀 있으면 잠시
+        max_open개를 넘을 수 있다.
+        """
+        excess = len(self.documents) - self.max_open
+        if excess <= 0:
+            return
+        victims = [path for path, document in self.documents.items()
+                   if document.pins == 0 and path != keep][:excess]
+        for path in victims:
+            document = self.documents.pop(path)
+            self.closes += 1
+            await self.client.notify("textDocument/didClose", {
+                "textDocument": {"uri": document.uri}
+            })
+
+    @contextlib.asynccontextmanager
+    async def use(self, path):
+        """질의하는 동안 문서가 닫히지 않도록 잡아 둔다."""
+        path = os.path.realpath(path)
+        async with self.lock:
+            await self._sync(path)
+            document = self.documents[path]
+            document.pins += 1
+            await self._evict()
+        try:
+            yield document.uri
+        finally:
+            document.pins -= 1
+
+    def version(self, path):
+        document = self.documents.get(os.path.realpath(path))
+        return document.version if document is not None else None
+
+    def stats(self):
+        return {
+            'open': len(self.documents),
+            'opens': self.opens,
+            'changes': self.changes,
+            'closes': self.closes
+        }
+
+
+# clangd에 알리는 client capability
+CLIENT_CAPABILITIES = {
+    "window": {
+        # backgroundIndexProgress를 받아서 index가 끝났는지 안다.
+        "workDoneProgress": True
+    },
+    "textDocument": {
+        "references": {
+            "dynamicRegistration": True,
+            "container": True  # clangd 16 or later
+        },
+        "documentSymbol": {
+            # 평평한 SymbolInformation 대신 중첩된 DocumentSymbol을 받는다.
+            "hierarchicalDocumentSymbolSupport": True
+        }
+    }
+}
+
+BACKGROUND_INDEX_TOKEN = 'backgroundIndexProgress'
+
+
+def compile_commands_files(compile_commands_dir):
+    """compile_commands.json의 파일들을 절대 경로로"""
+    path = os.path.join(compile_commands_dir, 'compile_commands.json')
+    with open(path, 'r') as f:
+        compile_commands = json.load(f)
+    return [os.path.join(cmd.get('directory', ''), cmd['file'])
+            for cmd in compile_commands]
+
+
+# LSP SymbolKind 중에서 함수로 보는 것들. 값은 같은 뜻의 libclang CursorKind
+# 이름이라서 buildutil.function_extents()의 결과와 바꿔 쓸 수 있다.
+FUNCTION_SYMBOL_KINDS = {6: 'CXX_METHOD', 9: 'CONSTRUCTOR', 12: 'FUNCTION_DECL'}
+
+
+def symbol_spelling(name):
+    """
+    clangd 심볼 이름을 libclang의 cursor.spelling 모양으로 바꾼다.
+    'Foo::bar' -> 'bar', 'max<int>' -> 'max'
+    """
+    name = name.rsplit('::', 1)[-1]
+    if not name.startswith('operator'):
+        name = name.split('<', 1)[0]
+    return name
+
+
+def flatten_symbols(symbols, kinds=FUNCTION_SYMBOL_KINDS):
+    """
+    documentSymbol 응답을 buildutil.function_extents()와 같은 형식으로 편다.
+
+    중첩된 DocumentSymbol 트리와 평평한 SymbolInformation 리스트를 모두
+    받는다. kinds에 속한 심볼만 남기고 라인 번호는 1부터 센다.
+
+    Returns:
+        list: (이름, kinds의 값, 시작 라인, 끝 라인)의 리스트.
+              바깥 심볼이 먼저 온다.
+    """
+    extents = []
+    stack = list(reversed(symbols or []))
+    while stack:
+        symbol = stack.pop()
+        if 'location' in symbol:
+            symbol_range = symbol['location']['range']
+        else:
+            symbol_range = symbol['range']
+            stack.extend(reversed(symbol.get('children') or []))
+        kind = kinds.get(symbol['kind'])
+        if kind is not None:
+            extents.append((symbol_spelling(symbol['name']), kind,
+                            symbol_range['start']['line'] + 1,
+                            symbol_range['end']['line'] + 1))
+    return extents
+
+
+class SymbolIndex:
+    """
+    문서 version마다 documentSymbol을 한 번만 요청해서 구간 색인으로
+    만들어 두고, 라인 번호 여러 개를 한 번에 찾는다.
+
+        extents = await symbols.extents(path)
+        owners = await symbols.lookup_lines(path, [10, 42, 43])
+    """
+
+    def __init__(self, client, documents, kinds=FUNCTION_SYMBOL_KINDS,
+                 max_entries=1024):
+        self.client = client
+        self.documents = documents
+        self.kinds = kinds
+        self.max_entries = max_entries
+        self.entries = collections.OrderedDict()  # path -> (version, extents, index)
+        self.requests = 0
+
+    async def _entry(self, path):
+        path = os.path.realpath(path)
+        async with self.documents.use(path) as uri:
+            version = self.documents.version(path)
+            entry = self.entries.get(path)
+            if entry is not None and entry[0] == version:
+                self.entries.move_to_end(path)
+                return entry
+
+            self.requests += 1
+            symbols = await self.client.request(
+                "textDocument/documentSymbol", {"textDocument": {"uri": uri}})
+        extents = flatten_symbols(symbols, self.kinds)
+        entry = (version, extents, IntervalIndex(extents))
+        self.entries[path] = entry
+        self.entries.move_to_end(path)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+        return entry
+
+    async def extents(self, path):
+        return (await self._entry(path))[1]
+
+    async def lookup_lines(self, path, line_numbers):
+        """라인 번호(1부터)마다 그 라인을 감싸는 가장 안쪽 심볼의 extent"""
+        return (await self._entry(path))[2].lookup_lines(line_numbers)
+
+
+class ClangdWorker:
+    """project root 하나를 맡는 오래 사는 clangd process"""
+
+    def __init__(self, root, compile_commands_dir=None, clangd='clangd',
+                 args=(), stderr=asyncio.subprocess.DEVNULL, max_open=32):
+        self.root = root
+        self.compile_commands_dir = compile_commands_dir or root
+        self.clangd = clangd
+        self.args = list(args)
+        self.stderr = stderr
+        self.max_open = max_open
+        self.client = None
+        self.documents = None
+        self.symbols = None
+        self.indexed = None
+        self.borrowed = 0
+
+    @property
+    def alive(self):
+        return self.client is not None and \
+            self.client.process.returncode is None and \
+            not self.client.reader_task.done()
+
+    async def start(self):
+        self.indexed = asyncio.Event()
+        self.client = await LspClient.spawn(
+            [self.clangd, '--background-index',
+             '--compile-commands-dir=' + self.compile_commands_dir] +
+            self.args,
+            stderr=self.stderr
+        )
+        self.client.request_handlers['window/workDoneProgress/create'] = \
+            lambda params: None
+        self.client.subscribe('$/progress', self._on_progress)
+        self.documents = DocumentManager(self.client, self.max_open)
+        self.symbols = SymbolIndex(self.client, self.documents)
+        await self.client.initialize(path_to_uri(self.root),
+                                     CLIENT_CAPABILITIES)
+
+        # clangd는 파일이 처음 열릴 때 compile database를 읽고
+        # background index를 시작하므로 파일 하나를 열어 둔다.
+        files = compile_commands_files(self.compile_commands_dir)
+        if files:
+            await self.documents.ensure_open(files[0])
+        else:
+            self.indexed.set()
+
+    def _on_progress(self, method, params):
+        if params.get('token') != BACKGROUND_INDEX_TOKEN:
+            return
+        kind = params.get('value', {}).get('kind')
+        if kind == 'begin':
+            self.indexed.clear()
+        elif kind == 'end':
+            self.indexed.set()
+
+    async def wait_indexed(self, timeout=INDEX_TIMEOUT):
+        """
+        background index가 끝났다는 progress를 받을 때까지 최대 timeout초
+        기다린다. 시간이 지나면 경고만 남기고 일부만 만들어진 index로
+        계속한다. timeout이 None이면 끝까지 기다린다.
+
+        Returns:
+            bool: index가 끝났으면 True
+        """
+        try:
+            await asyncio.wait_for(self.indexed.wait(), timeout)
+        except asyncio.TimeoutError:
+            print(f"Warning: clangd background index for {self.root} did not "
+                  f"finish in {timeout} s, continuing with a partial index",
+                  file=sys.stderr)
+            return False
+        return True
+
+    async def stop(self):
+        if self.client is None:
+            return
+        # 이미 죽은 process라도 shutdown이 pipe와 reader를 정리한다.
+        await self.client.shutdown()
+        self.client = None
+        self.documents = None
+        self.symbols = None
+
+
+class ClangdPool:
+    """
+    project root마다 clangd를 하나씩 띄워 두고 리뷰 사이에 재사용하는 pool.
+
+        pool = ClangdPool()
+        async with pool.borrow(root, compile_commands_dir) as worker:
+            async with worker.documents.use(path) as uri:
+                await worker.client.request("textDocument/references", ...)
+
+    LspClient는 요청을 id로 구분하므로 여러 호출자가 같은 worker를 동시에
+    빌릴 수 있다. 죽은 worker는 다음에 빌릴 때 다시 띄운다.
+    """
+
+    def __init__(self, clangd='clangd', args=(),
+                 stderr=asyncio.subprocess.DEVNULL, max_open=32):
+        self.clangd = clangd
+        self.args = list(args)
+        self.stderr = stderr
+        self.max_open = max_open
+        self.workers = {}
+        self.locks = {}
+        self.restarts = 0
+
+    async def worker(self, root, compile_commands_dir=None):
+        root = os.path.realpath(root)
+        lock = self.locks.setdefault(root, asyncio.Lock())
+        async with lock:
+            worker = self.workers.get(root)
+            if worker is not None and not worker.alive:
+                self.restarts += 1
+                await worker.stop()
+                worker = None
+            if worker is None:
+                worker = ClangdWorker(root, compile_commands_dir,
+                                      self.clangd, self.args, self.stderr,
+                                      self.max_open)
+                await worker.start()
+                self.workers[root] = worker
+            return worker
+
+    @contextlib.asynccontextmanager
+    async def borrow(self, root, compile_commands_dir=None,
+                     wait_indexed=True, timeout=INDEX_TIMEOUT):
+        """
+        root의 ClangdWorker를 빌려 준다. worker.client로 요청을 보내고
+        worker.documents로 문서를 연다.
+        wait_indexed이면 background index가 끝날 때까지(최대 timeout초)
+        기다린 뒤에 돌려준다.
+        """
+        worker = await self.worker(root, compile_commands_dir)
+        if wait_indexed:
+            await worker.wait_indexed(timeout)
+        worker.borrowed += 1
+        try:
+            yield worker
+        finally:
+            worker.borrowed -= 1
+
+    async def close(self):
+        for worker in self.workers.values():
+            await worker.stop()
+        self.workers.clear()
@@ -1,15 +1,22 @@
 #!/usr/bin/env python3
 
 import argparse
-import io
+import asyncio
 import os
+import subprocess
 import sys
 import json
 
 from git import Repo
-from openai import OpenAI
 
+import cacheutil
+import callgraphdb
+import callgraphfile
 import diffutil
+import includeutil
+import lsputil
+import promptutil
+import reviewutil
 import buildutil as bu
 
 # --- Begin of configuration ---
@@ -31,127 +38,328 @@ if libclang_dir is not None:
     Config.set_library_path(libclang_dir)
 # --- End of configuration ---
 
-def git_diff(repo, commit1, commit2):
+# get_git_diff가 리뷰하는 C/C++ 파일. git pathspec으로 넘겨서 나머지 파일의
+# patch는 git이 아예 만들지 않게 한다.
+CODE_PATHSPECS = ['*.c', '*.cpp', '*.h', '*.hpp']
+
+def git_diff(repo, commit1, commit2, pathspecs=None, context_lines=3,
+             find_renames=True):
     """
     Generate a diff between two commits in a git repository.
 
+    `git diff`를 subprocess로 실행하고 그 출력을 그대로
+    diffutil.GitDiffParser.parse_stream()에 흘려 보낸다.
+
     Args:
         repo (git.Repo): The git repository object.
         commit1 (str): The SHA or reference of the first commit.
         commit2 (str): The SHA or reference of the second commit.
+        pathspecs (list): Only diff paths matching these git pathspecs.
+        context_lines (int): Lines of context around each change (-U<n>).
+        find_renames (bool): Detect renamed files (-M).
 
-    Returns:
-        str: A string representing the diff between the two commits in
-             unified diff format.
+    Yields:
+        diffutil.DiffFile: One per changed file, in git's output order.
+                           Deleted files are skipped.
     """
-    commit = repo.commit(commit1)
-    diffs = commit.diff(commit2, create_patch=True)
-
-    txt = io.StringIO()
-
-    for diff in diffs:
-        txt.write('diff --git a/'+diff.a_path+' b/'+diff.b_path+"\n")
-        txt.write('--- a/'+diff.a_path+"\n")
-        txt.write('+++ b/'+diff.b_path+"\n")
-        txt.write(diff.diff.decode('utf-8'))
-
-    str = txt.getvalue()
-    txt.close()
-    return str
-
-def get_git_diff(repo, commit1, commit2):
-    diff_text = git_diff(repo, commit1, commit2)
+    cmd = ['git', '-c', 'core.quotepath=off', 'diff',
+           '--no-color', '--no-ext-diff', '--src-prefix=a/', '--dst-prefix=b/',
+           '--diff-filter=d', f'-U{context_lines}',
+           '-M' if find_renames else '--no-renames',
+           commit1, commit2, '--']
+    if pathspecs:
+        cmd += pathspecs
+
+    process = subprocess.Popen(
+        cmd,
+        cwd=repo.working_tree_dir,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        encoding='utf-8',
+        errors='replace'
+    )
 
     parser = diffutil.GitDiffParser()
-    diffs = parser.parse(diff_text)
-
+    try:
+        yield from parser.parse_stream(process.stdout)
+    finally:
+        process.stdout.close()
+        stderr = process.stderr.read()
+        process.stderr.close()
+        returncode = process.wait()
+
+    if returncode != 0:
+        raise subprocess.CalledProcessError(returncode, cmd, stderr=stderr)
+
+def get_git_diff(repo, commit1, commit2, context_lines=3, find_renames=True):
     # TODO: C/C++ 파일과 나머지 파일의 처리를 분리해야 함.
     # 빌드 관련 파일, 문서, 리소스 파일, 소스 코드 등으로 분리 가능.
-    code_diffs = [
-        diff for diff in diffs 
-        if diff.new_path.endswith((".c", ".cpp"))
-    ]
+    code_diffs = list(git_diff(repo, commit1, commit2, CODE_PATHSPECS,
+                               context_lines, find_renames))
 
     return (code_diffs, diffutil.changed_line_numbers(code_diffs))
 
-def find_functions(compile_commands, rootdir, changd_lines):
+def function_cache_key(file_path, args, parse_mode):
+    """파일 내용과 컴파일 플래그로 함수 범위 캐시의 키를 만든다."""
+    with open(file_path, 'rb') as f:
+        content = f.read()
+    return cacheutil.hash_key(bu.FUNCTION_EXTENTS_VERSION, parse_mode,
+                              content, args)
+
+def find_functions(compile_commands, rootdir, changd_lines, cache=None,
+                   parse_mode='full', extents_by_file=None,
+                   include_graph=None):
+    """
+    extents_by_file(dict)가 주어지면 파일별 function extent도 채워 준다.
+    prompt에 함수 본문을 넣을 때 쓴다.
+
+    include_graph(includeutil.IncludeGraph)가 주어지면 compile database에
+    없는 헤더는 그 헤더를 include하는 TU를 파싱해서 찾는다. 바뀐 헤더들을
+    모두 덮는 가장 작은 TU 집합만 파싱하고, 파싱한 소스 파일의 include
+    목록으로 graph를 갱신한다. graph에 없는 헤더는 가장 가까운 TU의
+    인자로 헤더만 파싱한다. single-file mode는 #include를 따라가지 않으므로
+    include graph를 쓰지도 갱신하지도 않는다.
+    """
+    if parse_mode not in bu.INCLUDE_PARSE_MODES:
+        include_graph = None
+
+    header_tus = {}
+    if include_graph is not None:
+        headers = [os.path.join(rootdir, file) for file in changd_lines
+                   if os.path.join(rootdir, file) not in compile_commands]
+        for tu_path, covered in include_graph.select_tus(headers).items():
+            for header in covered:
+                header_tus[header] = tu_path
+                print(f"Header {header}: included by "
+                      f"{len(include_graph.includers(header))} translation "
+                      f"units, parsing {tu_path}", file=sys.stderr)
+
     functions = {}
-    index = Index.create()
+    index = None
+    parsed = {}  # 헤더 여러 개를 덮는 TU는 한 번만 파싱한다.
     for file in changd_lines.keys():
         file_path = os.path.join(rootdir, file)
-
-        cmd = compile_commands[file_path]
-        c = bu.extract_args(cmd['command'])
-
-        tu = index.parse(cmd['file'], c)
-        function_list = bu.find_functions_in_file(
-            tu, file_path, changd_lines[file]
+        tu_path = header_tus.get(os.path.realpath(file_path))
+        # 다른 mode는 헤더의 함수 body를 건너뛰거나 헤더를 아예 읽지 않으므로
+        # TU를 통해 헤더를 볼 때는 full로 파싱해야 한다.
+        mode = parse_mode if tu_path is None else 'full'
+
+        try:
+            c = compile_commands.args(tu_path or file_path)
+        except KeyError:
+            print(f"Warning: no compile command for {file}", file=sys.stderr)
+            continue
+
+        file_extents = None
+        if cache is not None:
+            key_args = c if tu_path is None else [tu_path] + c
+            key = function_cache_key(file_path, key_args, mode)
+            file_extents = cache.get(key)
+
+        # 캐시에 없을 때만 libclang으로 파싱한다.
+        if file_extents is None:
+            if index is None:
+                index = Index.create()
+            if tu_path is None:
+                tu = bu.parse_for_extents(index, file_path, c, mode)
+                file_extents = bu.function_extents(tu.cursor, file_path)
+                if include_graph is not None and \
+                        file_path in compile_commands:
+                    include_graph.update(file_path, bu.include_names(tu))
+            else:
+                tu = parsed.get(tu_path)
+                if tu is None:
+                    tu = parsed[tu_path] = bu.parse_for_extents(
+                        index, tu_path, c, mode)
+                    include_graph.update(tu_path, bu.include_names(tu))
+                name = bu.included_file_name(tu, file_path)
+                file_extents = bu.function_extents(tu.cursor, name) \
+                    if name else []
+            if cache is not None:
+                cache.put(key, file_extents)
+
+        if extents_by_file is not None:
+            extents_by_file[file] = file_extents
+
+        function_list = bu.functions_at_lines(
+            file_extents, file_path, changd_lines[file]
         )
         functions[file] = function_list
 
     return functions
 
-def find_dependents(functions):
+async def clangd_extents(rootdir, compile_commands_dir, file_paths,
+                         clangd='clangd'):
+    pool = lsputil.ClangdPool(clangd)
+    try:
+        # documentSymbol은 background index가 없어도 답할 수 있다.
+        async with pool.borrow(rootdir, compile_commands_dir,
+                               wait_indexed=False) as worker:
+            return await asyncio.gather(
+                *(worker.symbols.extents(path) for path in file_paths))
+    finally:
+        await pool.close()
+
+def find_functions_clangd(compile_commands_dir, rootdir, changd_lines,
+                          extents_by_file=None, clangd='clangd'):
     """
-    System resource 등을 통한 간접적인 의존성을 갖는 함수를 찾자.
+    find_functions()와 같은 결과를 libclang 대신 clangd의 documentSymbol로
+    만든다. 파일마다 요청은 한 번이고 라인들은 구간 색인에서 찾는다.
+    clangd는 함수 안의 지역 클래스 메소드는 알려 주지 않는다.
     """
-    dependents = {}
-    for file in functions:
-        for file_path, line_no, function_name in functions[file]:
-            print(f"Changed Function: %s, File: %s, Line: %s" % 
-                  (function_name, file, line_no))
-                  
-   
-    return dependents
+    files = list(changd_lines.keys())
+    file_paths = [os.path.join(rootdir, file) for file in files]
+    all_extents = asyncio.run(
+        clangd_extents(rootdir, compile_commands_dir, file_paths, clangd))
 
-def generate_prompt(repo, commit, diff, functions, dependents):
-    prompt = io.StringIO()
+    functions = {}
+    for file, file_path, file_extents in zip(files, file_paths, all_extents):
+        if extents_by_file is not None:
+            extents_by_file[file] = file_extents
+        functions[file] = bu.functions_at_lines(
+            file_extents, file_path, changd_lines[file]
+        )
 
-    prompt.write(f"# {diff.new_path} 코드 리뷰 요청\n")
+    return functions
 
-    prompt.write("## 수정된 파일 내용입니다:\n")
+def find_dependents(functions, callgraph=None, max_depth=3, max_fanout=16,
+                    extents=None):
+    """
+    System resource 등을 통한 간접적인 의존성을 갖는 함수를 찾자.
 
-    prompt.write(repo.git.show(commit+":"+diff.new_path)+"\n")
+    callgraph(callgraphutil.CallGraph)가 주어지면 수정된 함수가 호출하는
+    함수들과, 수정된 함수를 max_depth 단계 안에서 호출하는 함수들을
+    찾는다. 함수마다 caller는 max_fanout개까지만 따라간다.
 
-    prompt.write(f"## 변경 내용에 대한 Unified Diff입니다:\n")
-    prompt.write(f"```diff\n{diff.diff_text}\n```\n")
+    수정된 함수는 이름만이 아니라 정의 위치로 찾는다. extents(파일 ->
+    function extent)가 있으면 함수 범위 안에 정의된 것을, 없으면 시작
+    라인 뒤의 가장 가까운 정의를 쓴다.
 
-    prompt.write(f"## 수정된 함수 목록입니다:\n")
+    Returns:
+        dict: pretty name -> {'callees': [pretty name],
+                              'callers': [(distance, pretty name)],
+                              'files': [그 함수가 바뀐 파일]}
+    """
+    dependents = {}
     for file in functions:
-        for file_path, line_no, function_name in functions[diff.new_path]:
-            prompt.write(f" * %s, File: %s, Line: %s\n" % 
-                          (function_name, file, line_no))
+        ends = {(e[2], e[0]): e[3] for e in (extents or {}).get(file) or []}
+        for file_path, line_no, function_name in functions[file]:
+            print(f"Changed Function: %s, File: %s, Line: %s" % 
+                  (function_name, file, line_no))
+            if callgraph is None:
+                continue
+            for pretty in callgraph.lookup_defined(
+                    function_name, file_path, line_no,
+                    ends.get((line_no, function_name))):
+                if pretty not in dependents:
+                    callers = callgraph.callers_within(pretty, max_depth,
+                                                       max_fanout)
+                    dependents[pretty] = {
+                        'callees': callgraph.callees(pretty),
+                        'callers': [(step.distance,
+                                     callgraph.pretty[step.symbol])
+                                    for step in callers],
+                        'files': [],
+                    }
+                if file not in dependents[pretty]['files']:
+                    dependents[pretty]['files'].append(file)
 
-    prompt.write(f"## Indirect Dependents:\n")
-    for function, calls in dependents.items():
-        prompt.write(f"%s 호출: %s\n" % 
-                     (function, ', '.join(calls) if calls else '없음'))
+    return dependents
 
-    str = prompt.getvalue()
-    prompt.close()
-    return str
+def function_bodies(lines, function_list, extents):
+    """수정된 함수들의 본문. extents가 없으면 빈 문자열."""
+    ranges = {(e[2], e[0]): e[3] for e in extents or []}
+    bodies = []
+    for file_path, line_no, function_name in function_list:
+        end_line = ranges.get((line_no, function_name))
+        if end_line is None:
+            continue
+        bodies.append('\n'.join(lines[line_no - 1:end_line]))
+    return '\n\n'.join(bodies)
+
+def build_prompt(repo, commit, diff, functions, dependents, extents=None,
+                 budget=None):
+    """
+    리뷰 prompt를 token 예산(budget) 안에서 조립한다.
 
-def ai_code_review(repo, commit, code_diffs, functions, dependents):
-        
-    client = OpenAI()
+    우선순위: 수정된 함수 목록과 본문, diff, call graph, 파일의 나머지 내용.
+    예산을 넘으면 뒤쪽 section부터 잘린다.
 
+    Returns:
+        promptutil.PromptBuilder: build()로 prompt를, report()로 section별
+                                  token 수를 얻는다.
+    """
+    content = repo.git.show(commit+":"+diff.new_path)
+    lines = content.split('\n')
+    function_list = functions.get(diff.new_path, [])
+
+    builder = promptutil.PromptBuilder(budget)
+
+    builder.add('title', "", f"# {diff.new_path} 코드 리뷰 요청\n")
+
+    builder.add('functions', "## 수정된 함수 목록입니다:\n", ''.join(
+        " * %s, File: %s, Line: %s\n" % (function_name, diff.new_path, line_no)
+        for file_path, line_no, function_name in function_list))
+
+    builder.add('bodies', "## 수정된 함수의 내용입니다:\n",
+                function_bodies(lines, function_list,
+                                (extents or {}).get(diff.new_path)),
+                fence='')
+
+    builder.add('diff', "## 변경 내용에 대한 Unified Diff입니다:\n",
+                diff.diff_text, fence='diff')
+
+    # 다른 파일에서 바뀐 함수의 caller/callee는 이 파일의 예산을 쓰지 않는다.
+    builder.add('callgraph', "## Indirect Dependents:\n", ''.join(
+        "%s 호출: %s\n%s 호출하는 함수 (거리): %s\n" % (
+            function,
+            ', '.join(deps['callees']) if deps['callees'] else '없음',
+            function,
+            ', '.join("%s (%d)" % (caller, distance)
+                      for distance, caller in deps['callers'])
+            if deps['callers'] else '없음')
+        for function, deps in dependents.items()
+        if diff.new_path in deps['files']))
+
+    builder.add('context', "## 수정된 파일 내용입니다:\n", content,
+                truncate=promptutil.keep_near(diffutil.changed_lines(diff)))
+
+    return builder
+
+def generate_prompt(repo, commit, diff, functions, dependents, extents=None,
+                    budget=None):
+    builder = build_prompt(repo, commit, diff, functions, dependents,
+                           extents, budget)
+    return builder.build()
+
+def ai_code_review(repo, commit, code_diffs, functions, dependents,
+                   dispatcher=None, extents=None, budget=None):
+    if dispatcher is None:
+        dispatcher = reviewutil.ReviewDispatcher()
+
+    prompts = []
     for diff in code_diffs:
-        prompt = generate_prompt(repo, commit, diff, functions, dependents)
+        builder = build_prompt(repo, commit, diff, functions, dependents,
+                               extents, budget)
+        prompt = builder.build()
         print("Prompt:\n")
         print(prompt)
-        
-        completion = client.chat.completions.create(
-            model="gpt-4o",
-            messages=[
-                    {"role": "system", 
-                     "content": "당신은 30년 경력의 Software 프로그래머입니다."},
-                    {"role": "user", "content": f"{prompt}"}
-                ]
-            )
+        print("Prompt tokens (%s): %s" % (diff.new_path, ', '.join(
+            "%s=%d/%d%s" % (name, used, total, ' truncated' if cut else '')
+            for name, used, total, cut in builder.report())),
+            file=sys.stderr)
+        prompts.append(prompt)
+
+    # 파일들을 동시에 리뷰하고 결과는 원래 파일 순서대로 출력한다.
+    reviews = dispatcher.run(prompts)
 
+    for diff, review in zip(code_diffs, reviews):
         # 응답 출력
         print("Code review response for file:", diff.new_path)
-        print(completion.choices[0].message.content)
+        if isinstance(review, Exception):
+            print(f"Error: {review}", file=sys.stderr)
+        else:
+            print(review)
 
 def parse_arguments():
     parser = argparse.ArgumentParser()
@@ -179,6 +387,126 @@ def parse_arguments():
         required=True
     )
 
+    parser.add_argument(
+        "--context-lines",
+        help="Lines of diff context around each change (git diff -U<n>)",
+        type=int,
+        default=3
+    )
+
+    parser.add_argument(
+        "--no-renames",
+        help="Do not detect renamed files in the diff",
+        action="store_true"
+    )
+
+    parser.add_argument(
+        "--cache-dir",
+        help="Directory for the function extent cache",
+        default=os.path.join(cacheutil.default_cache_dir(), 'functions')
+    )
+
+    parser.add_argument(
+        "--no-cache",
+        help="Always parse with libclang, bypassing the function extent cache",
+        action="store_true"
+    )
+
+    parser.add_argument(
+        "--parse-mode",
+        help="libclang parse mode for finding changed functions "
+             "(extents and single-file are faster, see buildutil.PARSE_MODES)",
+        choices=list(bu.PARSE_MODES),
+        default="full"
+    )
+
+    parser.add_argument(
+        "--function-backend",
+        help="Find changed functions with libclang or with clangd's "
+             "documentSymbol",
+        choices=["libclang", "clangd"],
+        default="libclang"
+    )
+
+    parser.add_argument(
+        "--clangd",
+        help="clangd executable for --function-backend clangd",
+        default="clangd"
+    )
+
+    parser.add_argument(
+        "--callgraph-db",
+        help="Callgraph store built by libclang-callgraph.py --db, or a "
+             "callgraph file written by its --export"
+    )
+
+    parser.add_argument(
+        "--caller-depth",
+        help="How many call levels above a changed function to report "
+             "as dependents (needs --callgraph-db)",
+        type=int,
+        default=3
+    )
+
+    parser.add_argument(
+        "--caller-fanout",
+        help="Callers followed per function when looking for dependents",
+        type=int,
+        default=16
+    )
+
+    parser.add_argument(
+        "--model",
+        help="Model used for code review",
+        default="gpt-4o"
+    )
+
+    parser.add_argument(
+        "--concurrency",
+        help="Number of review requests in flight at once",
+        type=int,
+        default=4
+    )
+
+    parser.add_argument(
+        "--rpm",
+        help="Request-per-minute budget for review requests",
+        type=int
+    )
+
+    parser.add_argument(
+        "--tpm",
+        help="Token-per-minute budget for review requests (estimated)",
+        type=int
+    )
+
+    parser.add_argument(
+        "--review-cache-dir",
+        help="Directory for cached code reviews "
+             "(shared with server.js --review-cache-dir)",
+        default=os.path.join(cacheutil.default_cache_dir(), 'reviews')
+    )
+
+    parser.add_argument(
+        "--review-cache-ttl",
+        help="Seconds a cached code review stays valid",
+        type=float,
+        default=7 * 24 * 60 * 60
+    )
+
+    parser.add_argument(
+        "--no-review-cache",
+        help="Always ask the model, bypassing the review cache",
+        action="store_true"
+    )
+
+    parser.add_argument(
+        "--prompt-budget",
+        help="Estimated token budget for each review prompt",
+        type=int,
+        default=16000
+    )
+
     args = parser.parse_args()
  
     if not os.path.exists(args.rootdir):
@@ -199,15 +527,64 @@ def parse_arguments():
 def main():
     args = parse_arguments()
     
-    compile_commands = bu.compile_commands_by_file(args.compile_commands)
+    compile_commands = bu.CompileDatabase(args.compile_commands)
 
     repo = Repo(args.rootdir)
 
-    code_diffs, changed_lines = get_git_diff(repo, args.commit1, args.commit2)
-
-    functions = find_functions(compile_commands, args.rootdir, changed_lines)
-    dependents = find_dependents(functions)
-    ai_code_review(repo, args.commit2, code_diffs, functions, dependents)
+    code_diffs, changed_lines = get_git_diff(repo, args.commit1, args.commit2,
+                                             args.context_lines,
+                                             not args.no_renames)
+
+    cache = None
+    if not args.no_cache:
+        cache = cacheutil.DiskCache(args.cache_dir)
+
+    extents = {}
+    if args.function_backend == 'clangd':
+        functions = find_functions_clangd(
+            os.path.dirname(os.path.abspath(args.compile_commands)),
+            args.rootdir, changed_lines, extents, args.clangd)
+    else:
+        include_graph = includeutil.IncludeGraph(
+            includeutil.include_graph_path(args.compile_commands))
+        functions = find_functions(compile_commands, args.rootdir,
+                                   changed_lines, cache, args.parse_mode,
+                                   extents, include_graph)
+        include_graph.save()
+    if cache is not None and args.function_backend == 'libclang':
+        print("Function cache: %(hits)d hits, %(misses)d misses" %
+              cache.stats(), file=sys.stderr)
+
+    callgraph = None
+    if args.callgraph_db:
+        if args.callgraph_db.endswith(callgraphfile.EXTENSION):
+            callgraph = callgraphfile.MappedCallGraph(args.callgraph_db)
+        else:
+            db = callgraphdb.CallGraphDB(args.callgraph_db)
+            callgraph = db.load_graph()
+            db.close()
+
+    dependents = find_dependents(functions, callgraph, args.caller_depth,
+                                 args.caller_fanout, extents)
+    review_cache = None
+    if not args.no_review_cache:
+        review_cache = cacheutil.DiskCache(args.review_cache_dir,
+                                           ttl=args.review_cache_ttl)
+
+    dispatcher = reviewutil.ReviewDispatcher(
+        model=args.model,
+        concurrency=args.concurrency,
+        rpm=args.rpm,
+        tpm=args.tpm,
+        cache=review_cache
+    )
+    ai_code_review(repo, args.commit2, code_diffs, functions, dependents,
+                   dispatcher, extents, args.prompt_budget)
+    if review_cache is not None:
+        stats = review_cache.stats()
+        print("Review cache: %d hits, %d misses, hit rate %.0f%%" %
+              (stats['hits'], stats['misses'], stats['hit_rate'] * 100),
+              file=sys.stderr)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,154 @@
+# promptutil.py
+
+import bisect
+
+from reviewutil import estimate_tokens
+
+
+def line_tokens(lines):
+    return [estimate_tokens(line + '\n') for line in lines]
+
+
+def keep_head(lines, budget):
+    """
+    앞에서부터 budget에 들어가는 줄까지 남긴다. 잘린 줄 수를 알리는 표시도
+    budget 안에 들어가야 하므로 필요하면 줄을 더 뺀다.
+    """
+    tokens = line_tokens(lines)
+    kept = []
+    used = 0
+    for line, n in zip(lines, tokens):
+        if used + n > budget:
+            break
+        kept.append(line)
+        used += n
+
+    while kept and len(kept) < len(lines):
+        marker = f"... ({len(lines) - len(kept)} lines truncated)"
+        if used + estimate_tokens(marker + '\n') <= budget:
+            return kept + [marker]
+        used -= tokens[len(kept) - 1]
+        kept.pop()
+    return kept
+
+
+def keep_near(focus):
+    """
+    focus(1부터 시작하는 라인 번호들)에 가까운 줄부터 budget만큼 남기는
+    truncate 함수를 만든다. 빠진 구간은 '...'으로 표시하고, 표시 줄도
+    budget에 센다.
+    """
+    def truncate(lines, budget):
+        if not focus:
+            return keep_head(lines, budget)
+
+        focus_index = sorted(n - 1 for n in focus)
+
+        def distance(i):
+            j = bisect.bisect_left(focus_index, i)
+            return min(abs(i - focus_index[k]) for k in (j - 1, j)
+                       if 0 <= k < len(focus_index))
+
+        # 거리가 같으면 앞쪽 줄이 먼저 - 결과가 항상 같도록
+        order = sorted(range(len(lines)), key=lambda i: (distance(i), i))
+        tokens = line_tokens(lines)
+        marker = estimate_tokens('...\n')
+        chosen = set()
+        used = 0
+        gaps = 1  # 남기지 않은 구간 수. 구간마다 '...' 한 줄이 들어간다.
+        for i in order:
+            # i를 남기면 i가 속한 구간이 양쪽에 남는 부분으로 나뉜다.
+            left = i > 0 and i - 1 not in chosen
+            right = i + 1 < len(lines) and i + 1 not in chosen
+            new_gaps = gaps - 1 + left + right
+            if used + tokens[i] + new_gaps * marker > budget:
+                break
+            chosen.add(i)
+            used += tokens[i]
+            gaps = new_gaps
+        if not chosen:
+            return []
+
+        kept = []
+        skipped = False
+        for i, line in enumerate(lines):
+            if i in chosen:
+                kept.append(line)
+                skipped = False
+            elif not skipped:
+                kept.append('...')
+                skipped = True
+        return kept
+
+    return truncate
+
+
+class PromptSection:
+    # truncate 함수는 남길 줄의 리스트를 돌려준다. 한 줄도 남길 수 없으면
+    # 빈 리스트를 돌려주고, 그러면 section 전체가 빠진다.
+    def __init__(self, name, heading, body, fence, truncate):
+        self.name = name
+        self.heading = heading
+        self.body = body
+        self.fence = fence
+        self.truncate = truncate
+        self.text = ''
+        self.original_tokens = estimate_tokens(self.render(body))
+        self.tokens = 0
+        self.truncated = False
+
+    def render(self, body):
+        if self.fence is None:
+            return self.heading + body
+        return f"{self.heading}```{self.fence}\n{body}\n```\n"
+
+    def fit(self, budget):
+        """budget 안에 들어가도록 본문을 자르고 실제 token 수를 기록한다."""
+        self.text = self.render(self.body)
+        if budget is not None and self.original_tokens > budget:
+            overhead = estimate_tokens(self.render(''))
+            lines = []
+            if overhead < budget:
+                lines = self.truncate(self.body.split('\n'),
+                                      budget - overhead)
+            self.text = self.render('\n'.join(lines)) if lines else ''
+            # truncate 함수가 예산을 넘겨 돌려주면 section을 넣지 않는다.
+            if estimate_tokens(self.text) > budget:
+                self.text = ''
+
+            self.truncated = True
+        self.tokens = estimate_tokens(self.text) if self.text else 0
+        return self.tokens
+
+
+class PromptBuilder:
+    """
+    token 예산 안에서 prompt를 조립한다.
+
+    section은 추가한 순서가 우선순위이다. 앞의 section부터 예산을 쓰고,
+    남은 예산보다 큰 section은 truncate 함수로 줄 단위로 잘라낸다.
+    budget이 None이면 자르지 않는다.
+    """
+
+    def __init__(self, budget=None):
+        self.budget = budget
+        self.sections = []
+
+    def add(self, name, heading, body, fence=None, truncate=keep_head):
+        if body is None or body == '':
+            return
+        self.sections.append(
+            PromptSection(name, heading, body, fence, truncate))
+
+    def build(self):
+        remaining = self.budget
+        for section in self.sections:
+            used = section.fit(remaining)
+            if remaining is not None:
+                remaining -= used
+        return ''.join(section.text for section in self.sections)
+
+    def report(self):
+        """section별 (이름, 사용한 token, 원래 token, 잘렸는지)"""
+        return [(s.name, s.tokens, s.original_tokens, s.truncated)
+                for s in self.sections]
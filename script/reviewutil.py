@@ -0,0 +1,202 @@
+# reviewutil.py
+
+import asyncio
+import random
+import time
+
+import openai
+from openai import AsyncOpenAI
+
+import cacheutil
+
+SYSTEM_MESSAGE = "당신은 30년 경력의 Software 프로그래머입니다."
+
+# 재시도할 HTTP status. 429(rate limit)와 서버 쪽 일시적인 오류들.
+RETRY_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504}
+
+
+def review_cache_key(model, system_message, prompt):
+    """
+    review cache의 키. server.js의 reviewCacheKey()와 같은 값을 만들어야
+    두 경로가 캐시를 함께 쓸 수 있다.
+    """
+    return cacheutil.hash_key('review', model, system_message, prompt)
+
+
+def estimate_tokens(text):
+    """tokenizer 없이 대략적인 token 수를 추정한다 (4 bytes ≈ 1 token)."""
+    return (len(text.encode('utf-8')) + 3) // 4
+
+
+class TokenBucket:
+    """분당 허용량을 초 단위로 채워 넣는 token bucket"""
+
+    def __init__(self, per_minute):
+        self.capacity = per_minute
+        self.tokens = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity,
+                          self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount):
+        """amount만큼 쓰려면 기다려야 하는 시간(초)"""
+        self._refill()
+        # 한 번에 capacity보다 많이 요청하면 영원히 기다리게 되므로 자른다.
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def consume(self, amount):
+        self.tokens -= min(amount, self.capacity)
+
+
+class RateLimiter:
+    """requests-per-minute, tokens-per-minute 예산을 함께 지키는 limiter"""
+
+    def __init__(self, rpm=None, tpm=None):
+        self.requests = TokenBucket(rpm) if rpm else None
+        self.tokens = TokenBucket(tpm) if tpm else None
+        self.lock = asyncio.Lock()
+
+    async def acquire(self, tokens):
+        budgets = [(bucket, amount) for bucket, amount in
+                   ((self.requests, 1), (self.tokens, tokens))
+                   if bucket is not None]
+        if not budgets:
+            return
+
+        # lock을 잡은 채로 기다려서 먼저 온 요청이 먼저 나가게 한다.
+        async with self.lock:
+            while True:
+                wait = max(bucket.wait_time(amount)
+                           for bucket, amount in budgets)
+                if wait <= 0:
+                    break
+                await asyncio.sleep(wait)
+            for bucket, amount in budgets:
+                bucket.consume(amount)
+
+
+def retry_delay(error, attempt, backoff, max_backoff):
+    """Retry-After header가 있으면 따르고, 없으면 jitter를 준 지수 backoff"""
+    response = getattr(error, 'response', None)
+    if response is not None:
+        retry_after = response.headers.get('retry-after')
+        if retry_after:
+            try:
+                return min(float(retry_after), max_backoff)
+            except ValueError:
+                pass
+    delay = min(backoff * (2 ** attempt), max_backoff)
+    return delay * (0.5 + random.random() / 2)
+
+
+def is_retryable(error):
+    if isinstance(error, (openai.APIConnectionError, openai.APITimeoutError)):
+        return True
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code in RETRY_STATUS_CODES or \
+            error.status_code >= 500
+    return False
+
+
+class ReviewDispatcher:
+    """
+    여러 prompt를 동시에 LLM에 보내는 비동기 review 엔진.
+
+    동시에 진행되는 요청 수를 concurrency로 제한하고, rpm/tpm 예산을
+    넘지 않도록 요청을 늦추며, 429/5xx는 backoff 후 다시 보낸다.
+    결과는 입력 prompt의 순서대로 돌려준다.
+
+    cache(cacheutil.DiskCache)가 주어지면 (model, system message, prompt)가
+    같은 요청은 보내지 않고 저장해 둔 review를 돌려준다.
+    """
+
+    def __init__(self, client=None, model="gpt-4o",
+                 system_message=SYSTEM_MESSAGE, concurrency=4, rpm=None,
+                 tpm=None, max_retries=5, backoff=1.0, max_backoff=60.0,
+                 cache=None):
+        self.client = client
+        self.cache = cache
+        self.model = model
+        self.system_message = system_message
+        self.concurrency = concurrency
+        self.rpm = rpm
+        self.tpm = tpm
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+
+    def messages(self, prompt):
+        return [
+            {"role": "system", "content": self.system_message},
+            {"role": "user", "content": f"{prompt}"}
+        ]
+
+    async def review(self, prompt, limiter=None):
+        key = None
+        if self.cache is not None:
+            key = review_cache_key(self.model, self.system_message, prompt)
+            cached = self.cache.get(key)
+            if cached is not None:
+                return cached['content']
+
+        content = await self.request_review(prompt, limiter)
+
+        if key is not None:
+            self.cache.put(key, {'model': self.model, 'content': content})
+        return content
+
+    async def request_review(self, prompt, limiter=None):
+        tokens = estimate_tokens(self.system_message) + estimate_tokens(prompt)
+        attempt = 0
+        while True:
+            if limiter is not None:
+                await limiter.acquire(tokens)
+            try:
+                completion = await self.client.chat.completions.create(
+                    model=self.model,
+                    messages=self.messages(prompt)
+                )
+                return completion.choices[0].message.content
+            except openai.APIError as e:
+                if attempt >= self.max_retries or not is_retryable(e):
+                    raise
+                await asyncio.sleep(retry_delay(e, attempt, self.backoff,
+                                                self.max_backoff))
+                attempt += 1
+
+    async def review_all(self, prompts):
+        """
+        Returns:
+            list: prompts와 같은 순서의 review. 실패한 요청은 예외 객체.
+        """
+        limiter = RateLimiter(self.rpm, self.tpm)
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def bounded(prompt):
+            async with semaphore:
+                return await self.review(prompt, limiter)
+
+        # client는 event loop에 묶이므로 loop마다 만들고 닫는다.
+        # 재시도는 여기서 직접 하므로 client의 자체 재시도는 끈다.
+        owns_client = self.client is None
+        if owns_client:
+            self.client = AsyncOpenAI(max_retries=0)
+        try:
+            return await asyncio.gather(*(bounded(p) for p in prompts),
+                                        return_exceptions=True)
+        finally:
+            if owns_client:
+                await self.client.close()
+                self.client = None
+
+    def run(self, prompts):
+        """review_all()의 동기 버전"""
+        return asyncio.run(self.review_all(prompts))
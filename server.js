@@ -1,5 +1,7 @@
 import express from 'express';
+import crypto from 'crypto';
 import fs from 'fs';
+import os from 'os';
 import path from 'path';
 import { fileURLToPath } from 'url';
 import OpenAI from 'openai';
@@ -10,7 +12,10 @@ const app = express();
 const port = 3000;
 
 const {values} = parseArgs({options: 
-                            {"compile-commands-dir": {type: 'string'}}});
+                            {"compile-commands-dir": {type: 'string'},
+                             "review-cache-dir": {type: 'string'},
+                             "review-cache-ttl": {type: 'string'},
+                             "no-review-cache": {type: 'boolean'}}});
 
 // 현재 모듈의 URL을 파일 경로로 변환
 const __filename = fileURLToPath(import.meta.url);
@@ -29,17 +34,129 @@ const client = new OpenAI ({
     apiKey: process.env['OPENAI_API_KEY'],
 });
 
+const REVIEW_MODEL = "gpt-4o";
+const REVIEW_SYSTEM_MESSAGE = "You are a helpful assistant that reviews code.";
+
+// script/cacheutil.py의 DiskCache와 같은 형식의 review cache.
+// 같은 디렉터리를 쓰면 plumbing.py와 캐시를 함께 쓸 수 있다.
+function defaultCacheDir() {
+    const base = process.env['XDG_CACHE_HOME'] ||
+                 path.join(os.homedir(), '.cache');
+    return path.join(base, 'lang_server');
+}
+
+const reviewCache = {
+    enabled: !values['no-review-cache'],
+    dir: values['review-cache-dir'] ||
+         path.join(defaultCacheDir(), 'reviews'),
+    // 초 단위. plumbing.py --review-cache-ttl과 같은 기본값(7일)
+    ttl: Number(values['review-cache-ttl'] || 7 * 24 * 60 * 60),
+    maxBytes: 64 * 1024 * 1024,
+    hits: 0,
+    misses: 0
+};
+
+// cacheutil.hash_key()와 같은 방식: 각 part의 UTF-8 길이와 ':'를 앞에 붙여 sha256
+function reviewCacheKey(model, systemMessage, prompt) {
+    const hash = crypto.createHash('sha256');
+    for (const part of ['review', model, systemMessage, prompt]) {
+        const buf = Buffer.from(part, 'utf8');
+        hash.update(`${buf.length}:`);
+        hash.update(buf);
+    }
+    return hash.digest('hex');
+}
+
+function reviewCachePath(key) {
+    return path.join(reviewCache.dir, `${key}.json`);
+}
+
+async function readCachedReview(key) {
+    const file = reviewCachePath(key);
+    try {
+        const st = await fs.promises.stat(file);
+        if (Date.now() / 1000 - st.mtimeMs / 1000 > reviewCache.ttl) {
+            await fs.promises.unlink(file);
+            reviewCache.misses++;
+            return null;
+        }
+        const value = JSON.parse(await fs.promises.readFile(file, 'utf8'));
+        // LRU: atime은 마지막 사용 시각, mtime은 TTL 용으로 둔다.
+        await fs.promises.utimes(file, new Date(), st.mtime);
+        reviewCache.hits++;
+        return value.content;
+    } catch (err) {
+        reviewCache.misses++;
+        return null;
+    }
+}
+
+async function evictReviewCache() {
+    const entries = [];
+    let total = 0;
+    for (const name of await fs.promises.readdir(reviewCache.dir)) {
+        if (!name.endsWith('.json')) {
+            continue;
+        }
+        const file = path.join(reviewCache.dir, name);
+        try {
+            const st = await fs.promises.stat(file);
+            entries.push({file, atime: st.atimeMs, size: st.size});
+            total += st.size;
+        } catch (err) {
+            // 다른 프로세스가 먼저 지운 경우
+        }
+    }
+
+    entries.sort((a, b) => a.atime - b.atime);
+    for (const entry of entries) {
+        if (total <= reviewCache.maxBytes) {
+            break;
+        }
+        await fs.promises.rm(entry.file, {force: true});
+        total -= entry.size;
+    }
+}
+
+async function writeCachedReview(key, value) {
+    await fs.promises.mkdir(reviewCache.dir, {recursive: true});
+    const tmp = path.join(reviewCache.dir,
+                          `${key}.${process.pid}.${Date.now()}.tmp`);
+    await fs.promises.writeFile(tmp, JSON.stringify(value));
+    await fs.promises.rename(tmp, reviewCachePath(key));
+    await evictReviewCache();
+}
+
 async function getCodeReview(fileContent) {
+    const prompt = `Please review the following code in Korean:\n\n${fileContent}`;
+
+    let key = null;
+    if (reviewCache.enabled) {
+        key = reviewCacheKey(REVIEW_MODEL, REVIEW_SYSTEM_MESSAGE, prompt);
+        const cached = await readCachedReview(key);
+        if (cached !== null) {
+            return cached;
+        }
+    }
+
     try {
         const completion = await client.chat.completions.create({
-            model: "gpt-4o",
+            model: REVIEW_MODEL,
             messages: [
-                { role: "system", content: "You are a helpful assistant that reviews code." },
-                { role: "user", content: `Please review the following code in Korean:\n\n${fileContent}` }
+                { role: "system", content: REVIEW_SYSTEM_MESSAGE },
+                { role: "user", content: prompt }
             ]
         });
 
-        return completion.choices[0].message.content;
+        const content = completion.choices[0].message.content;
+        if (key !== null) {
+            try {
+                await writeCachedReview(key, {model: REVIEW_MODEL, content});
+            } catch (err) {
+                console.error('Error writing review cache:', err);
+            }
+        }
+        return content;
     } catch (error) {
         console.error('Error calling OpenAI API:', error);
         return 'Error calling OpenAI API';
@@ -74,6 +191,18 @@ app.get('/filelist', (req, res) => {
     `);
 });
 
+// /review-cache-stats 경로로 요청이 들어오면 review cache 적중률을 JSON으로 응답
+app.get('/review-cache-stats', (req, res) => {
+    const lookups = reviewCache.hits + reviewCache.misses;
+    res.json({
+        enabled: reviewCache.enabled,
+        dir: reviewCache.dir,
+        hits: reviewCache.hits,
+        misses: reviewCache.misses,
+        hit_rate: lookups ? reviewCache.hits / lookups : 0
+    });
+});
+
 // 정적 파일 제공
 app.use(express.static(path.join(__dirname, 'public')));
 